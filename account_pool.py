@@ -0,0 +1,241 @@
+"""
+ModelScope 账号池
+config.py 中的 MODEL_SCOPE_COOKIES 可配置多个账号（未配置时只有 MODEL_SCOPE_COOKIE 一个），
+未指定Cookie的生图任务分配给负载最低的可用账号：先比进行中的任务数，再比这些任务的排队位置之和；
+提交时返回“会话已过期”的账号自动隔离 ACCOUNT_QUARANTINE_SECONDS 秒，期间不再分配任务。
+各账号的进行中任务、排队位置、过期次数与利用率在 /health 的 accounts 与 /metrics 中查看
+"""
+
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import config
+import metrics
+from modelscope_api import extract_csrf_token_enhanced
+
+MODEL_SCOPE_COOKIES = getattr(config, 'MODEL_SCOPE_COOKIES', [])                     # 账号列表，元素为Cookie字符串或 {'name', 'cookie'}
+ACCOUNT_QUARANTINE_SECONDS = getattr(config, 'ACCOUNT_QUARANTINE_SECONDS', 1800)     # 会话过期的账号隔离时间（秒）
+ACCOUNT_MAX_IN_FLIGHT = getattr(config, 'ACCOUNT_MAX_IN_FLIGHT', 0)                  # 每个账号同时进行的任务上限，0 表示不限
+ACCOUNT_TASK_OWNERS = 4096                                                           # 记住最近多少个任务ID所属的账号
+
+
+class NoAccountAvailable(RuntimeError):
+    """所有账号都已被隔离或达到并发上限"""
+
+
+class Account:
+    """一个 ModelScope 账号及其负载统计"""
+
+    def __init__(self, name: str, cookie: str):
+        self.name = name
+        self.cookie = cookie
+        self.csrf_token = extract_csrf_token_enhanced(cookie)
+        self.tasks: Dict[int, Optional[int]] = {}   # 占用ID -> 当前排队位置
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.expired = 0
+        self.quarantined_until = 0.0
+        self.created_at = time.monotonic()
+        self.busy_seconds = 0.0                     # 至少有一个进行中任务的累计时间
+        self._busy_since: Optional[float] = None
+
+    def is_quarantined(self, now: float) -> bool:
+        return now < self.quarantined_until
+
+    def load(self) -> Tuple[int, int]:
+        """(进行中的任务数, 排队位置之和)，越小越空闲"""
+        return len(self.tasks), sum(position or 0 for position in self.tasks.values())
+
+    def utilization(self, now: float) -> float:
+        """启动以来至少有一个进行中任务的时间占比"""
+        busy = self.busy_seconds + (now - self._busy_since if self._busy_since is not None else 0)
+        elapsed = now - self.created_at
+        return busy / elapsed if elapsed > 0 else 0.0
+
+    def _occupy(self, lease_id: int, now: float):
+        if not self.tasks:
+            self._busy_since = now
+        self.tasks[lease_id] = None
+
+    def _vacate(self, lease_id: int, now: float):
+        self.tasks.pop(lease_id, None)
+        if not self.tasks and self._busy_since is not None:
+            self.busy_seconds += now - self._busy_since
+            self._busy_since = None
+
+    def to_dict(self, now: float) -> Dict[str, Any]:
+        in_flight, queue_sum = self.load()
+        return {
+            'name': self.name,
+            'status': 'quarantined' if self.is_quarantined(now) else 'healthy',
+            'quarantine_remaining': round(max(self.quarantined_until - now, 0), 1),
+            'has_csrf_token': bool(self.csrf_token),
+            'in_flight': in_flight,
+            'queue_positions': sorted(position for position in self.tasks.values() if position),
+            'queue_position_sum': queue_sum,
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'failed': self.failed,
+            'expired': self.expired,
+            'utilization': round(self.utilization(now), 4),
+        }
+
+
+class Lease:
+    """一个任务对账号的占用：提交成功后 bind(task_id)，轮询时 update(排队位置)，结束时 release(outcome)"""
+
+    def __init__(self, pool: 'AccountPool', account: Account, lease_id: int):
+        self.pool = pool
+        self.account = account
+        self.lease_id = lease_id
+        self.task_id: Optional[str] = None
+        self.released = False
+
+    @property
+    def cookie(self) -> str:
+        return self.account.cookie
+
+    def bind(self, task_id: str):
+        self.pool._bind(self, task_id)
+
+    def update(self, queue_position: Optional[int]):
+        self.pool._update(self, queue_position)
+
+    def release(self, outcome: Optional[str] = None):
+        """outcome: completed / failed / timeout / expired；未提交成功就放弃的占用传 None"""
+        self.pool._release(self, outcome)
+
+
+class AccountPool:
+    """多个账号间分配生图任务，隔离会话过期的账号"""
+
+    def __init__(self, accounts: Iterable[Account], quarantine_seconds: float = ACCOUNT_QUARANTINE_SECONDS,
+                 max_in_flight: int = ACCOUNT_MAX_IN_FLIGHT):
+        self.accounts: List[Account] = list(accounts)
+        self.quarantine_seconds = quarantine_seconds
+        self.max_in_flight = max_in_flight
+        self._by_cookie = {account.cookie: account for account in self.accounts}
+        self._owners: 'OrderedDict[str, Account]' = OrderedDict()   # 任务ID -> 提交它的账号
+        self._next_lease = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls) -> 'AccountPool':
+        entries = MODEL_SCOPE_COOKIES or ([config.MODEL_SCOPE_COOKIE] if getattr(config, 'MODEL_SCOPE_COOKIE', '') else [])
+        accounts = []
+        for index, entry in enumerate(entries):
+            if isinstance(entry, dict):
+                name, cookie = entry.get('name') or f'account{index + 1}', entry.get('cookie', '')
+            else:
+                name, cookie = f'account{index + 1}', entry
+            if cookie:
+                accounts.append(Account(name, cookie))
+        return cls(accounts)
+
+    def acquire(self, exclude: Iterable[str] = ()) -> Lease:
+        """占用负载最低的可用账号，exclude 为本次已尝试过的账号名"""
+        exclude = set(exclude)
+        now = time.monotonic()
+        with self._lock:
+            candidates = [account for account in self.accounts
+                          if account.name not in exclude and not account.is_quarantined(now)
+                          and (not self.max_in_flight or len(account.tasks) < self.max_in_flight)]
+            if not candidates:
+                raise NoAccountAvailable('没有可用的ModelScope账号：Cookie均已过期或达到并发上限')
+            # 负载相同时选提交次数少的，使任务在账号间轮流分配
+            account = min(candidates, key=lambda candidate: (candidate.load(), candidate.submitted))
+            return self._lease(account, now)
+
+    def attach(self, cookie: str, task_id: Optional[str] = None) -> Optional[Lease]:
+        """为已提交的任务（如重启后恢复的任务）登记占用；Cookie不属于账号池时返回 None"""
+        account = self._by_cookie.get(cookie)
+        if account is None:
+            return None
+        with self._lock:
+            lease = self._lease(account, time.monotonic())
+            if task_id:
+                lease.task_id = task_id
+                self._remember(task_id, account)
+        return lease
+
+    def cookie_for_task(self, task_id: str) -> str:
+        """查询任务状态使用的Cookie：优先使用提交该任务的账号，其次是第一个未被隔离的账号"""
+        now = time.monotonic()
+        with self._lock:
+            account = self._owners.get(str(task_id))
+            if account is not None:
+                return account.cookie
+            for account in self.accounts:
+                if not account.is_quarantined(now):
+                    return account.cookie
+        return self.accounts[0].cookie if self.accounts else ''
+
+    def _lease(self, account: Account, now: float) -> Lease:
+        self._next_lease += 1
+        account._occupy(self._next_lease, now)
+        return Lease(self, account, self._next_lease)
+
+    def _remember(self, task_id: str, account: Account):
+        self._owners[str(task_id)] = account
+        self._owners.move_to_end(str(task_id))
+        while len(self._owners) > ACCOUNT_TASK_OWNERS:
+            self._owners.popitem(last=False)
+
+    def _bind(self, lease: Lease, task_id: str):
+        with self._lock:
+            lease.task_id = task_id
+            lease.account.submitted += 1
+            self._remember(task_id, lease.account)
+
+    def _update(self, lease: Lease, queue_position: Optional[int]):
+        with self._lock:
+            if lease.lease_id in lease.account.tasks:
+                lease.account.tasks[lease.lease_id] = queue_position or None
+
+    def _release(self, lease: Lease, outcome: Optional[str]):
+        now = time.monotonic()
+        with self._lock:
+            if lease.released:
+                return
+            lease.released = True
+            account = lease.account
+            account._vacate(lease.lease_id, now)
+            if outcome == 'completed':
+                account.completed += 1
+            elif outcome == 'expired':
+                account.expired += 1
+                account.quarantined_until = now + self.quarantine_seconds
+            elif outcome is not None:
+                account.failed += 1
+        if outcome == 'expired':
+            logging.warning(f'账号 {account.name} 的会话已过期，隔离{self.quarantine_seconds}秒，请更新其Cookie')
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            accounts = [account.to_dict(now) for account in self.accounts]
+        return {
+            'total': len(accounts),
+            'healthy': sum(1 for account in accounts if account['status'] == 'healthy'),
+            'accounts': accounts,
+        }
+
+    def _by_account(self, fn) -> Dict[tuple, float]:
+        now = time.monotonic()
+        with self._lock:
+            return {(account.name,): fn(account, now) for account in self.accounts}
+
+
+account_pool = AccountPool.from_config()
+metrics.Gauge('account_tasks_in_flight', '各账号进行中的生图任务数', ('account',),
+              fn=lambda: account_pool._by_account(lambda account, now: len(account.tasks)))
+metrics.Gauge('account_queue_position_sum', '各账号进行中任务的排队位置之和', ('account',),
+              fn=lambda: account_pool._by_account(lambda account, now: account.load()[1]))
+metrics.Gauge('account_quarantined', '账号是否因会话过期被隔离（1 为隔离中）', ('account',),
+              fn=lambda: account_pool._by_account(lambda account, now: int(account.is_quarantined(now))))
+metrics.Gauge('account_utilization', '账号启动以来至少有一个进行中任务的时间占比', ('account',),
+              fn=lambda: account_pool._by_account(lambda account, now: account.utilization(now)))
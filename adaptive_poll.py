@@ -0,0 +1,128 @@
+"""
+自适应轮询间隔
+根据排队位置 (taskQueue.currentPosition) 与观测到的进度速度 (progress.percent) 估算剩余时间：
+排队靠后时很少查询，接近完成时密集查询；查询失败时指数退避，所有间隔都加随机抖动。
+同时统计相对固定间隔轮询节省了多少次状态查询
+"""
+
+import math
+import time
+import random
+import logging
+import threading
+from collections import deque
+from typing import Dict, Optional, Any
+
+import config
+
+POLL_MIN_INTERVAL = getattr(config, 'POLL_MIN_INTERVAL', 1.0)        # 最短轮询间隔（秒）
+POLL_MAX_INTERVAL = getattr(config, 'POLL_MAX_INTERVAL', 20.0)       # 最长轮询间隔（秒）
+POLL_ETA_FRACTION = getattr(config, 'POLL_ETA_FRACTION', 0.5)        # 下次轮询安排在预计剩余时间的多少比例处
+POLL_SECONDS_PER_POSITION = getattr(config, 'POLL_SECONDS_PER_POSITION', 10.0)  # 尚未观测到队列移动时，每个排队位置的预估耗时
+POLL_JITTER = getattr(config, 'POLL_JITTER', 0.2)                    # 抖动比例，避免大量任务同时查询
+POLL_HISTORY = 5                                                     # 估算速度时使用的最近样本数
+
+
+def _rate(samples) -> float:
+    """最近样本的变化速度（每秒）"""
+    if len(samples) < 2:
+        return 0.0
+    (t0, v0), (t1, v1) = samples[0], samples[-1]
+    return (v1 - v0) / (t1 - t0) if t1 > t0 else 0.0
+
+
+class AdaptiveInterval:
+    """单个任务的轮询节奏：每次查询后调用 update() 或 failed()，再用 next_delay() 取下次间隔"""
+
+    def __init__(self, baseline: float, min_interval: float = POLL_MIN_INTERVAL,
+                 max_interval: float = POLL_MAX_INTERVAL, jitter: float = POLL_JITTER):
+        self.baseline = baseline        # 对照的固定轮询间隔
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.jitter = jitter
+        self.started = time.monotonic()
+        self.polls = 0
+        self.errors = 0                 # 连续失败次数
+        self.percent = 0
+        self.queue_position: Optional[int] = None
+        self._progress = deque(maxlen=POLL_HISTORY)
+        self._queue = deque(maxlen=POLL_HISTORY)
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def update(self, percent: Optional[float] = None, queue_position: Optional[int] = None):
+        """记录一次成功的状态查询"""
+        now = time.monotonic()
+        self.polls += 1
+        self.errors = 0
+        self.queue_position = queue_position or None
+        if self.queue_position:
+            self._queue.append((now, self.queue_position))
+        else:
+            self._queue.clear()
+        if percent is not None:
+            self.percent = percent
+            self._progress.append((now, percent))
+
+    def failed(self):
+        """记录一次失败的状态查询"""
+        self.polls += 1
+        self.errors += 1
+
+    def eta(self) -> Optional[float]:
+        """预计剩余时间（秒），无法估算时返回 None"""
+        if self.queue_position:
+            # 队列前进速度：位置每秒减少多少，尚未观测到前进时使用先验值
+            advance = -_rate(self._queue)
+            if advance <= 0:
+                advance = 1 / POLL_SECONDS_PER_POSITION
+            return self.queue_position / advance
+        velocity = _rate(self._progress)
+        if velocity > 0:
+            return max(100 - self.percent, 0) / velocity
+        return None
+
+    def next_delay(self) -> float:
+        if self.errors:
+            delay = self.baseline * (2 ** (self.errors - 1))
+        else:
+            eta = self.eta()
+            delay = self.baseline if eta is None else eta * POLL_ETA_FRACTION
+        delay = min(max(delay, self.min_interval), self.max_interval)
+        delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        return max(delay, self.min_interval)
+
+    def baseline_polls(self) -> int:
+        """同样时长内按固定间隔轮询需要的查询次数"""
+        return max(1, math.ceil(self.elapsed() / self.baseline))
+
+
+class PollSavings:
+    """汇总已结束任务的查询次数与固定间隔基线的对比"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {'tasks': 0, 'polls': 0, 'baseline_polls': 0}
+
+    def record(self, pacer: AdaptiveInterval, task_id: str = ''):
+        baseline = pacer.baseline_polls()
+        with self._lock:
+            self._stats['tasks'] += 1
+            self._stats['polls'] += pacer.polls
+            self._stats['baseline_polls'] += baseline
+        logging.info(f'任务 {task_id} 轮询结束：查询{pacer.polls}次，固定{pacer.baseline}秒间隔需{baseline}次，'
+                     f'节省{baseline - pacer.polls}次')
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            tasks = self._stats['tasks']
+            saved = self._stats['baseline_polls'] - self._stats['polls']
+            return {
+                **self._stats,
+                'saved': saved,
+                'saved_per_task': round(saved / tasks, 2) if tasks else 0.0
+            }
+
+
+poll_savings = PollSavings()
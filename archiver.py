@@ -0,0 +1,181 @@
+"""
+生成结果归档模块
+任务完成后把图片与 <task_id>.json 写入 out_pic 的工作放到独立的后台队列中执行，
+HTTP 响应在拿到图片URL后即可返回；队列有上限以形成背压，失败的下载按指数退避重试
+"""
+
+import os
+import json
+import time
+import queue
+import logging
+import threading
+from typing import Dict, List, Optional, Any
+
+from flask import Blueprint, jsonify
+
+import config
+from config import out_pic
+from downloader import download_images
+from history_index import history_index
+from poll_scheduler import poll_scheduler
+
+ARCHIVE_WORKERS = getattr(config, 'ARCHIVE_WORKERS', 2)                  # 归档线程数
+ARCHIVE_QUEUE_SIZE = getattr(config, 'ARCHIVE_QUEUE_SIZE', 200)          # 队列上限，满时入队方阻塞等待
+ARCHIVE_ENQUEUE_TIMEOUT = getattr(config, 'ARCHIVE_ENQUEUE_TIMEOUT', 5)  # 入队最长等待时间（秒），超时则放弃归档
+ARCHIVE_MAX_RETRIES = getattr(config, 'ARCHIVE_MAX_RETRIES', 3)          # 下载失败时的最大重试次数
+ARCHIVE_RETRY_BACKOFF = getattr(config, 'ARCHIVE_RETRY_BACKOFF', 5)      # 首次重试等待时间（秒），之后翻倍
+
+archive_bp = Blueprint('archive', __name__)
+
+
+def archive_task_result(task_id: str, images: List[str], prompt_text: str = '', request_id: str = '',
+                        pending: Optional[List[str]] = None) -> List[str]:
+    """
+    下载任务图片到 out_pic/<task_id>/ 并写入 <task_id>.json
+
+    Args:
+        images: 任务的全部图片URL，写入JSON
+        pending: 本次需要下载的URL，默认为全部图片
+
+    Returns:
+        List[str]: 下载失败的URL
+    """
+    task_folder = os.path.join(out_pic, task_id)
+    results = download_images(images if pending is None else pending, task_folder)
+    failed = [r['url'] for r in results if not r['success']]
+
+    json_data = {
+        'id': task_id,
+        'requestId': request_id,
+        'prompt': prompt_text,
+        'reverse_image': '',  # 生成图片接口没有原始图片URL
+        'url': images
+    }
+
+    json_file = os.path.join(task_folder, f"{task_id}.json")
+    with open(json_file, 'w', encoding='utf-8') as f:
+        json.dump(json_data, f, ensure_ascii=False, indent=2)
+    history_index.add(task_id, json_data)
+
+    logging.info(f"任务 {task_id} 归档完成，保存了{len(results) - len(failed)}张图片和JSON文档")
+    return failed
+
+
+class ArchiveItem:
+    def __init__(self, task_id: str, images: List[str], prompt_text: str, request_id: str):
+        self.task_id = task_id
+        self.images = images
+        self.prompt_text = prompt_text
+        self.request_id = request_id
+        self.pending = list(images)
+        self.attempts = 0
+        self.enqueued_at = time.time()
+
+
+class Archiver:
+    """后台归档器：有界队列 + 固定数量的工作线程"""
+
+    def __init__(self, workers: int = ARCHIVE_WORKERS, queue_size: int = ARCHIVE_QUEUE_SIZE):
+        self._queue: 'queue.Queue[ArchiveItem]' = queue.Queue(maxsize=queue_size)
+        self._workers = workers
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._outstanding: Dict[str, float] = {}   # task_id -> 首次入队时间
+        self._stats = {'enqueued': 0, 'completed': 0, 'failed': 0, 'dropped': 0, 'retries': 0}
+        self._last_lag = 0.0
+
+    def enqueue(self, task_id: str, images: List[str], prompt_text: str = '', request_id: str = '') -> bool:
+        """提交归档任务；队列满时最多阻塞 ARCHIVE_ENQUEUE_TIMEOUT 秒，仍无空位则放弃"""
+        self._ensure_workers()
+        item = ArchiveItem(task_id, images, prompt_text, request_id)
+        with self._lock:
+            self._outstanding[task_id] = item.enqueued_at
+        if not self._put(item, ARCHIVE_ENQUEUE_TIMEOUT):
+            logging.error(f'归档队列已满，放弃归档任务 {task_id}')
+            with self._lock:
+                self._outstanding.pop(task_id, None)
+                self._stats['dropped'] += 1
+            return False
+        with self._lock:
+            self._stats['enqueued'] += 1
+        return True
+
+    def status(self) -> Dict[str, Any]:
+        """归档进度：队列深度、积压的最老任务等待时长等"""
+        now = time.time()
+        with self._lock:
+            oldest = min(self._outstanding.values()) if self._outstanding else None
+            return {
+                **self._stats,
+                'queue_depth': self._queue.qsize(),
+                'queue_capacity': self._queue.maxsize,
+                'outstanding': len(self._outstanding),
+                'oldest_pending_seconds': round(now - oldest, 3) if oldest else 0,
+                'last_lag_seconds': round(self._last_lag, 3)
+            }
+
+    def _put(self, item: ArchiveItem, timeout: Optional[float]) -> bool:
+        try:
+            self._queue.put(item, timeout=timeout)
+            return True
+        except queue.Full:
+            return False
+
+    def _ensure_workers(self):
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            for i in range(self._workers - len(self._threads)):
+                t = threading.Thread(target=self._work, name=f'archiver-{i}', daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            try:
+                self._process(item)
+            except Exception as e:
+                logging.error(f'归档任务 {item.task_id} 异常: {e}')
+                self._retry_or_fail(item)
+            finally:
+                self._queue.task_done()
+
+    def _process(self, item: ArchiveItem):
+        item.attempts += 1
+        item.pending = archive_task_result(item.task_id, item.images, item.prompt_text, item.request_id, item.pending)
+        if item.pending:
+            self._retry_or_fail(item)
+        else:
+            self._finish(item, 'completed')
+
+    def _retry_or_fail(self, item: ArchiveItem):
+        if item.attempts > ARCHIVE_MAX_RETRIES:
+            logging.error(f'归档任务 {item.task_id} 重试{ARCHIVE_MAX_RETRIES}次后仍失败，未下载: {item.pending}')
+            self._finish(item, 'failed')
+            return
+
+        delay = ARCHIVE_RETRY_BACKOFF * (2 ** (item.attempts - 1))
+        with self._lock:
+            self._stats['retries'] += 1
+
+        def requeue() -> Optional[float]:
+            # 已接受的任务不丢弃：队列满时稍后再试
+            return None if self._put(item, 0) else ARCHIVE_RETRY_BACKOFF
+
+        poll_scheduler.watch(requeue, delay)
+
+    def _finish(self, item: ArchiveItem, outcome: str):
+        with self._lock:
+            self._outstanding.pop(item.task_id, None)
+            self._stats[outcome] += 1
+            self._last_lag = time.time() - item.enqueued_at
+
+
+archiver = Archiver()
+
+
+@archive_bp.route('/archive/status', methods=['GET'])
+def archive_status():
+    """归档队列状态，用于观察归档落后多少"""
+    return jsonify({'success': True, **archiver.status()})
@@ -0,0 +1,229 @@
+"""
+ASGI 服务入口
+与 create_app 提供相同的接口：/health、/reverse_image、/api/generate_image、/poll_task、/task_status/<task_id>
+在事件循环中处理，等待 ModelScope 排队、下载图片与调用 Qwen3-VL 时不占用线程，
+对外请求共用一个 httpx.AsyncClient；其余接口（上传、任务、归档等）原样转交给 Flask 应用。
+响应内容与 Flask 版本由 routes.py / task_poller.py 中的同一组函数生成
+
+启动：python web_app.py --server asgi
+只能以单进程运行：上传暂存、生图任务表、合并中的请求、账号占用与隔离、令牌桶都保存在进程内
+依赖（可选）：pip install -r requirements-asgi.txt
+"""
+
+import asyncio
+import contextlib
+from typing import Dict, Optional, Tuple
+
+import config
+import metrics
+from config import OPENAI_API_KEY
+from account_pool import account_pool
+from adaptive_poll import AdaptiveInterval, poll_savings
+from image_analyzer import image_analyzer
+from image_buffer import download_image_async
+from jobs import submit_generate_job
+from log_setup import get_logger
+from modelscope_api import STATUS_URL
+from routes import (GENERATE_WAIT_TIMEOUT, generate_job_response, generate_request_error,
+                    generate_status_only_response, health_payload)
+from task_poller import create_task_poller, poll_task_response, polls_in_flight, task_status_response
+from upstream_guard import UpstreamRejected, status_guard
+from web_app import create_app
+
+try:
+    import httpx
+    from starlette.applications import Starlette
+    from starlette.middleware import Middleware
+    from starlette.middleware.cors import CORSMiddleware
+    from starlette.responses import JSONResponse
+    from starlette.routing import Mount, Route
+except ImportError:   # 可选依赖，只有 --server asgi 时需要
+    httpx = None
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:
+    try:
+        from starlette.middleware.wsgi import WSGIMiddleware
+    except ImportError:
+        WSGIMiddleware = None
+
+ASYNC_HTTP_MAX_CONNECTIONS = getattr(config, 'ASYNC_HTTP_MAX_CONNECTIONS', 100)   # 最大并发连接数
+ASYNC_HTTP_KEEPALIVE = getattr(config, 'ASYNC_HTTP_KEEPALIVE', 20)                # 保持的空闲连接数
+ASYNC_WSGI_THREADS = getattr(config, 'ASYNC_WSGI_THREADS', 10)                    # 转交给Flask的请求使用的线程数
+
+logger = get_logger('asgi')
+
+
+async def _poll_numeric_async(client, poller, task_id: str, max_attempts: int, interval: float) -> Tuple[bool, Dict]:
+    """ModelScopeTaskPoller.poll_task_with_numeric_id 的异步版本，间隔之间 await asyncio.sleep；同样最多查询 max_attempts 次"""
+    url = f"{STATUS_URL}?taskId={task_id}"
+    pacer = AdaptiveInterval(interval)
+    phases = metrics.TaskPhases('async_poller')
+    result = None
+    attempt = 0
+
+    polls_in_flight.inc()
+    try:
+        while True:
+            try:
+                response = await status_guard.call_async(lambda: client.get(url, headers=poller.headers, timeout=30))
+                response.raise_for_status()
+                result = poller.interpret_status(response.json(), task_id, attempt, pacer, phases)
+            except (httpx.HTTPError, UpstreamRejected, ValueError) as e:
+                poller.poll_failed(task_id, e, pacer, phases)
+            attempt += 1
+            if result is not None or attempt >= max_attempts or pacer.elapsed() >= max_attempts * interval:
+                break
+            await asyncio.sleep(pacer.next_delay())
+    finally:
+        polls_in_flight.dec()
+
+    poll_savings.record(pacer, task_id)
+    phases.finish('timeout' if result is None else 'completed' if result[0] else 'failed')
+    if result is None:
+        logger.warning("⏰ 任务 %s 轮询超时", task_id)
+        return False, {'error': '轮询超时', 'timeout': True}
+    return result
+
+
+async def poll_task_async(client, poller, task_id: str, id_type: str = 'auto', max_attempts: int = 60,
+                          interval: float = 5) -> Tuple[bool, Dict]:
+    """ModelScopeTaskPoller.poll_task_with_fallback 的异步版本"""
+    logger.info("🔄 开始智能轮询任务 %s (类型: %s)", task_id, id_type)
+    id_type = poller.resolve_id_type(task_id, id_type)
+    if id_type == 'numeric':
+        return poller.numeric_result(task_id, *await _poll_numeric_async(client, poller, task_id, max_attempts, interval))
+    return poller.unsupported_id_result(task_id, id_type)
+
+
+async def _json_body(request) -> Optional[Dict]:
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+async def health(request):
+    return JSONResponse(health_payload())
+
+
+async def reverse_image(request):
+    data = await _json_body(request) or {}
+    image_url = data.get('image_url')
+
+    if not image_url:
+        return JSONResponse({'success': False, 'message': '缺少图片URL！'})
+
+    try:
+        # 下载图片到内存缓冲区，分析完成后立即释放
+        with await download_image_async(request.app.state.http, image_url) as buf:
+            success, result = await image_analyzer.analyze_async(
+                buf.view(), api_key=OPENAI_API_KEY, force_refresh=data.get('force_refresh', False))
+
+        if success:
+            return JSONResponse({'success': True, 'prompt': result})
+        return JSONResponse({'success': False, 'error': result})
+    except Exception as e:
+        return JSONResponse({'success': False, 'error': str(e)})
+
+
+async def generate_image(request):
+    try:
+        data = await _json_body(request)
+        if data is None:
+            return JSONResponse({'success': False, 'error': '请求体不是有效的JSON'})
+        error = generate_request_error(data)
+        if error:
+            return JSONResponse(error)
+
+        logger.info('开始生成图片，提示词: %.50s', data['prompt'])
+
+        if data.get('check_status_only', False):
+            return JSONResponse(generate_status_only_response())
+
+        # 提交只是登记任务并交给提交线程池，不会阻塞事件循环
+        job = submit_generate_job(data)
+        logger.info("🚀 已提交生图任务，本地任务ID: %s", job.job_id)
+
+        if data.get('async'):
+            return JSONResponse({'success': True, 'job_id': job.job_id, 'status': job.status})
+
+        # 同步模式：由后台轮询器推进任务，这里只挂起协程等待结束通知
+        return JSONResponse(generate_job_response(job, await job.wait_done(GENERATE_WAIT_TIMEOUT)))
+
+    except Exception as e:
+        logger.error('生成图片时出错: %s', e)
+        return JSONResponse({'success': False, 'error': f'生成图片时出错: {e}'})
+
+
+async def poll_task(request):
+    data = await _json_body(request) or {}
+    task_id = data.get('task_id')
+
+    if not task_id:
+        return JSONResponse({'success': False, 'error': '缺少任务ID'})
+
+    try:
+        poller = create_task_poller(account_pool.cookie_for_task(task_id))
+        success, result_data = await poll_task_async(
+            request.app.state.http, poller, task_id,
+            id_type=data.get('id_type', 'auto'),
+            max_attempts=data.get('max_attempts', 60),
+            interval=data.get('interval', 5)
+        )
+        return JSONResponse(poll_task_response(poller, task_id, success, result_data))
+
+    except Exception as e:
+        logger.error('智能轮询任务 %s 异常: %s', task_id, e)
+        return JSONResponse({'success': False, 'error': f'轮询异常: {str(e)}'})
+
+
+async def task_status(request):
+    task_id = request.path_params['task_id']
+    try:
+        poller = create_task_poller(account_pool.cookie_for_task(task_id))
+        success, result_data = await poll_task_async(request.app.state.http, poller, task_id,
+                                                     max_attempts=1, interval=1)
+        return JSONResponse(task_status_response(success, result_data))
+
+    except Exception as e:
+        logger.error('获取任务状态 %s 异常: %s', task_id, e)
+        return JSONResponse({'status': 'failed', 'error': f'获取任务状态异常: {str(e)}'})
+
+
+def create_async_app(resume_jobs: bool = True):
+    """
+    创建 ASGI 应用（供 uvicorn --factory 使用）
+    resume_jobs: 是否恢复重启前未完成的生图任务
+    """
+    if httpx is None or WSGIMiddleware is None:
+        raise RuntimeError('ASGI 服务需要额外的依赖：pip install -r requirements-asgi.txt')
+
+    flask_app = create_app(resume_jobs=resume_jobs)
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        limits = httpx.Limits(max_connections=ASYNC_HTTP_MAX_CONNECTIONS,
+                              max_keepalive_connections=ASYNC_HTTP_KEEPALIVE)
+        async with httpx.AsyncClient(limits=limits, follow_redirects=True) as client:
+            app.state.http = client
+            yield
+
+    if WSGIMiddleware.__module__.startswith('a2wsgi'):
+        wsgi = WSGIMiddleware(flask_app, workers=ASYNC_WSGI_THREADS)
+    else:
+        wsgi = WSGIMiddleware(flask_app)
+
+    routes = [
+        Route('/health', health, methods=['GET']),
+        Route('/reverse_image', reverse_image, methods=['POST']),
+        Route('/api/generate_image', generate_image, methods=['POST']),
+        Route('/poll_task', poll_task, methods=['POST']),
+        Route('/task_status/{task_id}', task_status, methods=['GET']),
+        # 其余接口仍由 Flask 处理
+        Mount('/', app=wsgi),
+    ]
+    middleware = [Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['GET', 'POST', 'OPTIONS'],
+                             allow_headers=['Content-Type', 'X-Requested-With'])]
+    return Starlette(routes=routes, middleware=middleware, lifespan=lifespan)
@@ -0,0 +1,301 @@
+"""
+批量生图模块
+POST /api/generate_batch 接收一组 提示词/模型/尺寸 规格（每条可带多组LoRA组合），
+展开为多个生图任务，由限速、限并发的提交器逐个提交，所有任务共用 jobs.py 的共享轮询器跟踪；
+GET /api/generate_batch/<batch_id> 返回随任务进度实时更新的汇总状态
+"""
+
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from collections import deque
+from functools import lru_cache
+from typing import Dict, List, Optional, Any
+
+from flask import Blueprint, request, jsonify
+
+import config
+from config import DEFAULT_WIDTH, DEFAULT_HEIGHT, model_info
+from account_pool import account_pool
+from jobs import job_manager, Job, JOB_RETENTION, STATUS_COMPLETED, STATUS_FAILED
+from poll_scheduler import poll_scheduler
+from modelscope_api import DEFAULT_PROMPT_PREFIX, build_txt2img_request_body
+
+BATCH_MAX_ITEMS = getattr(config, 'BATCH_MAX_ITEMS', 200)          # 单个批次展开后的最大任务数
+BATCH_MAX_IN_FLIGHT = getattr(config, 'BATCH_MAX_IN_FLIGHT', 4)    # 同时在ModelScope排队/生成中的批量任务数
+BATCH_SUBMIT_RATE = getattr(config, 'BATCH_SUBMIT_RATE', 0.5)      # 每秒最多提交的任务数
+BATCH_IDLE_CHECK = 1.0                                             # 达到并发上限时，再次检查的间隔（秒）
+
+MODEL_CATALOG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'comfyui_modelscope')
+
+STATUS_QUEUED = 'QUEUED'   # 尚未提交到ModelScope
+
+batch_bp = Blueprint('batch', __name__)
+
+
+@lru_cache(maxsize=None)
+def _load_catalog(filename: str) -> List[Dict]:
+    try:
+        with open(os.path.join(MODEL_CATALOG_DIR, filename), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logging.error(f'读取模型列表 {filename} 失败: {e}')
+        return []
+
+
+def resolve_lora(lora, default_scale: float = 1) -> Optional[Dict]:
+    """LoRA可以是 loraArgs.json 中的 LoraName、model_info 中的名称，或包含 modelVersionId 的字典"""
+    if isinstance(lora, dict):
+        if not lora.get('modelVersionId'):
+            return None
+        return {
+            'loraName': lora.get('LoraName') or lora.get('loraName', ''),
+            'modelVersionId': lora['modelVersionId'],
+            'scale': lora.get('scale', default_scale)
+        }
+    name = str(lora).strip()
+    for item in _load_catalog('loraArgs.json'):
+        if item.get('LoraName') == name:
+            return {'loraName': name, 'modelVersionId': item['modelVersionId'], 'scale': item.get('scale', default_scale)}
+    if name in model_info:
+        return {'loraName': name, 'modelVersionId': model_info[name]['id'], 'scale': default_scale}
+    return None
+
+
+def resolve_checkpoint(checkpoint) -> Optional[Dict]:
+    """Checkpoint可以是 checkpoint.json 中的 CheckpointName、model_info 中的名称，或完整的字典"""
+    if isinstance(checkpoint, dict):
+        return checkpoint if checkpoint.get('checkpointModelVersionId') else None
+    name = str(checkpoint).strip()
+    for item in _load_catalog('checkpoint.json'):
+        if name in (item.get('CheckpointName'), item.get('checkpointShowInfo')):
+            return item
+    if name in model_info:
+        return {'checkpointModelVersionId': model_info[name]['id'], 'checkpointShowInfo': name}
+    return None
+
+
+def build_batch_request_body(spec: Dict, loras: List) -> Dict:
+    """根据一条规格与一组LoRA构建请求体，未找到的模型名称抛出 ValueError"""
+    lora_args = []
+    for lora in loras:
+        resolved = resolve_lora(lora)
+        if not resolved:
+            raise ValueError(f'未找到LoRA: {lora}')
+        lora_args.append(resolved)
+
+    checkpoint = None
+    if spec.get('checkpoint'):
+        checkpoint = resolve_checkpoint(spec['checkpoint'])
+        if not checkpoint:
+            raise ValueError(f"未找到Checkpoint: {spec['checkpoint']}")
+
+    model_args = {
+        'checkpointModelVersionId': checkpoint['checkpointModelVersionId'] if checkpoint else 275167,
+        'checkpointShowInfo': checkpoint.get('checkpointShowInfo', '') if checkpoint else "Qwen_Image_v1.safetensors",
+        'loraArgs': lora_args,
+        'predictType': "TXT_2_IMG"
+    }
+    body = build_txt2img_request_body(
+        DEFAULT_PROMPT_PREFIX + spec['prompt'],
+        spec.get('width', DEFAULT_WIDTH),
+        spec.get('height', DEFAULT_HEIGHT),
+        model_args=model_args,
+        negative_prompt=spec.get('negative_prompt', ''),
+        num_images=spec.get('num_images', 4)
+    )
+    # 不同Checkpoint推荐的步数与引导系数不同
+    if checkpoint:
+        for key in ('numInferenceSteps', 'guidanceScale'):
+            if key in checkpoint:
+                body['basicDiffusionArgs'][key] = checkpoint[key]
+    return body
+
+
+class BatchItem:
+    """批次中的一个任务：一条规格 × 一组LoRA"""
+
+    def __init__(self, index: int, spec: Dict, loras: List, request_body: Dict):
+        self.index = index
+        self.spec = spec
+        self.loras = loras
+        self.request_body = request_body
+        self.job: Optional[Job] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        item = {
+            'index': self.index,
+            'prompt': self.spec['prompt'],
+            'checkpoint': self.spec.get('checkpoint'),
+            'loras': [lora['loraName'] for lora in self.request_body['modelArgs']['loraArgs']],
+            'width': self.request_body['basicDiffusionArgs']['width'],
+            'height': self.request_body['basicDiffusionArgs']['height'],
+        }
+        if self.job is None:
+            item.update({'job_id': None, 'task_id': None, 'status': STATUS_QUEUED, 'progress': 0,
+                         'queue_position': None, 'images': [], 'error': None})
+        else:
+            job = self.job.to_dict()
+            item.update({key: job[key] for key in
+                         ('job_id', 'task_id', 'status', 'progress', 'queue_position', 'images', 'error')})
+        return item
+
+
+class Batch:
+    def __init__(self, cookie: str, items: List[BatchItem]):
+        self.batch_id = uuid.uuid4().hex
+        self.cookie = cookie
+        self.items = items
+        self.created_at = time.time()
+
+    @property
+    def is_finished(self) -> bool:
+        return all(item.job is not None and item.job.is_terminal for item in self.items)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """汇总状态文档，每次查询都根据各任务的最新状态生成"""
+        items = [item.to_dict() for item in self.items]
+        counts = {'queued': 0, 'running': 0, 'completed': 0, 'failed': 0}
+        for item in items:
+            if item['status'] == STATUS_QUEUED:
+                counts['queued'] += 1
+            elif item['status'] == STATUS_COMPLETED:
+                counts['completed'] += 1
+            elif item['status'] == STATUS_FAILED:
+                counts['failed'] += 1
+            else:
+                counts['running'] += 1
+        updated_at = max([self.created_at] + [item.job.updated_at for item in self.items if item.job])
+        return {
+            'batch_id': self.batch_id,
+            'status': 'COMPLETED' if self.is_finished else 'RUNNING',
+            'total': len(items),
+            **counts,
+            'progress': round(sum(item['progress'] or 0 for item in items) / len(items), 1) if items else 100,
+            'images': [url for item in items for url in item['images']],
+            'created_at': self.created_at,
+            'updated_at': updated_at,
+            'items': items
+        }
+
+
+class BatchSubmitter:
+    """
+    批量任务提交器：所有批次的待提交任务排成一个FIFO队列，
+    按 BATCH_SUBMIT_RATE 限速、按 BATCH_MAX_IN_FLIGHT 限制同时进行的任务数，
+    提交节奏由共享轮询调度器驱动，不额外占用线程
+    """
+
+    def __init__(self, max_in_flight: int = BATCH_MAX_IN_FLIGHT, submit_rate: float = BATCH_SUBMIT_RATE):
+        self.max_in_flight = max_in_flight
+        self.submit_interval = 1 / submit_rate if submit_rate > 0 else 0
+        self._pending: 'deque[tuple]' = deque()
+        self._running: List[BatchItem] = []
+        self._batches: Dict[str, Batch] = {}
+        self._lock = threading.Lock()
+        self._pumping = False
+
+    def create(self, cookie: str, items: List[BatchItem]) -> Batch:
+        batch = Batch(cookie, items)
+        with self._lock:
+            self._evict_finished()
+            self._batches[batch.batch_id] = batch
+            self._pending.extend((batch, item) for item in items)
+            start = not self._pumping
+            self._pumping = True
+        if start:
+            poll_scheduler.watch(self._pump)
+        return batch
+
+    def get(self, batch_id: str) -> Optional[Batch]:
+        with self._lock:
+            return self._batches.get(batch_id)
+
+    def stats(self) -> Dict[str, int]:
+        """待提交、进行中的任务数与内存中的批次数，在 /health 的 batches 中查看"""
+        with self._lock:
+            in_flight = sum(1 for item in self._running if not item.job.is_terminal)
+            return {'pending': len(self._pending), 'in_flight': in_flight, 'batches': len(self._batches)}
+
+    def _pump(self) -> Optional[float]:
+        """提交下一个任务，返回下次检查的间隔；队列为空时停止"""
+        with self._lock:
+            self._running = [item for item in self._running if not item.job.is_terminal]
+            if not self._pending:
+                self._pumping = False
+                return None
+            if len(self._running) >= self.max_in_flight:
+                return BATCH_IDLE_CHECK
+            batch, item = self._pending.popleft()
+        # 登记任务要写 task_store，不持锁进行，避免批次查询等在提交后面；
+        # 提交节奏只有一条调度链，取出与放回之间不会有其他 _pump 插入
+        job = job_manager.submit(batch.cookie, item.request_body, coalesce=False)
+        with self._lock:
+            item.job = job
+            self._running.append(item)
+        logging.info(f'批次 {batch.batch_id} 提交第{item.index + 1}/{len(batch.items)}个任务: {item.job.job_id}')
+        return self.submit_interval
+
+    def _evict_finished(self):
+        cutoff = time.time() - JOB_RETENTION
+        expired = [batch_id for batch_id, batch in self._batches.items()
+                   if batch.is_finished and batch.created_at < cutoff]
+        for batch_id in expired:
+            del self._batches[batch_id]
+
+
+batch_submitter = BatchSubmitter()
+
+
+def expand_specs(specs: List[Dict]) -> List[BatchItem]:
+    """把规格列表展开为任务：每条规格的 loras 是LoRA组合列表，每个组合生成一个任务"""
+    items = []
+    for spec in specs:
+        if not isinstance(spec, dict) or not spec.get('prompt'):
+            raise ValueError('每条规格都需要提供prompt')
+        combos = spec.get('loras') or [[]]
+        for combo in combos:
+            combo = combo if isinstance(combo, list) else [combo]
+            items.append(BatchItem(len(items), spec, combo, build_batch_request_body(spec, combo)))
+    return items
+
+
+@batch_bp.route('/api/generate_batch', methods=['POST'])
+def generate_batch():
+    """
+    批量提交生图任务，立即返回批次ID与初始状态
+
+    请求体: {"specs": [{"prompt": "...", "checkpoint": "Qwen_Image_v1", "loras": [["FEIFEI"], ["GUA", "GUA_V2"]],
+                        "width": 928, "height": 1664, "num_images": 4}]}
+    """
+    data = request.get_json(silent=True) or {}
+    specs = data.get('specs')
+    if not isinstance(specs, list) or not specs:
+        return jsonify({'success': False, 'error': '请提供specs列表'})
+
+    # 未指定cookie时每个任务由账号池分配账号
+    cookie = data.get('cookie') or ''
+    if not cookie and not account_pool.accounts:
+        return jsonify({'success': False, 'error': 'Cookie未配置，请在config.py中设置MODEL_SCOPE_COOKIE'})
+
+    try:
+        items = expand_specs(specs)
+    except (ValueError, TypeError) as e:
+        return jsonify({'success': False, 'error': str(e)})
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({'success': False, 'error': f'任务数{len(items)}超过上限{BATCH_MAX_ITEMS}'})
+
+    batch = batch_submitter.create(cookie, items)
+    return jsonify({'success': True, **batch.to_dict()})
+
+
+@batch_bp.route('/api/generate_batch/<batch_id>', methods=['GET'])
+def get_batch(batch_id):
+    """查询批次汇总状态"""
+    batch = batch_submitter.get(batch_id)
+    if not batch:
+        return jsonify({'success': False, 'error': '批次不存在或已过期'}), 404
+    return jsonify({'success': True, **batch.to_dict()})
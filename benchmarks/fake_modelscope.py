@@ -0,0 +1,305 @@
+"""
+本地 ModelScope 替身服务
+模拟生图的提交/状态查询接口、图片CDN与 Qwen3-VL 反推接口（OpenAI 兼容的 /v1/chat/completions），
+响应结构与真实接口一致（{"Code":200,"Data":{"data":{...}},"Success":true}），压测时不消耗魔搭额度。
+排队按 workers 个生成槽位先到先得模拟，进度曲线、生成耗时与各类失败比例均可配置；
+GET /_fake/stats 返回各接口的调用次数，POST /_fake/reset 清零
+
+用法：
+    python benchmarks/fake_modelscope.py --port 9100 --workers 4 --processing-time 8 --fail-rate 0.05
+然后在 config.py 中设置：
+    MODELSCOPE_BASE_URL = 'http://127.0.0.1:9100'
+    ANALYZER_BASE_URL = 'http://127.0.0.1:9100/v1'
+"""
+
+import io
+import json
+import math
+import time
+import heapq
+import random
+import argparse
+import threading
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional
+
+from PIL import Image
+from flask import Flask, Response, jsonify, request
+
+PROGRESS_CURVES = ('linear', 'ease', 'stall')
+
+FAKE_PROMPT = '这是一副专业人像摄影作品，室内自然光线柔和，中景构图，一个亚洲女人坐在窗边，画面干净，细节真实。'
+
+
+@dataclass
+class FakeSettings:
+    """替身服务的行为参数"""
+    workers: int = 4                    # 同时生成的任务数，超出的任务排队
+    backlog: int = 0                    # 启动时已在排队的其他用户任务数（按 processing_time 依次消化）
+    processing_time: float = 5.0        # 单个任务的生成耗时（秒）
+    jitter: float = 0.2                 # 生成耗时的随机浮动比例
+    progress_curve: str = 'linear'      # linear / ease（先慢后快再慢）/ stall（长时间停在90%附近）
+    images_per_task: int = 4
+    image_size: int = 512               # CDN 返回图片的边长（像素）
+    fail_rate: float = 0.0              # 任务最终失败（status=FAILED）的比例
+    expired_rate: float = 0.0           # 提交时返回“会话已过期”的比例
+    expired_cookie: str = ''            # Cookie中包含该字符串的账号提交时总是返回“会话已过期”
+    submit_error_rate: float = 0.0      # 提交接口返回 HTTP 500 的比例
+    status_error_rate: float = 0.0      # 状态接口返回 HTTP 503 的比例
+    submit_latency: float = 0.05        # 提交接口的响应延迟（秒）
+    status_latency: float = 0.02        # 状态接口的响应延迟（秒）
+    analyze_latency: float = 1.0        # 反推接口的响应延迟（秒）
+    seed: Optional[int] = None
+
+
+@dataclass
+class FakeTask:
+    task_id: int
+    submitted_at: float
+    started_at: float
+    finished_at: float
+    fails: bool
+    request_id: str
+    prompt: str = ''
+    reported: bool = False   # 结束状态是否已计入统计
+
+
+def progress_at(curve: str, fraction: float) -> int:
+    """生成进度（0-99），fraction 为已生成时间占总耗时的比例"""
+    fraction = min(max(fraction, 0.0), 1.0)
+    if curve == 'ease':
+        fraction = fraction * fraction * (3 - 2 * fraction)
+    elif curve == 'stall':
+        fraction = min(fraction * 1.8, 0.9) if fraction < 0.95 else fraction
+    return min(int(fraction * 100), 99)
+
+
+class FakeModelScope:
+    """任务表与调用计数"""
+
+    def __init__(self, settings: FakeSettings):
+        self.settings = settings
+        self.random = random.Random(settings.seed)
+        self._lock = threading.Lock()
+        self._tasks: Dict[int, FakeTask] = {}
+        self._next_id = 10_000_000
+        self._slots: List[float] = []
+        self._calls: Dict[str, int] = {}
+        self._image_cache: Dict[int, bytes] = {}
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            now = time.time()
+            self._tasks.clear()
+            self._calls = {'submit': 0, 'status': 0, 'cdn': 0, 'cdn_bytes': 0, 'analyze': 0,
+                           'tasks': 0, 'completed': 0, 'failed': 0}
+            # 每个槽位在消化完分到的积压任务后空闲
+            per_slot = self.settings.backlog / max(self.settings.workers, 1)
+            self._slots = [now + per_slot * self.settings.processing_time] * max(self.settings.workers, 1)
+            heapq.heapify(self._slots)
+
+    def count(self, name: str, amount: int = 1):
+        with self._lock:
+            self._calls[name] = self._calls.get(name, 0) + amount
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._calls)
+
+    def chance(self, rate: float) -> bool:
+        return rate > 0 and self.random.random() < rate
+
+    def submit(self, prompt: str) -> FakeTask:
+        settings = self.settings
+        now = time.time()
+        duration = settings.processing_time * (1 + self.random.uniform(-settings.jitter, settings.jitter))
+        with self._lock:
+            slot_free = heapq.heappop(self._slots)
+            started = max(now, slot_free)
+            finished = started + duration
+            heapq.heappush(self._slots, finished)
+            self._next_id += 1
+            task = FakeTask(task_id=self._next_id, submitted_at=now, started_at=started, finished_at=finished,
+                            fails=self.chance(settings.fail_rate), request_id=f'req-{self._next_id}',
+                            prompt=prompt)
+            self._tasks[task.task_id] = task
+            self._calls['tasks'] += 1
+        return task
+
+    def get(self, task_id: int) -> Optional[FakeTask]:
+        with self._lock:
+            return self._tasks.get(task_id)
+
+    def queue_position(self, task: FakeTask, now: float) -> int:
+        """排在该任务前面的任务数：按剩余等待时间与槽位数估算（含启动时的积压）"""
+        per_task = max(self.settings.processing_time, 0.001) / max(self.settings.workers, 1)
+        return max(math.ceil((task.started_at - now) / per_task), 1)
+
+    def image(self, seed: int) -> bytes:
+        """按 seed 生成一张纯色PNG，相同 seed 返回相同内容"""
+        with self._lock:
+            data = self._image_cache.get(seed)
+        if data is None:
+            size = self.settings.image_size
+            color = ((seed * 53) % 256, (seed * 97) % 256, (seed * 193) % 256)
+            img = Image.new('RGB', (size, size), color)
+            img.putpixel((seed % size, (seed // size) % size), (255, 255, 255))
+            out = io.BytesIO()
+            img.save(out, 'PNG')
+            data = out.getvalue()
+            with self._lock:
+                if len(self._image_cache) < 1024:
+                    self._image_cache[seed] = data
+        return data
+
+
+def _task_data(fake: FakeModelScope, task: FakeTask, base_url: str) -> Dict:
+    now = time.time()
+    settings = fake.settings
+    data = {'taskId': task.task_id, 'requestId': task.request_id, 'progress': {'percent': 0, 'detail': ''}}
+    if now < task.started_at:
+        position = fake.queue_position(task, now)
+        data['status'] = 'QUEUING'
+        data['taskQueue'] = {'currentPosition': position, 'total': position + settings.workers}
+        data['progress']['detail'] = f'排队中，前面还有{position}个任务'
+    elif now < task.finished_at:
+        fraction = (now - task.started_at) / max(task.finished_at - task.started_at, 0.001)
+        data['status'] = 'PROCESSING'
+        data['progress']['percent'] = progress_at(settings.progress_curve, fraction)
+        data['progress']['detail'] = '生成中'
+    elif task.fails:
+        data['status'] = 'FAILED'
+        data['errorMsg'] = '模拟的生成失败'
+    else:
+        data['status'] = 'SUCCEED'
+        data['progress']['percent'] = 100
+        data['predictResult'] = {'images': [
+            {'imageUrl': f'{base_url}/cdn/{task.task_id}/{n}.png', 'prompt': task.prompt}
+            for n in range(settings.images_per_task)
+        ]}
+    return data
+
+
+def _ok(data: Dict, request_id: str) -> Response:
+    return jsonify({'Code': 200, 'Data': data, 'RequestId': request_id, 'Success': True})
+
+
+def create_fake_app(settings: Optional[FakeSettings] = None) -> Flask:
+    """创建替身服务，FakeModelScope 实例保存在 app.config['FAKE']"""
+    fake = FakeModelScope(settings or FakeSettings())
+    app = Flask(__name__)
+    app.config['FAKE'] = fake
+
+    @app.route('/api/v1/muse/predict/task/submit', methods=['POST'])
+    def submit():
+        fake.count('submit')
+        time.sleep(fake.settings.submit_latency)
+        if fake.chance(fake.settings.submit_error_rate):
+            return jsonify({'Code': 500, 'Message': '模拟的服务端错误', 'Success': False}), 500
+        body = request.get_json(silent=True) or {}
+        request_id = f'req-{fake.random.getrandbits(48):012x}'
+        expired_cookie = fake.settings.expired_cookie
+        if fake.chance(fake.settings.expired_rate) or (expired_cookie and expired_cookie in request.headers.get('Cookie', '')):
+            return _ok({'code': 10010, 'message': '会话已过期，请重新登录'}, request_id)
+        prompt = (body.get('promptArgs') or {}).get('prompt', '')
+        task = fake.submit(prompt)
+        return _ok({'code': 0, 'data': {'taskId': task.task_id, 'requestId': task.request_id}, 'success': True},
+                   request_id)
+
+    @app.route('/api/v1/muse/predict/task/status', methods=['GET'])
+    def status():
+        fake.count('status')
+        time.sleep(fake.settings.status_latency)
+        if fake.chance(fake.settings.status_error_rate):
+            return jsonify({'Code': 503, 'Message': '模拟的网关错误', 'Success': False}), 503
+        task_id = request.args.get('taskId', '')
+        if not task_id.isdigit():
+            return jsonify({'Code': 40000, 'Data': {'message': f'java.lang.NumberFormatException: {task_id}'},
+                            'Success': False})
+        task = fake.get(int(task_id))
+        if task is None:
+            return jsonify({'Code': 404, 'Message': '任务不存在', 'Success': False}), 404
+        data = _task_data(fake, task, request.host_url.rstrip('/'))
+        if data['status'] in ('SUCCEED', 'FAILED') and not task.reported:
+            task.reported = True
+            fake.count('completed' if data['status'] == 'SUCCEED' else 'failed')
+        return _ok({'code': 0, 'data': data, 'success': True}, task.request_id)
+
+    @app.route('/cdn/<int:task_id>/<int:n>.png', methods=['GET'])
+    def cdn(task_id, n):
+        data = fake.image(task_id * 16 + n)
+        fake.count('cdn')
+        fake.count('cdn_bytes', len(data))
+        return Response(data, mimetype='image/png')
+
+    @app.route('/cdn/source/<int:seed>.png', methods=['GET'])
+    def source_image(seed):
+        """压测反推接口用的原图，不同 seed 的图片内容不同（不会命中反推缓存）"""
+        data = fake.image(1_000_000 + seed)
+        fake.count('cdn')
+        fake.count('cdn_bytes', len(data))
+        return Response(data, mimetype='image/png')
+
+    @app.route('/v1/chat/completions', methods=['POST'])
+    def chat_completions():
+        fake.count('analyze')
+        body = request.get_json(silent=True) or {}
+        time.sleep(fake.settings.analyze_latency)
+        created = int(time.time())
+        if body.get('stream'):
+            def generate():
+                for i in range(0, len(FAKE_PROMPT), 8):
+                    chunk = {'id': 'chatcmpl-fake', 'object': 'chat.completion.chunk', 'created': created,
+                             'model': body.get('model', ''),
+                             'choices': [{'index': 0, 'delta': {'content': FAKE_PROMPT[i:i + 8]}, 'finish_reason': None}]}
+                    yield f'data: {json.dumps(chunk, ensure_ascii=False)}\n\n'
+                yield 'data: [DONE]\n\n'
+            return Response(generate(), mimetype='text/event-stream')
+        return jsonify({
+            'id': 'chatcmpl-fake', 'object': 'chat.completion', 'created': created, 'model': body.get('model', ''),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': FAKE_PROMPT}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}
+        })
+
+    @app.route('/_fake/stats', methods=['GET'])
+    def fake_stats():
+        return jsonify({'calls': fake.stats(), 'settings': asdict(fake.settings)})
+
+    @app.route('/_fake/reset', methods=['POST'])
+    def fake_reset():
+        fake.reset()
+        return jsonify({'success': True})
+
+    return app
+
+
+def add_settings_arguments(parser: argparse.ArgumentParser):
+    """把 FakeSettings 的字段注册为命令行参数（load_test.py 复用）"""
+    defaults = FakeSettings()
+    for name, value in asdict(defaults).items():
+        option = '--' + name.replace('_', '-')
+        if name == 'progress_curve':
+            parser.add_argument(option, choices=PROGRESS_CURVES, default=value)
+        elif name == 'seed':
+            parser.add_argument(option, type=int, default=value)
+        else:
+            parser.add_argument(option, type=type(value), default=value)
+
+
+def settings_from_args(args: argparse.Namespace) -> FakeSettings:
+    return FakeSettings(**{name: getattr(args, name) for name in asdict(FakeSettings())})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地 ModelScope 替身服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9100)
+    add_settings_arguments(parser)
+    args = parser.parse_args()
+    app = create_fake_app(settings_from_args(args))
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+"""
+端到端压测
+以固定并发驱动 /api/generate_image、/process_image_complete 或 /reverse_image，
+上游全部由 fake_modelscope.py 替身服务提供，报告 p50/p95/p99 延迟、每秒请求数与每个任务的上游调用次数
+
+用法：
+    # 在本进程内启动替身服务与本服务（数据写入临时目录，不影响 config.py 中的路径）
+    python benchmarks/load_test.py --endpoint generate_image --concurrency 8 --requests 64 --processing-time 3
+    # 压测已经在运行的服务，该服务的 config.py 需指向同一个替身服务
+    python benchmarks/load_test.py --target http://127.0.0.1:8005 --fake http://127.0.0.1:9100 --endpoint reverse_image
+"""
+
+import io
+import os
+import sys
+import json
+import math
+import logging
+import time
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import requests
+from PIL import Image
+from werkzeug.serving import make_server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.fake_modelscope import FakeSettings, add_settings_arguments, create_fake_app, settings_from_args
+
+ENDPOINTS = ('generate_image', 'process_image_complete', 'reverse_image')
+BENCH_COOKIE = 'csrf_token=bench; session=bench'
+UPSTREAM_CALLS = ('submit', 'status', 'cdn', 'analyze')
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """最近秩百分位数，sorted_values 须已排序"""
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(p / 100 * len(sorted_values)), 1)
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def start_server(app, host: str = '127.0.0.1', port: int = 0) -> Tuple[Any, str]:
+    """在后台线程中启动WSGI服务，port 为0时自动分配端口"""
+    # 每个请求一行的访问日志会淹没压测输出
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server(host, port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name=f'bench-server-{server.port}', daemon=True).start()
+    return server, f'http://{host}:{server.port}'
+
+
+def start_in_process(settings: FakeSettings, poll_interval: float,
+                     accounts: int = 1) -> Tuple[str, str, Callable[[], None]]:
+    """
+    启动替身服务，并让本服务的各模块指向它后在同一进程中启动；accounts 为账号池中的账号数
+
+    Returns:
+        Tuple[服务地址, 替身服务地址, 关闭函数]
+    """
+    fake_server, fake_url = start_server(create_fake_app(settings))
+
+    # 必须在导入 web_app 之前覆盖，各模块在导入时读取配置
+    import config
+    workdir = tempfile.mkdtemp(prefix='aigc-bench-')
+    overrides = {
+        'MODELSCOPE_BASE_URL': fake_url,
+        'ANALYZER_BASE_URL': f'{fake_url}/v1',
+        'MODEL_SCOPE_COOKIE': BENCH_COOKIE,
+        'MODEL_SCOPE_COOKIES': [{'name': f'bench{i + 1}', 'cookie': f'{BENCH_COOKIE}; account=bench{i + 1}'}
+                                for i in range(accounts)],
+        'OPENAI_API_KEY': 'bench',
+        'out_pic': os.path.join(workdir, 'out_pic'),
+        'UPLOAD_FOLDER': os.path.join(workdir, 'uploads'),
+        'PROMPT_CACHE_PATH': os.path.join(workdir, 'prompt_cache.sqlite3'),
+        'TASK_STORE_PATH': os.path.join(workdir, 'tasks.sqlite3'),
+        'HISTORY_INDEX_PATH': os.path.join(workdir, 'history.sqlite3'),
+        'THUMB_CACHE_DIR': os.path.join(workdir, 'thumbs'),
+        'JOB_POLL_INTERVAL': poll_interval,
+        'LOG_LEVEL': 'WARNING',
+    }
+    for name, value in overrides.items():
+        setattr(config, name, value)
+
+    from web_app import create_app
+    app_server, app_url = start_server(create_app(resume_jobs=False))
+
+    def shutdown():
+        app_server.shutdown()
+        fake_server.shutdown()
+
+    print(f'替身服务: {fake_url}  本服务: {app_url}  数据目录: {workdir}')
+    return app_url, fake_url, shutdown
+
+
+def make_png(seed: int, size: int = 256) -> bytes:
+    img = Image.new('RGB', (size, size), ((seed * 31) % 256, (seed * 67) % 256, (seed * 131) % 256))
+    img.putpixel((seed % size, 0), (255, 255, 255))
+    out = io.BytesIO()
+    img.save(out, 'PNG')
+    return out.getvalue()
+
+
+def build_request(endpoint: str, index: int, target: str, fake: str, same_payload: bool) -> Dict[str, Any]:
+    """第 index 个请求的参数；默认每个请求内容不同，不会被请求合并或反推缓存吸收"""
+    seed = 0 if same_payload else index
+    if endpoint == 'generate_image':
+        return {'method': 'POST', 'url': f'{target}/api/generate_image', 'json': {'prompt': f'压测提示词 {seed}'}}
+    if endpoint == 'reverse_image':
+        return {'method': 'POST', 'url': f'{target}/reverse_image',
+                'json': {'image_url': f'{fake}/cdn/source/{seed}.png'}}
+    return {'method': 'POST', 'url': f'{target}/process_image_complete',
+            'files': {'file': (f'bench_{seed}.png', make_png(seed), 'image/png')},
+            'data': {'json_data': json.dumps({'openai_api_key': 'bench'})}}
+
+
+def run_load(endpoint: str, target: str, fake: str, concurrency: int, total: int,
+             duration: Optional[float] = None, same_payload: bool = False, timeout: float = 600) -> Dict[str, Any]:
+    """以 concurrency 个并发发送 total 个请求（指定 duration 时改为持续发送 duration 秒）"""
+    lock = threading.Lock()
+    state = {'next': 0}
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    deadline = time.monotonic() + duration if duration else None
+
+    def take() -> Optional[int]:
+        with lock:
+            if deadline is None and state['next'] >= total:
+                return None
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            state['next'] += 1
+            return state['next'] - 1
+
+    def worker():
+        session = requests.Session()
+        while True:
+            index = take()
+            if index is None:
+                return
+            kwargs = build_request(endpoint, index, target, fake, same_payload)
+            started = time.monotonic()
+            try:
+                response = session.request(timeout=timeout, **kwargs)
+                body = response.json()
+                error = None if response.ok and body.get('success') else str(body.get('error') or response.status_code)
+            except Exception as e:
+                error = type(e).__name__
+            elapsed = time.monotonic() - started
+            with lock:
+                if error is None:
+                    latencies.append(elapsed)
+                else:
+                    errors[error[:80]] = errors.get(error[:80], 0) + 1
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    wall = time.monotonic() - started
+
+    latencies.sort()
+    failed = sum(errors.values())
+    return {
+        'endpoint': endpoint,
+        'concurrency': concurrency,
+        'requests': len(latencies) + failed,
+        'succeeded': len(latencies),
+        'failed': failed,
+        'errors': errors,
+        'seconds': round(wall, 3),
+        'rps': round((len(latencies) + failed) / wall, 3) if wall else 0.0,
+        'latency': {
+            'p50': round(percentile(latencies, 50), 3),
+            'p95': round(percentile(latencies, 95), 3),
+            'p99': round(percentile(latencies, 99), 3),
+            'max': round(latencies[-1], 3) if latencies else 0.0,
+            'mean': round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+        },
+    }
+
+
+def upstream_per_task(calls: Dict[str, int], requests_sent: int) -> Dict[str, float]:
+    """每个任务（生图接口按替身服务登记的任务数，反推接口按请求数）的上游调用次数"""
+    tasks = calls.get('tasks') or requests_sent
+    return {name: round(calls.get(name, 0) / tasks, 2) if tasks else 0.0 for name in UPSTREAM_CALLS}
+
+
+def print_report(report: Dict[str, Any]):
+    latency = report['latency']
+    print(f"\n== {report['endpoint']}  并发 {report['concurrency']} ==")
+    print(f"请求 {report['requests']}（成功 {report['succeeded']}，失败 {report['failed']}），"
+          f"耗时 {report['seconds']}s，{report['rps']} req/s")
+    print(f"延迟(s)  p50 {latency['p50']}  p95 {latency['p95']}  p99 {latency['p99']}  "
+          f"max {latency['max']}  mean {latency['mean']}")
+    if report.get('upstream'):
+        per_task = report['upstream_per_task']
+        print('上游调用  ' + '  '.join(f'{name} {report["upstream"].get(name, 0)}' for name in UPSTREAM_CALLS)
+              + f"  任务 {report['upstream'].get('tasks', 0)}")
+        print('每任务    ' + '  '.join(f'{name} {value}' for name, value in per_task.items()))
+    for account in report.get('accounts', []):
+        print(f"账号 {account['name']:<10} {account['status']:<11} 提交 {account['submitted']}  完成 {account['completed']}  "
+              f"失败 {account['failed']}  过期 {account['expired']}  利用率 {account['utilization']:.0%}")
+    for error, count in report['errors'].items():
+        print(f'  失败 ×{count}: {error}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='端到端压测（上游为本地替身服务）')
+    parser.add_argument('--endpoint', choices=ENDPOINTS, default='generate_image')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=32, help='请求总数')
+    parser.add_argument('--duration', type=float, default=None, help='持续压测的秒数，指定后忽略 --requests')
+    parser.add_argument('--same-payload', action='store_true', help='所有请求内容相同，用于观察请求合并与缓存的效果')
+    parser.add_argument('--target', default=None, help='已运行的服务地址，不指定时在本进程内启动')
+    parser.add_argument('--fake', default=None, help='已运行的替身服务地址（与 --target 一起使用）')
+    parser.add_argument('--poll-interval', type=float, default=1.0, help='进程内启动时的 JOB_POLL_INTERVAL')
+    parser.add_argument('--accounts', type=int, default=1, help='进程内启动时账号池中的账号数')
+    parser.add_argument('--settle', type=float, default=1.0, help='压测结束后等待后台归档下载的秒数')
+    parser.add_argument('--json', dest='json_path', default=None, help='把报告写入JSON文件')
+    add_settings_arguments(parser)
+    args = parser.parse_args()
+
+    shutdown = None
+    if args.target:
+        if not args.fake:
+            parser.error('--target 需要同时指定 --fake')
+        target, fake = args.target.rstrip('/'), args.fake.rstrip('/')
+    else:
+        target, fake, shutdown = start_in_process(settings_from_args(args), args.poll_interval, args.accounts)
+
+    try:
+        requests.post(f'{fake}/_fake/reset', timeout=10)
+        report = run_load(args.endpoint, target, fake, args.concurrency, args.requests, args.duration,
+                          args.same_payload)
+        time.sleep(args.settle)
+        calls = requests.get(f'{fake}/_fake/stats', timeout=10).json()['calls']
+        report['upstream'] = calls
+        report['upstream_per_task'] = upstream_per_task(calls, report['requests'])
+        report['accounts'] = requests.get(f'{target}/health', timeout=10).json().get('accounts', {}).get('accounts', [])
+    finally:
+        if shutdown:
+            shutdown()
+
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,315 @@
+"""
+热路径微基准
+不访问网络，用 fixtures/ 中记录的 ModelScope 响应作为输入，测量响应解析与字段提取、CSRF Token 提取、
+UUID 判断、base64 编码与反推结果截断、图片预处理，以及 ComfyUI 节点中 PIL→numpy→torch 的转换。
+每项自动确定循环次数后重复测量，取最小值与中位数；与 baseline.json 比较，
+最小值比基线慢超过阈值即视为回退，进程以状态码1退出
+
+用法：
+    python benchmarks/micro.py                  # 与基线比较
+    python benchmarks/micro.py --save           # 把本次结果保存为新基线
+    python benchmarks/micro.py -k extract --threshold 0.5
+基线与机器相关，换机器或升级 Python 后先用 --save 重新生成
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import types
+import argparse
+import platform
+import importlib
+import statistics
+from typing import Callable, Dict, List, Optional
+
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(HERE, 'fixtures')
+BASELINE_PATH = os.path.join(HERE, 'baseline.json')
+DEFAULT_THRESHOLD = 0.25    # 比基线慢25%以上视为回退
+MIN_RUN_SECONDS = 0.05      # 每轮测量至少持续的时间
+REPEAT = 7
+
+# 名称 -> 返回待测函数的 setup；setup 返回 None 表示依赖缺失，跳过该项
+_benchmarks: Dict[str, Callable[[], Optional[Callable[[], object]]]] = {}
+
+
+def bench(name: str):
+    def register(setup):
+        _benchmarks[name] = setup
+        return setup
+    return register
+
+
+def fixture(name: str):
+    with open(os.path.join(FIXTURES_DIR, f'{name}.json'), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def sample_png(width: int, height: int) -> bytes:
+    """带渐变的测试图片，内容固定，压缩率接近真实照片而不是纯色"""
+    img = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    out = io.BytesIO()
+    img.save(out, 'PNG')
+    return out.getvalue()
+
+
+# ---- 响应解析与字段提取（modelscope_api.py，routes.py 与 jobs.py 共用） ----
+
+@bench('extract_task_id')
+def _():
+    from modelscope_api import extract_task_id
+    submit = fixture('submit')
+    return lambda: extract_task_id(submit)
+
+
+@bench('extract_request_id')
+def _():
+    from modelscope_api import request_id_extractor
+    submit = fixture('submit')
+    return lambda: request_id_extractor.extract(submit)
+
+
+@bench('extract_images')
+def _():
+    from modelscope_api import extract_images
+    response = fixture('status_succeed')
+    task_data = response['Data']['data']
+    return lambda: extract_images(task_data, response)
+
+
+@bench('extract_images_fallback')
+def _():
+    from modelscope_api import extract_images
+    response = fixture('status_legacy')
+    return lambda: extract_images(response['data'], response)
+
+
+@bench('parse_task_status_queuing')
+def _():
+    from modelscope_api import parse_task_status
+    response = fixture('status_queuing')
+    return lambda: parse_task_status(response)
+
+
+@bench('parse_task_status_succeed')
+def _():
+    from modelscope_api import parse_task_status
+    response = fixture('status_succeed')
+    return lambda: parse_task_status(response)
+
+
+@bench('extract_csrf_token')
+def _():
+    from modelscope_api import extract_csrf_token_enhanced
+    cookie = fixture('cookies')['typical']
+    return lambda: extract_csrf_token_enhanced(cookie)
+
+
+@bench('extract_csrf_token_missing')
+def _():
+    import logging
+    from modelscope_api import extract_csrf_token_enhanced
+    logging.getLogger().setLevel(logging.ERROR)   # 未找到时的警告日志不计入
+    cookie = fixture('cookies')['missing']
+    return lambda: extract_csrf_token_enhanced(cookie)
+
+
+@bench('is_uuid_format')
+def _():
+    from task_poller import ModelScopeTaskPoller
+    poller = ModelScopeTaskPoller('')
+    values = ('5a1f0c52-9d8e-4b7a-a3c2-0f6e2d9b1c47', '14839126')
+    return lambda: [poller.is_uuid_format(value) for value in values]
+
+
+# ---- 反推：base64 编码、结果清理与截断、图片预处理（image_analyzer.py） ----
+
+@bench('encode_image_1mb')
+def _():
+    from image_analyzer import encode_image
+    payload = os.urandom(1024 * 1024)
+    return lambda: encode_image(payload)
+
+
+@bench('clean_content_long')
+def _():
+    from image_analyzer import clean_content
+    text = ('这是一副专业人像摄影作品，在室内房间场景中，光线均匀柔和。\n  中景构图下，一个亚洲女人穿传统风格服饰。 ' * 20)
+    return lambda: clean_content(text)
+
+
+@bench('incremental_cleaner')
+def _():
+    from image_analyzer import IncrementalCleaner
+    chunks = ['这是一副专业人像摄影作品，', '在室内房间场景中，光线均匀柔和。', '\n  中景构图下，'] * 40
+
+    def run():
+        cleaner = IncrementalCleaner()
+        for chunk in chunks:
+            cleaner.feed(chunk)
+        cleaner.finish()
+    return run
+
+
+@bench('prepare_image_2048')
+def _():
+    from image_analyzer import prepare_image
+    data = sample_png(2048, 1536)
+    return lambda: prepare_image(data)
+
+
+# ---- ComfyUI 节点：PIL→numpy→torch（comfyui_modelscope/image.py） ----
+
+def _load_comfyui_image_module():
+    """不执行包的 __init__（其中会创建配置文件并注册节点），只加载 image.py"""
+    package_dir = os.path.join(ROOT, 'comfyui_modelscope')
+    if 'comfyui_modelscope' not in sys.modules:
+        package = types.ModuleType('comfyui_modelscope')
+        package.__path__ = [package_dir]
+        sys.modules['comfyui_modelscope'] = package
+    return importlib.import_module('comfyui_modelscope.image')
+
+
+@bench('comfyui_image_to_tensor')
+def _():
+    try:
+        import numpy  # noqa: F401
+        import torch  # noqa: F401
+    except ImportError:
+        return None
+    module = _load_comfyui_image_module()
+    img = Image.open(io.BytesIO(sample_png(928, 1664)))
+    img.load()
+    return lambda: module._image_to_tensor(img)
+
+
+# ---- 测量与基线比较 ----
+
+def measure(fn: Callable[[], object]) -> Dict[str, float]:
+    """先确定循环次数使一轮不少于 MIN_RUN_SECONDS，再重复 REPEAT 轮，返回每次调用的耗时（秒）"""
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - started
+        if elapsed >= MIN_RUN_SECONDS:
+            break
+        loops *= 2 if elapsed == 0 else max(2, min(int(MIN_RUN_SECONDS / elapsed) + 1, 10))
+
+    timings = []
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        timings.append((time.perf_counter() - started) / loops)
+    return {'min': min(timings), 'median': statistics.median(timings), 'loops': loops}
+
+
+def run(selected: List[str]) -> Dict[str, Dict[str, float]]:
+    results = {}
+    for name in selected:
+        fn = _benchmarks[name]()
+        if fn is None:
+            print(f'{name:<30} 跳过（依赖未安装）')
+            continue
+        results[name] = measure(fn)
+    return results
+
+
+def recheck(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+            threshold: float) -> Dict[str, Dict[str, float]]:
+    """超过阈值的基准再测一次取较快的结果，排除偶发的调度抖动"""
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base and result['min'] > base['min'] * (1 + threshold):
+            retry = measure(_benchmarks[name]())
+            if retry['min'] < result['min']:
+                results[name] = retry
+    return results
+
+
+def _format_seconds(seconds: float) -> str:
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return f'{seconds / scale:.2f}{unit}'
+    return f'{seconds / 1e-9:.0f}ns'
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+            threshold: float) -> List[str]:
+    """打印对比表，返回回退的基准名称"""
+    regressions = []
+    # 表头用ASCII，中文在等宽终端中占两列会错位
+    print(f"{'benchmark':<30}{'min':>12}{'median':>12}{'baseline':>12}{'change':>10}")
+    for name, result in results.items():
+        base = baseline.get(name)
+        line = f"{name:<30}{_format_seconds(result['min']):>12}{_format_seconds(result['median']):>12}"
+        if base:
+            change = result['min'] / base['min'] - 1
+            flag = ''
+            if change > threshold:
+                regressions.append(name)
+                flag = '  回退'
+            line += f"{_format_seconds(base['min']):>12}{change:>+10.1%}{flag}"
+        else:
+            line += f"{'-':>12}{'-':>10}"
+        print(line)
+    return regressions
+
+
+def load_baseline(path: str) -> Dict[str, Dict[str, float]]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f).get('results', {})
+
+
+def save_baseline(path: str, results: Dict[str, Dict[str, float]]):
+    merged = {**load_baseline(path), **results}
+    document = {
+        'python': platform.python_version(),
+        'machine': f'{platform.system()} {platform.machine()}',
+        'saved_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'results': {name: {key: (round(value, 12) if key != 'loops' else value) for key, value in result.items()}
+                    for name, result in sorted(merged.items())},
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(document, f, ensure_ascii=False, indent=2)
+        f.write('\n')
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='热路径微基准')
+    parser.add_argument('-k', dest='keyword', default='', help='只运行名称包含该字符串的基准')
+    parser.add_argument('--save', action='store_true', help='把结果保存为基线')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='允许的变慢比例，默认0.25')
+    args = parser.parse_args()
+
+    selected = [name for name in _benchmarks if args.keyword in name]
+    results = run(selected)
+    baseline = load_baseline(args.baseline)
+    if not args.save:
+        results = recheck(results, baseline, args.threshold)
+    regressions = compare(results, baseline, args.threshold)
+
+    if args.save:
+        save_baseline(args.baseline, results)
+        print(f'基线已保存到 {args.baseline}')
+        return 0
+    if regressions:
+        print(f"\n{len(regressions)}项比基线慢超过{args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,6 +7,11 @@ import time
 import requests
 import logging
 import re
+import math
+import random
+from collections import deque
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 try:
     import torch
@@ -21,6 +26,136 @@ except ImportError:
 
 from .config_loader import ConfigLoader
 
+# 节点内所有请求共用一个带连接池的 Session，复用到 ModelScope 与图片CDN 的 keep-alive 连接
+_session = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=8,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504),
+                      allowed_methods=frozenset(['GET']), raise_on_status=False)
+)
+_session.mount('https://', _adapter)
+_session.mount('http://', _adapter)
+
+# 自适应轮询：排队靠后时很少查询，接近完成时密集查询
+_POLL_MIN_INTERVAL = 2
+_POLL_MAX_INTERVAL = 20
+_POLL_BASELINE_INTERVAL = 10      # 无法估算剩余时间时的间隔，也是统计节省次数的对照基线
+_POLL_SECONDS_PER_POSITION = 10   # 尚未观测到队列移动时，每个排队位置的预估耗时
+
+
+def _adaptive_delay(history, errors=0):
+    """
+    根据最近的排队位置与进度速度估算剩余时间，下次轮询安排在剩余时间的一半处，加±20%抖动
+    history: 最近几次观测 [(时间, 排队位置, 进度百分比)]
+    """
+    if errors:
+        delay = _POLL_BASELINE_INTERVAL * (2 ** (errors - 1))
+    elif not history:
+        delay = _POLL_BASELINE_INTERVAL
+    else:
+        (t0, q0, p0), (t1, q1, p1) = history[0], history[-1]
+        span = t1 - t0
+        if q1:
+            advance = (q0 - q1) / span if span > 0 and q0 else 0
+            eta = q1 / advance if advance > 0 else q1 * _POLL_SECONDS_PER_POSITION
+        elif span > 0 and p1 > p0:
+            eta = (100 - p1) / ((p1 - p0) / span)
+        else:
+            eta = _POLL_BASELINE_INTERVAL * 2
+        delay = eta / 2
+    delay = min(max(delay, _POLL_MIN_INTERVAL), _POLL_MAX_INTERVAL)
+    return max(delay * random.uniform(0.8, 1.2), _POLL_MIN_INTERVAL)
+
+# 响应字段提取：按顺序尝试预编译的路径（'*' 表示展开列表），都未命中时做有深度上限的回退遍历；
+# 各路径的命中次数记录在 _EXTRACT_HITS 中，接口结构变化时可以从日志看出
+_TASK_ID_PATHS = (('Data', 'taskId'), ('Data', 'data', 'taskId'), ('data', 'taskId'), ('taskId',))
+_IMAGE_PATHS = (
+    ('predictResult', 'images', '*', 'imageUrl'),
+    ('predictResult', '*', 'url'),
+    ('images', '*', 'imageUrl'),
+    ('images', '*', 'url'),
+    ('images', '*'),
+    ('result', 'images', '*', 'imageUrl'),
+    ('result', 'images', '*', 'url'),
+    ('result', 'images', '*'),
+    ('result', 'image_urls', '*'),
+)
+_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp')
+_EXTRACT_MAX_DEPTH = 6
+_EXTRACT_HITS = {}
+
+
+def _resolve(obj, steps):
+    values = [obj]
+    for step in steps:
+        found = []
+        for value in values:
+            if step == '*':
+                if isinstance(value, list):
+                    found.extend(value)
+            elif isinstance(value, dict) and step in value:
+                found.append(value[step])
+        if not found:
+            return []
+        values = found
+    return values
+
+
+def _walk(obj, keys):
+    """广度优先查找键名（不区分大小写）匹配的值，最多展开 _EXTRACT_MAX_DEPTH 层"""
+    level = [obj] if isinstance(obj, (dict, list)) else []
+    for _ in range(_EXTRACT_MAX_DEPTH):
+        children = []
+        for node in level:
+            items = node.items() if isinstance(node, dict) else enumerate(node)
+            for key, value in items:
+                if isinstance(key, str) and key.lower() in keys:
+                    yield value
+                elif isinstance(value, (dict, list)):
+                    children.append(value)
+        if not children:
+            return
+        level = children
+
+
+def _extract(name, obj, paths, accept, fallback_keys, fallback_accept=None, many=False):
+    """按路径提取字段，many 为 True 时返回所有有效值的列表，否则返回第一个有效值"""
+    for steps in paths:
+        values = [value for value in _resolve(obj, steps) if accept(value)]
+        if values:
+            key = f"{name}:{'.'.join(steps)}"
+            _EXTRACT_HITS[key] = _EXTRACT_HITS.get(key, 0) + 1
+            return values if many else values[0]
+    values = [value for value in _walk(obj, fallback_keys)
+              if accept(value) and (fallback_accept is None or fallback_accept(value))]
+    key = f"{name}:{'fallback' if values else 'miss'}"
+    _EXTRACT_HITS[key] = _EXTRACT_HITS.get(key, 0) + 1
+    if values:
+        logging.warning(f"[ModelScope] {name} 预设路径均未命中，回退遍历取得结果，命中统计: {_EXTRACT_HITS}")
+        return values if many else values[0]
+    return [] if many else None
+
+
+def _extract_task_id(result):
+    return _extract('task_id', result, _TASK_ID_PATHS, lambda v: isinstance(v, (int, str)) and bool(str(v)),
+                    ('taskid', 'task_id'))
+
+
+def _extract_images(task_data):
+    return _extract('images', task_data, _IMAGE_PATHS, lambda v: isinstance(v, str) and bool(v),
+                    ('url', 'imageurl', 'image_url'), lambda v: v.lower().endswith(_IMAGE_EXTENSIONS), many=True)
+
+
+def _image_to_tensor(img):
+    """PIL图像转为ComfyUI的 [1, H, W, 3] float32 张量（取值0-1）"""
+    # 转换为numpy数组
+    img_array = np.array(img).astype(np.float32) / 255.0
+    img_array = img_array[:, :, :3]  # 确保只有RGB通道
+    # 转换为PyTorch张量
+    return torch.from_numpy(img_array)[None,]
+
+
 class ModelScopeImageNode:
     """ModelScope图像生成节点"""
     
@@ -183,7 +318,7 @@ class ModelScopeImageNode:
             logging.info(f"[ModelScope] 开始生成图像，提示词: {prompt[:50]}{'...' if len(prompt) > 50 else ''}")
             logging.info(f"[ModelScope] 图像尺寸: {width}x{height}, 数量: {num_images}, 高清修复: {enable_hires}")
             
-            response = requests.post(api_url, json=request_data, headers=headers, timeout=30)
+            response = _session.post(api_url, json=request_data, headers=headers, timeout=30)
             response.raise_for_status()
             
             result = response.json()
@@ -203,12 +338,8 @@ class ModelScopeImageNode:
                 return ("", empty_tensor, "API响应格式不正确")
                 
             # 检查taskId位置
-            task_id = None
-            if "taskId" in result["Data"]:
-                task_id = result["Data"]["taskId"]
-            elif "data" in result["Data"] and "taskId" in result["Data"]["data"]:
-                task_id = result["Data"]["data"]["taskId"]
-            else:
+            task_id = _extract_task_id(result)
+            if task_id is None:
                 logging.error(f"[ModelScope] 无法从API响应中获取taskId: {result}")
                 empty_tensor = torch.zeros((1, 64, 64, 3), dtype=torch.float32) if torch else None
                 return ("", empty_tensor, "无法从API响应中获取taskId")
@@ -234,19 +365,14 @@ class ModelScopeImageNode:
             for i, url in enumerate(urls):
                 try:
                     logging.info(f"[ModelScope] 正在下载第{i+1}张图像: {url[:50]}...")
-                    img_response = requests.get(url, timeout=30)
+                    img_response = _session.get(url, timeout=30)
                     img_response.raise_for_status()
                     
                     # 将图像转换为PIL对象
                     img = Image.open(io.BytesIO(img_response.content))
                     logging.info(f"[ModelScope] 图像{i+1}下载成功，格式: {img.format}, 尺寸: {img.size}")
                     
-                    # 转换为numpy数组
-                    img_array = np.array(img).astype(np.float32) / 255.0
-                    img_array = img_array[:, :, :3]  # 确保只有RGB通道
-                    
-                    # 转换为PyTorch张量
-                    img_tensor = torch.from_numpy(img_array)[None,]
+                    img_tensor = _image_to_tensor(img)
                     images.append(img_tensor)
                     image_urls.append(url)
                     
@@ -302,10 +428,14 @@ class ModelScopeImageNode:
         """
         api_url = f"https://www.modelscope.cn/api/v1/muse/predict/task/status?taskId={task_id}"
         start_time = time.time()
+        history = deque(maxlen=5)
+        polls = 0
+        errors = 0
         
         while time.time() - start_time < max_wait_time:
+            polls += 1
             try:
-                response = requests.get(api_url, headers=headers, timeout=10)
+                response = _session.get(api_url, headers=headers, timeout=10)
                 response.raise_for_status()
                 
                 result = response.json()
@@ -337,48 +467,13 @@ class ModelScopeImageNode:
                 status = task_data.get("status", "")
                 
                 if status == "COMPLETED" or status == "SUCCEED":
-                    # 尝试从不同位置获取图像
-                    images = []
-                    
-                    # 尝试从predictResult.images获取
-                    if "predictResult" in task_data and isinstance(task_data["predictResult"], dict):
-                        predict_result = task_data["predictResult"]
-                        if "images" in predict_result and isinstance(predict_result["images"], list):
-                            # 从每个图像对象中提取imageUrl字段
-                            for img_obj in predict_result["images"]:
-                                if isinstance(img_obj, dict) and "imageUrl" in img_obj:
-                                    images.append(img_obj["imageUrl"])
-                    
-                    # 尝试从predictResult获取（旧格式）
-                    elif "predictResult" in task_data and isinstance(task_data["predictResult"], list):
-                        images = [item.get("url") for item in task_data.get("predictResult", []) if item and isinstance(item, dict) and item.get("url")]
-                    
-                    # 尝试从images获取
-                    elif "images" in task_data and isinstance(task_data["images"], list):
-                        for img_obj in task_data["images"]:
-                            if isinstance(img_obj, dict) and "imageUrl" in img_obj:
-                                images.append(img_obj["imageUrl"])
-                            elif isinstance(img_obj, str):
-                                images.append(img_obj)
-                            elif isinstance(img_obj, dict) and "url" in img_obj:
-                                images.append(img_obj["url"])
-                    
-                    # 尝试从result中获取
-                    elif "result" in task_data and isinstance(task_data["result"], dict):
-                        result_data = task_data["result"]
-                        if "images" in result_data and isinstance(result_data["images"], list):
-                            for img_obj in result_data["images"]:
-                                if isinstance(img_obj, dict) and "imageUrl" in img_obj:
-                                    images.append(img_obj["imageUrl"])
-                                elif isinstance(img_obj, str):
-                                    images.append(img_obj)
-                                elif isinstance(img_obj, dict) and "url" in img_obj:
-                                    images.append(img_obj["url"])
-                        elif "image_urls" in result_data:
-                            images = result_data.get("image_urls", [])
-                    
+                    images = _extract_images(task_data)
+
                     # 添加调试信息
                     logging.info(f"[ModelScope] 任务完成，状态: {status}，生成了{len(images)}张图像")
+                    baseline_polls = max(1, math.ceil((time.time() - start_time) / _POLL_BASELINE_INTERVAL))
+                    logging.info(f"[ModelScope] 共查询{polls}次，固定{_POLL_BASELINE_INTERVAL}秒间隔需{baseline_polls}次，"
+                                 f"节省{baseline_polls - polls}次")
                     if not images:
                         logging.warning(f"[ModelScope] 无法从响应中提取图像URL，任务数据: {task_data}")
                     else:
@@ -398,16 +493,11 @@ class ModelScopeImageNode:
                     
                     logging.info(f"[ModelScope] 任务状态: {status}, 进度: {percent}%, 详情: {detail}")
                     
-                    # 智能轮询间隔：排队时使用较长间隔，处理时使用较短间隔
-                    if status == "QUEUING" or "排队" in detail:
-                        # 排队时，间隔15秒
-                        time.sleep(15)
-                    elif status == "PROCESSING":
-                        # 处理中，间隔8秒
-                        time.sleep(8)
-                    else:
-                        # 其他状态，间隔10秒
-                        time.sleep(10)
+                    # 自适应轮询间隔：根据排队位置与进度速度估算
+                    task_queue = task_data.get("taskQueue") or {}
+                    history.append((time.time(), task_queue.get("currentPosition") or 0, percent or 0))
+                    errors = 0
+                    time.sleep(_adaptive_delay(history))
                         
                 else:
                     logging.warning(f"[ModelScope] 未知任务状态: {status}")
@@ -416,7 +506,8 @@ class ModelScopeImageNode:
                 
             except requests.exceptions.RequestException as e:
                 logging.error(f"[ModelScope] 轮询请求失败: {e}")
-                time.sleep(10)
+                errors += 1
+                time.sleep(_adaptive_delay(history, errors))
                 
         # 如果超时，返回空图像列表
         logging.warning(f"[ModelScope] 任务轮询超时，可能需要更长时间")
@@ -0,0 +1,42 @@
+import os
+
+here = os.path.dirname(os.path.abspath(__file__))
+out_pic = "/tmp/out_pic"
+
+
+# 配置上传文件夹和允许的文件扩展名
+UPLOAD_FOLDER = os.path.join(here, 'uploads')
+ALLOWED_EXTENSIONS = {'webp','png', 'jpg', 'jpeg', 'gif', 'bmp'}
+MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB上传限制
+
+# 在这里配置您的API Key和Cookie
+OPENAI_API_KEY = ""
+MODEL_SCOPE_COOKIE = "csrf_token=abc; x=1"
+
+# 图像生成默认参数
+DEFAULT_WIDTH = 928
+DEFAULT_HEIGHT = 1664
+
+
+LORA_ARGS = [
+    # {'modelVersionId': 310150, 'scale': 1},
+    {'modelVersionId': 313167, 'scale': 1}
+]
+
+# 模型信息字典：模型名称 → {id: modelVersionId, description: 描述}
+model_info = {
+    # FEI系列
+    'Q_FEI_ckpt-12': {'id': 310150, 'description': 'Q_FEI_ckpt-12 模型'},
+    'Q_FEIFEI_ckpt-10': {'id': 313167, 'description': 'Q_FEIFEI_ckpt-10 模型'},
+
+    # 默认Qwen模型（从API响应中看到的）
+    'Qwen-image_v1': {'id': 275167, 'description': 'Qwen-image_v1 默认模型'},
+    'MusePublic/Qwen-image': {'id': 48344, 'description': 'MusePublic Qwen-image 模型'},
+
+}
+
+# 异步生图任务调度参数（jobs.py）
+JOB_POLL_INTERVAL = 3      # 轮询间隔（秒）
+JOB_MAX_POLLS = 60         # 单个任务最大轮询次数
+JOB_SUBMIT_WORKERS = 4     # 提交任务的线程数
+JOB_RETENTION = 3600       # 已结束任务在内存中保留的时间（秒）
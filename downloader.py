@@ -0,0 +1,84 @@
+"""
+图片并行下载模块
+同一任务的所有图片在有界线程池中并发下载，按块流式写入临时文件后原子重命名，
+并记录每张图片的耗时与大小
+"""
+
+import os
+import time
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any
+
+import config
+import http_client
+import metrics
+
+DOWNLOAD_WORKERS = getattr(config, 'DOWNLOAD_WORKERS', 8)          # 并发下载的线程数
+DOWNLOAD_CHUNK_SIZE = getattr(config, 'DOWNLOAD_CHUNK_SIZE', 64 * 1024)
+DOWNLOAD_TIMEOUT = getattr(config, 'DOWNLOAD_TIMEOUT', 30)
+
+_pool = ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS, thread_name_prefix='image-download')
+
+
+def image_filename(url: str, index: int) -> str:
+    """从URL中提取文件名，无法提取时按序号命名"""
+    filename = os.path.basename(url.split('?')[0])
+    if not filename or '.' not in filename:
+        filename = f"image_{index + 1}.jpg"
+    return filename
+
+
+def download_to_file(url: str, path: str) -> int:
+    """流式下载到临时文件，完成后原子重命名为目标路径，返回写入的字节数"""
+    folder = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix='.download-', suffix='.part')
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as f, http_client.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                f.write(chunk)
+                size += len(chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return size
+
+
+def _download_one(url: str, folder: str, index: int) -> Dict[str, Any]:
+    filename = image_filename(url, index)
+    started = time.monotonic()
+    result = {'url': url, 'filename': filename, 'success': False, 'bytes': 0, 'seconds': 0.0, 'error': None}
+    try:
+        result['bytes'] = download_to_file(url, os.path.join(folder, filename))
+        result['success'] = True
+    except Exception as e:
+        result['error'] = str(e)
+        logging.error(f"下载图片失败 {url}: {e}")
+    elapsed = time.monotonic() - started
+    result['seconds'] = round(elapsed, 3)
+    metrics.download_seconds.observe(elapsed, kind='archive')
+    if result['success']:
+        metrics.download_bytes.observe(result['bytes'], kind='archive')
+    return result
+
+
+def download_images(urls: List[str], folder: str) -> List[Dict[str, Any]]:
+    """
+    并发下载一组图片到 folder，总耗时取决于最慢的一张
+
+    Returns:
+        List[Dict]: 与 urls 顺序一致的下载结果，包含 filename / success / bytes / seconds / error
+    """
+    os.makedirs(folder, exist_ok=True)
+    futures = [_pool.submit(_download_one, url, folder, i) for i, url in enumerate(urls)]
+    results = [future.result() for future in futures]
+
+    for r in results:
+        if r['success']:
+            logging.info(f"图片已保存: {r['filename']} ({r['bytes']} bytes, {r['seconds']}s)")
+    return results
@@ -5,6 +5,7 @@ class APIManager {
         this.timeout = CONFIG.API.TIMEOUT;
         this.pollInterval = CONFIG.API.POLL_INTERVAL;
         this.currentTaskId = null;
+        this.currentEventSource = null;
     }
     
     /**
@@ -103,15 +104,15 @@ class APIManager {
     
     /**
      * 分析图片
-     * @param {string} filename - 文件名
+     * @param {string} uploadId - 上传接口返回的 upload_id
      * @param {Object} settings - 设置参数
      * @returns {Promise<Object>} - 分析结果
      */
-    async analyzeImage(filename, settings) {
+    async analyzeImage(uploadId, settings) {
         const url = `${this.baseUrl}${CONFIG.API.ENDPOINTS.ANALYZE}`;
         
         const requestData = {
-            filename: filename,
+            upload_id: uploadId,
             openai_api_key: settings.openaiKey
         };
         
@@ -166,71 +167,53 @@ class APIManager {
     }
     
     /**
-     * 轮询任务状态
-     * @param {string} taskId - 任务ID
+     * 订阅任务进度（SSE推送，由后端共享轮询器统一查询ModelScope）
+     * @param {string} taskId - 后端返回的 job_id
      * @param {Function} onProgress - 进度回调函数
      * @param {Function} onComplete - 完成回调函数
      * @param {Function} onError - 错误回调函数
      */
     async pollTaskStatus(taskId, onProgress, onComplete, onError) {
         this.currentTaskId = taskId;
-        
-        const poll = async () => {
-            try {
-                // 检查是否已取消
-                if (this.currentTaskId !== taskId) {
-                    return;
-                }
-                
-                const status = await this.getQueueStatus(taskId);
-                
-                if (onProgress) {
-                    onProgress(status);
-                }
-                
-                switch (status.status) {
-                    case CONFIG.STATUS.COMPLETED:
-                        // 获取结果
-                        const result = await this.getResult(taskId);
-                        if (onComplete) {
-                            onComplete(result);
-                        }
-                        break;
-                        
-                    case CONFIG.STATUS.FAILED:
-                        if (onError) {
-                            onError(new Error(status.error || '任务执行失败'));
-                        }
-                        break;
-                        
-                    case CONFIG.STATUS.CANCELLED:
-                        if (onError) {
-                            onError(new Error('任务已取消'));
-                        }
-                        break;
-                        
-                    case CONFIG.STATUS.PENDING:
-                    case CONFIG.STATUS.PROCESSING:
-                        // 继续轮询
-                        setTimeout(poll, this.pollInterval);
-                        break;
-                        
-                    default:
-                        if (onError) {
-                            onError(new Error('未知任务状态: ' + status.status));
-                        }
-                        break;
-                }
-                
-            } catch (error) {
-                if (onError) {
-                    onError(error);
+        if (this.currentEventSource) {
+            this.currentEventSource.close();
+        }
+
+        const source = new EventSource(`${this.baseUrl}${CONFIG.API.ENDPOINTS.JOBS}/${taskId}/events`);
+        this.currentEventSource = source;
+
+        source.addEventListener('progress', event => {
+            // 检查是否已取消
+            if (this.currentTaskId !== taskId) {
+                source.close();
+                return;
+            }
+            if (onProgress) {
+                onProgress(JSON.parse(event.data));
+            }
+        });
+
+        source.addEventListener('done', event => {
+            source.close();
+            const status = JSON.parse(event.data);
+            if (this.currentTaskId !== taskId) {
+                return;
+            }
+            if (status.status.toLowerCase() === CONFIG.STATUS.COMPLETED) {
+                if (onComplete) {
+                    onComplete(status);
                 }
+            } else if (onError) {
+                onError(new Error(status.error || '任务执行失败'));
+            }
+        });
+
+        source.onerror = () => {
+            source.close();
+            if (this.currentTaskId === taskId && onError) {
+                onError(new Error('任务进度连接已断开'));
             }
         };
-        
-        // 开始轮询
-        poll();
     }
     
     /**
@@ -238,6 +221,10 @@ class APIManager {
      */
     cancelCurrentTask() {
         this.currentTaskId = null;
+        if (this.currentEventSource) {
+            this.currentEventSource.close();
+            this.currentEventSource = null;
+        }
     }
     
     /**
@@ -271,7 +258,7 @@ class APIManager {
                 onAnalyzeStart();
             }
             
-            const analyzeResult = await this.analyzeImage(uploadResult.filename, settings);
+            const analyzeResult = await this.analyzeImage(uploadResult.upload_id, settings);
             
             if (!analyzeResult.success) {
                 throw new Error(analyzeResult.error || CONFIG.ERRORS.ANALYZE_FAILED);
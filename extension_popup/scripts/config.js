@@ -7,6 +7,7 @@ const CONFIG = {
         
         // API 端点
         ENDPOINTS: {
+            JOBS: '/jobs',
             UPLOAD: '/upload',
             ANALYZE: '/analyze_from_url',
             GENERATE: '/api/generate_image',
@@ -93,6 +93,32 @@ function createPopup(imageUrl) {
     return popup;
 }
 
+// 订阅后台任务的SSE进度推送直到完成，返回与同步接口相同结构的结果
+function waitForJob(jobId, onProgress) {
+    return new Promise((resolve, reject) => {
+        const source = new EventSource(`http://127.0.0.1:8005/jobs/${jobId}/events`);
+        source.addEventListener('progress', event => {
+            if (onProgress) {
+                onProgress(JSON.parse(event.data));
+            }
+        });
+        source.addEventListener('done', event => {
+            source.close();
+            const job = JSON.parse(event.data);
+            if (job.status === 'COMPLETED') {
+                resolve({ success: true, images: job.images, task_id: job.task_id });
+            } else {
+                resolve({ success: false, error: job.error });
+            }
+        });
+        source.onerror = () => {
+            // 连接断开（服务重启或任务已过期）时不自动重连
+            source.close();
+            reject(new Error('任务进度连接已断开'));
+        };
+    });
+}
+
 chrome.runtime.onMessage.addListener((request, sender, sendResponse) => {
     if (request.action === "showModal") {
         const newPopup = createPopup(request.imageUrl);
@@ -124,9 +150,13 @@ chrome.runtime.onMessage.addListener((request, sender, sendResponse) => {
                     headers: {
                         'Content-Type': 'application/json',
                     },
-                    body: JSON.stringify({ prompt: data.prompt }),
+                    body: JSON.stringify({ prompt: data.prompt, async: true }),
                 })
                 .then(response => response.json())
+                .then(submitData => submitData.success && submitData.job_id ? waitForJob(submitData.job_id, job => {
+                    const label = newPopup.querySelector('.image-box:last-child p');
+                    label.textContent = job.queue_position ? `生成图片（排队第${job.queue_position}位）` : `生成图片（${job.progress || 0}%）`;
+                }) : submitData)
                 .then(generateData => {
                     spinner.style.display = 'none';
                     if (generateData.success && generateData.images && generateData.images.length > 0) {
@@ -151,7 +181,14 @@ chrome.runtime.onMessage.addListener((request, sender, sendResponse) => {
 
                         generateData.images.forEach((imageUrl, index) => {
                             const thumb = document.createElement('img');
-                            thumb.src = imageUrl;
+                            // 优先加载后端生成的WebP缩略图，失败时回退到原图
+                            thumb.src = generateData.task_id
+                                ? `http://127.0.0.1:8005/thumb/${generateData.task_id}/${index}?w=${Math.ceil(thumbSize * (window.devicePixelRatio || 1))}`
+                                : imageUrl;
+                            thumb.onerror = () => {
+                                thumb.onerror = null;
+                                thumb.src = imageUrl;
+                            };
                             thumb.style.width = `${thumbSize}px`;
                             thumb.style.height = `${thumbSize}px`;
                             thumb.style.objectFit = 'cover';
@@ -0,0 +1,294 @@
+"""
+生成历史索引模块
+为 out_pic/<task_id>/<task_id>.json 建立SQLite索引，提示词使用FTS5（trigram分词，支持中文子串）全文检索；
+不足3个字符的中文词查 history_grams 中的单字/双字索引，其余短词才退回 LIKE 扫描；
+首次使用时扫描一次 out_pic，之后由归档器在写入JSON时增量更新，不再重复扫描目录
+"""
+
+import os
+import re
+import json
+import time
+import sqlite3
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Any
+
+from flask import Blueprint, request, jsonify
+
+import config
+from config import out_pic
+
+HISTORY_INDEX_PATH = getattr(config, 'HISTORY_INDEX_PATH',
+                             os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'history.sqlite3'))
+HISTORY_PAGE_SIZE = 20
+HISTORY_MAX_PAGE_SIZE = 100
+FTS_MIN_TERM = 3   # trigram 分词只能检索不少于3个字符的词，更短的中文词查单字/双字索引，其余退回 LIKE 查询
+LIKE_COUNT_LIMIT = 1000   # 含 LIKE 词的检索要扫描全表，总数最多数到这里
+GRAMS_VERSION = '1'       # 单字/双字索引的格式版本，变化时重建
+
+CJK_RUN = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+')
+
+history_bp = Blueprint('history', __name__)
+
+
+def short_grams(text: str) -> Set[str]:
+    """提示词中连续中文字符的所有单字与相邻双字，供短中文词检索"""
+    grams = set()
+    for run in CJK_RUN.findall(text or ''):
+        grams.update(run)
+        grams.update(run[i:i + 2] for i in range(len(run) - 1))
+    return grams
+
+
+def _is_cjk(term: str) -> bool:
+    return CJK_RUN.fullmatch(term) is not None
+
+
+def _like_pattern(term: str) -> str:
+    """LIKE 子串匹配的模式，词中的 \\ % _ 按字面匹配（配合 ESCAPE '\\'）"""
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+class HistoryIndex:
+    """out_pic 归档的查询索引"""
+
+    def __init__(self, path: str = HISTORY_INDEX_PATH, root: str = out_pic):
+        self.path = path
+        self.root = root
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._built = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript('''
+                CREATE TABLE IF NOT EXISTS history (
+                    id INTEGER PRIMARY KEY,
+                    task_id TEXT NOT NULL UNIQUE,
+                    request_id TEXT,
+                    prompt TEXT,
+                    reverse_image TEXT,
+                    urls TEXT,
+                    image_count INTEGER,
+                    created_at REAL NOT NULL);
+                CREATE INDEX IF NOT EXISTS idx_history_created ON history(created_at);
+                CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(
+                    prompt, content='history', content_rowid='id', tokenize='trigram');
+                CREATE TRIGGER IF NOT EXISTS history_ai AFTER INSERT ON history BEGIN
+                    INSERT INTO history_fts(rowid, prompt) VALUES (new.id, new.prompt);
+                END;
+                CREATE TRIGGER IF NOT EXISTS history_ad AFTER DELETE ON history BEGIN
+                    INSERT INTO history_fts(history_fts, rowid, prompt) VALUES ('delete', old.id, old.prompt);
+                END;
+                CREATE TRIGGER IF NOT EXISTS history_au AFTER UPDATE ON history BEGIN
+                    INSERT INTO history_fts(history_fts, rowid, prompt) VALUES ('delete', old.id, old.prompt);
+                    INSERT INTO history_fts(rowid, prompt) VALUES (new.id, new.prompt);
+                END;
+                CREATE TABLE IF NOT EXISTS history_grams (
+                    gram TEXT NOT NULL,
+                    id INTEGER NOT NULL,
+                    PRIMARY KEY (gram, id)) WITHOUT ROWID;
+                CREATE TRIGGER IF NOT EXISTS history_grams_ad AFTER DELETE ON history BEGIN
+                    DELETE FROM history_grams WHERE id = old.id;
+                END;
+                CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            ''')
+            version = conn.execute("SELECT value FROM meta WHERE key = 'grams_version'").fetchone()
+            if version is None or version[0] != GRAMS_VERSION:
+                # 旧版本建立的索引没有单字/双字表，补建一次
+                with conn:
+                    conn.execute('DELETE FROM history_grams')
+                    self._index_grams(conn, conn.execute('SELECT id, prompt FROM history').fetchall())
+                    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('grams_version', ?)",
+                                 (GRAMS_VERSION,))
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _index_grams(conn: sqlite3.Connection, rows: Iterable[Tuple[int, str]]):
+        """为新增的行建立单字/双字索引，rows 为 (id, prompt)"""
+        conn.executemany('INSERT OR IGNORE INTO history_grams (gram, id) VALUES (?, ?)',
+                         ((gram, row_id) for row_id, prompt in rows for gram in short_grams(prompt)))
+
+    @staticmethod
+    def _row(task_id: str, data: Dict, created_at: float) -> Tuple:
+        urls = data.get('url') or []
+        return (task_id, data.get('requestId', ''), data.get('prompt', ''), data.get('reverse_image', ''),
+                json.dumps(urls, ensure_ascii=False), len(urls), created_at)
+
+    def add(self, task_id: str, data: Dict, created_at: Optional[float] = None):
+        """登记或更新一个任务，data 为 <task_id>.json 的内容"""
+        row = self._row(task_id, data, created_at or time.time())
+        with self._lock:
+            try:
+                conn = self._connect()
+                old = conn.execute('SELECT id, prompt FROM history WHERE task_id = ?', (task_id,)).fetchone()
+                conn.execute('''INSERT INTO history (task_id, request_id, prompt, reverse_image, urls, image_count, created_at)
+                                VALUES (?, ?, ?, ?, ?, ?, ?)
+                                ON CONFLICT(task_id) DO UPDATE SET
+                                    request_id = excluded.request_id, prompt = excluded.prompt,
+                                    reverse_image = excluded.reverse_image, urls = excluded.urls,
+                                    image_count = excluded.image_count''', row)
+                if old is None or old['prompt'] != row[2]:
+                    if old is not None:
+                        conn.executemany('DELETE FROM history_grams WHERE gram = ? AND id = ?',
+                                         [(gram, old['id']) for gram in short_grams(old['prompt'])])
+                    self._index_grams(conn, conn.execute('SELECT id, prompt FROM history WHERE task_id = ?',
+                                                         (task_id,)).fetchall())
+                conn.commit()
+            except sqlite3.Error as e:
+                logging.error(f'更新历史索引 {task_id} 失败: {e}')
+
+    def build(self) -> int:
+        """扫描 out_pic 补齐索引中缺少的任务，返回新增数量"""
+        rows = []
+        if os.path.isdir(self.root):
+            with os.scandir(self.root) as entries:
+                for entry in entries:
+                    if not entry.is_dir():
+                        continue
+                    json_file = os.path.join(entry.path, f'{entry.name}.json')
+                    try:
+                        with open(json_file, 'r', encoding='utf-8') as f:
+                            data = json.load(f)
+                        rows.append(self._row(entry.name, data, os.path.getmtime(json_file)))
+                    except (OSError, ValueError):
+                        continue
+
+        with self._lock:
+            conn = self._connect()
+            # 新增的行 id 都大于插入前的最大 id；不用 total_changes，它还会计入触发器写入的行
+            with conn:
+                last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM history').fetchone()[0]
+                conn.executemany('''INSERT INTO history (task_id, request_id, prompt, reverse_image, urls, image_count, created_at)
+                                    VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(task_id) DO NOTHING''', rows)
+                new_rows = conn.execute('SELECT id, prompt FROM history WHERE id > ?', (last_id,)).fetchall()
+                self._index_grams(conn, new_rows)
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('built_at', ?)", (str(time.time()),))
+            added = len(new_rows)
+            self._built = True
+        logging.info(f'历史索引扫描完成：{len(rows)}个任务，新增{added}个')
+        return added
+
+    def ensure_built(self):
+        """索引从未建立过时扫描一次 out_pic"""
+        if self._built:
+            return
+        with self._lock:
+            built = self._connect().execute("SELECT value FROM meta WHERE key = 'built_at'").fetchone()
+            self._built = built is not None
+        if not self._built:
+            self.build()
+
+    def page(self, page: int = 1, per_page: int = HISTORY_PAGE_SIZE) -> Tuple[int, List[Dict[str, Any]]]:
+        """按时间倒序分页"""
+        self.ensure_built()
+        with self._lock:
+            conn = self._connect()
+            total = conn.execute('SELECT COUNT(*) FROM history').fetchone()[0]
+            rows = conn.execute('SELECT * FROM history ORDER BY created_at DESC LIMIT ? OFFSET ?',
+                                (per_page, (page - 1) * per_page)).fetchall()
+        return total, [self._to_dict(row) for row in rows]
+
+    def search(self, query: str, page: int = 1, per_page: int = HISTORY_PAGE_SIZE) -> Tuple[int, List[Dict[str, Any]]]:
+        """
+        在提示词中检索，多个词之间为“且”关系，结果按时间倒序分页
+        不少于3个字符的词走FTS5，1~2个字的中文词走单字/双字索引，都不扫描全表；
+        其余短词（如 "4k"）用 LIKE 扫描，这类检索的总数最多只数到 LIKE_COUNT_LIMIT
+        """
+        self.ensure_built()
+        terms = query.split()
+        if not terms:
+            return 0, []
+
+        clauses: List[str] = []
+        params: List[str] = []
+        fts_terms = [term for term in terms if len(term) >= FTS_MIN_TERM]
+        if fts_terms:
+            clauses.append('id IN (SELECT rowid FROM history_fts WHERE history_fts MATCH ?)')
+            params.append(' AND '.join('"{}"'.format(term.replace('"', '""')) for term in fts_terms))
+        like_terms = 0
+        for term in terms:
+            if len(term) >= FTS_MIN_TERM:
+                continue
+            if _is_cjk(term):
+                clauses.append('id IN (SELECT id FROM history_grams WHERE gram = ?)')
+                params.append(term)
+            else:
+                clauses.append("prompt LIKE ? ESCAPE '\\'")
+                params.append(_like_pattern(term))
+                like_terms += 1
+        where = ' AND '.join(clauses)
+
+        with self._lock:
+            conn = self._connect()
+            if like_terms:
+                total = conn.execute(f'SELECT COUNT(*) FROM (SELECT 1 FROM history WHERE {where} LIMIT ?)',
+                                     (*params, LIKE_COUNT_LIMIT)).fetchone()[0]
+            else:
+                total = conn.execute(f'SELECT COUNT(*) FROM history WHERE {where}', params).fetchone()[0]
+            rows = conn.execute(f'SELECT * FROM history WHERE {where} ORDER BY created_at DESC LIMIT ? OFFSET ?',
+                                (*params, per_page, (page - 1) * per_page)).fetchall()
+        return total, [self._to_dict(row) for row in rows]
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        self.ensure_built()
+        with self._lock:
+            row = self._connect().execute('SELECT * FROM history WHERE task_id = ?', (task_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            'task_id': row['task_id'],
+            'request_id': row['request_id'],
+            'prompt': row['prompt'],
+            'reverse_image': row['reverse_image'],
+            'images': json.loads(row['urls'] or '[]'),
+            'image_count': row['image_count'],
+            'created_at': row['created_at']
+        }
+
+
+history_index = HistoryIndex()
+
+
+def _page_args() -> Tuple[int, int]:
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', HISTORY_PAGE_SIZE, type=int), 1), HISTORY_MAX_PAGE_SIZE)
+    return page, per_page
+
+
+@history_bp.route('/history', methods=['GET'])
+def history():
+    """分页浏览生成历史：?page=1&per_page=20"""
+    page, per_page = _page_args()
+    total, items = history_index.page(page, per_page)
+    return jsonify({'success': True, 'total': total, 'page': page, 'per_page': per_page, 'items': items})
+
+
+@history_bp.route('/history/search', methods=['GET'])
+def history_search():
+    """
+    按提示词检索生成历史：?q=关键词&page=1&per_page=20
+    含不足3个字符的非中文词（如 4k）时需扫描全表，total 最多为 LIKE_COUNT_LIMIT
+    """
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'success': False, 'error': '请提供检索关键词q'})
+    page, per_page = _page_args()
+    total, items = history_index.search(query, page, per_page)
+    return jsonify({'success': True, 'q': query, 'total': total, 'page': page, 'per_page': per_page, 'items': items})
+
+
+@history_bp.route('/history/reindex', methods=['POST'])
+def history_reindex():
+    """重新扫描 out_pic，补齐手动拷贝进来的任务"""
+    added = history_index.build()
+    return jsonify({'success': True, 'added': added})
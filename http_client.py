@@ -0,0 +1,95 @@
+"""
+共享的HTTP连接池
+所有对 ModelScope 及图片CDN 的请求都经过同一个 requests.Session：
+按主机复用 keep-alive 连接，对连接错误和 5xx 自动退避重试，并统计连接池命中情况
+"""
+
+import threading
+from typing import Dict
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+import config
+
+HTTP_POOL_HOSTS = getattr(config, 'HTTP_POOL_HOSTS', 16)          # 缓存连接池的主机数
+HTTP_POOL_MAXSIZE = getattr(config, 'HTTP_POOL_MAXSIZE', 32)      # 每个主机保持的最大连接数
+HTTP_RETRIES = getattr(config, 'HTTP_RETRIES', 3)                 # 连接错误 / 5xx 的重试次数
+HTTP_BACKOFF = getattr(config, 'HTTP_BACKOFF', 0.5)               # 重试退避系数（秒）
+
+_stats_lock = threading.Lock()
+_stats = {'requests': 0, 'new_connections': 0}
+
+
+def _count(key: str):
+    with _stats_lock:
+        _stats[key] += 1
+
+
+class _CountingPoolMixin:
+    """统计从连接池取连接的次数与新建连接的次数"""
+
+    def _get_conn(self, timeout=None):
+        _count('requests')
+        return super()._get_conn(timeout)
+
+    def _new_conn(self):
+        _count('new_connections')
+        return super()._new_conn()
+
+
+class CountingHTTPConnectionPool(_CountingPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class CountingHTTPSConnectionPool(_CountingPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class PooledAdapter(HTTPAdapter):
+    """使用带统计的连接池类的 HTTPAdapter"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CountingHTTPConnectionPool,
+            'https': CountingHTTPSConnectionPool,
+        }
+
+
+def build_session() -> requests.Session:
+    """创建带连接池与重试策略的 Session"""
+    retry = Retry(
+        total=HTTP_RETRIES,
+        backoff_factor=HTTP_BACKOFF,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset(['GET', 'HEAD']),   # POST 提交任务不做状态码重试，避免重复提交
+        raise_on_status=False,
+    )
+    adapter = PooledAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=HTTP_POOL_MAXSIZE,
+                            max_retries=retry, pool_block=False)
+    s = requests.Session()
+    s.mount('https://', adapter)
+    s.mount('http://', adapter)
+    return s
+
+
+session = build_session()
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return session.get(url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return session.post(url, **kwargs)
+
+
+def pool_stats() -> Dict[str, int]:
+    """连接池统计：hits 为复用已有连接的次数，misses 为新建连接的次数"""
+    with _stats_lock:
+        total = _stats['requests']
+        misses = _stats['new_connections']
+    return {'requests': total, 'hits': max(total - misses, 0), 'misses': misses}
@@ -1,44 +1,39 @@
+import os
 import base64
+import asyncio
 import logging
 import re
-# from io import BytesIO  # 新增：用于内存中处理图片
-# from PIL import Image  # 新增：用于图片格式转换
-from openai import OpenAI
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO  # 用于内存中处理图片
+from typing import Any, Dict, Iterator, List, Tuple, Union
+from PIL import Image  # 用于图片缩放与格式转换
+from openai import OpenAI, AsyncOpenAI
 
-def analyze_image(image_path, api_key):
-    """调用Qwen3-VL API分析图片"""
-    try:
-        # 读取并转换图片为WebP格式（关键修改）
-        # try:
-        #     with Image.open(image_path) as img:
-        #         # 创建内存缓冲区存储转换后的WebP数据
-        #         webp_buffer = BytesIO()
-        #         # 转换为WebP格式（quality可调整，1-100）
-        #         img.save(webp_buffer, format="WebP", quality=90)
-        #         # 移动到缓冲区起始位置，读取二进制数据
-        #         webp_buffer.seek(0)
-        #         # 编码为base64
-        #         base64_image = base64.b64encode(webp_buffer.read()).decode("utf-8")
-        # except Exception as e:
-        #     error_msg = f"图片格式转换失败（可能原图损坏或格式不支持）: {str(e)}"
-        #     logging.error(error_msg)
-        #     return False, error_msg
-        
-        # 读取并编码图片
-        with open(image_path, "rb") as image_file:
-            base64_image = base64.b64encode(image_file.read()).decode("utf-8")
-        
-        # 使用Qwen3-VL反推
-        try:
-            # 初始化OpenAI客户端
-            client = OpenAI(
-                base_url='https://api-inference.modelscope.cn/v1',
-                # api_key= api_key,
-                api_key= "ms-" + api_key,   #老版本的 KEY
-            )
-            
-            # 构建提示词，包含用户要求的所有反推要点
-            prompt = """在完全遵循图片内容的情况下，直接返回图片描述内容。生成一段 300 字以内类似下面这段提示词的提示词，并且注重描述画面的真实感，需要描述画面风格（如真实人像摄影、中国水墨画，油画，水彩画等）、画面中光线或明暗程度，镜头角度，画面构图比例等，如果是人像摄影，涉及到人脸脸部特写镜头需要描述人物表情，皮肤细节，人物性别国籍，如果是全身则需要描述清楚人物的姿势造型。如果是中国画等绘画作品需要描述具体的画种风格，这些描述都需要用自然语言回答，不要出现精准的数字，不允许出现特殊符号。
+import config
+import metrics
+from prompt_cache import PromptCache, prompt_cache, make_key
+from single_flight import SingleFlight
+
+ANALYZER_BASE_URL = getattr(config, 'ANALYZER_BASE_URL', 'https://api-inference.modelscope.cn/v1')
+ANALYZER_MODEL = 'Qwen/Qwen3-VL-30B-A3B-Instruct'
+# ANALYZER_MODEL = 'Qwen/Qwen2.5-VL-72B-Instruct'  # ModelScope Model-Id
+# ANALYZER_MODEL = 'Qwen/Qwen3-VL-235B-A22B-Instruct'  # ModelScope Model-Id
+ANALYZER_TIMEOUT = 60.0  # 增加超时时间
+ANALYZER_BATCH_CONCURRENCY = getattr(config, 'ANALYZER_BATCH_CONCURRENCY', 4)   # 批量反推的并发数
+ANALYZER_MAX_EDGE = getattr(config, 'ANALYZER_MAX_EDGE', 1536)             # 上传前长边的最大像素
+ANALYZER_IMAGE_FORMAT = getattr(config, 'ANALYZER_IMAGE_FORMAT', 'WEBP')   # 重新编码的格式：WEBP 或 JPEG
+ANALYZER_IMAGE_QUALITY = getattr(config, 'ANALYZER_IMAGE_QUALITY', 85)     # 重新编码的质量（1-100）
+
+# 反推接口接受文件路径或内存中的图片内容（如 ImageBuffer.view() 返回的 memoryview）
+ImageData = Union[bytes, bytearray, memoryview]
+ImageSource = Union[str, os.PathLike, ImageData]
+
+IMAGE_MIME_TYPES = {'WEBP': 'image/webp', 'JPEG': 'image/jpeg', 'PNG': 'image/png', 'GIF': 'image/gif', 'BMP': 'image/bmp'}
+
+# 构建提示词，包含用户要求的所有反推要点
+ANALYZE_PROMPT = """在完全遵循图片内容的情况下，直接返回图片描述内容。生成一段 300 字以内类似下面这段提示词的提示词，并且注重描述画面的真实感，需要描述画面风格（如真实人像摄影、中国水墨画，油画，水彩画等）、画面中光线或明暗程度，镜头角度，画面构图比例等，如果是人像摄影，涉及到人脸脸部特写镜头需要描述人物表情，皮肤细节，人物性别国籍，如果是全身则需要描述清楚人物的姿势造型。如果是中国画等绘画作品需要描述具体的画种风格，这些描述都需要用自然语言回答，不要出现精准的数字，不允许出现特殊符号。
 ## 原则
     1. 使用**客观、精确和基于事实的语言**。撰写技巧：主体场景+画质风格+构图视角+光线氛围+技术参数，前后可以接关键词。
     2. 不要描述象征性的含义或氛围（例如，“传达决心”、“增强情绪”、“强调奋斗”、“营造神秘感”）。
@@ -54,61 +49,402 @@ def analyze_image(image_path, api_key):
 脸部特写：皮肤呈现自然光泽，毛孔细节锐利；眼神看向镜头方向，画面干净柔和，富士胶片色调，50mm镜头带来的浅景深效果。
 衣物细节：上衣褶皱随动作自然起伏，红色镶边边缘锐利；下裙面料垂坠感明显，腰带系结纹理清晰；飘带边缘柔和，布艺花饰的针脚与色彩过渡细腻。
 背景元素：窗帘纹理均匀，座椅布套花纹细节锐利（色彩柔和）。整体在均匀光线下，皮肤、发丝、衣物、配饰的质感高度还原，呈现真实细节。"""
-            
-            # 发送请求
-            response = client.chat.completions.create(
-                model='Qwen/Qwen3-VL-30B-A3B-Instruct',
-                # model='Qwen/Qwen2.5-VL-72B-Instruct',  # ModelScope Model-Id
-                # model='Qwen/Qwen3-VL-235B-A22B-Instruct',  # ModelScope Model-Id
-                messages=[{
-                    'role': 'user',
-                    'content': [{
-                        'type': 'text',
-                        'text': prompt,
-                    }, {
-                        'type': 'image_url',
-                        'image_url': {
-                            'url': f"data:image/png;base64,{base64_image}",
-                            # 'url': f"data:image/webp;base64,{base64_image}",
-                        },
-                    }],
-                }],
+
+
+def build_messages(base64_image: str, mime_type: str = 'image/png') -> List[Dict]:
+    """构建包含提示词与图片的对话消息"""
+    return [{
+        'role': 'user',
+        'content': [{
+            'type': 'text',
+            'text': ANALYZE_PROMPT,
+        }, {
+            'type': 'image_url',
+            'image_url': {
+                'url': f"data:{mime_type};base64,{base64_image}",
+            },
+        }],
+    }]
+
+
+MAX_PROMPT_CHARS = 500        # 反推结果的最大字数
+MIN_TRUNCATED_CHARS = 400     # 截断时至少保留的字数
+
+
+def truncate_content(filtered_content: str) -> str:
+    """把结果限制在500字以内，尽量在句号或逗号处截断，避免破坏句子结构"""
+    if len(filtered_content) <= MAX_PROMPT_CHARS:
+        return filtered_content
+
+    truncated_content = filtered_content[:MAX_PROMPT_CHARS]
+    last_period = truncated_content.rfind('。')
+    last_comma = truncated_content.rfind('，')
+
+    if last_period > MIN_TRUNCATED_CHARS:  # 确保截断后至少保留400个字符
+        return truncated_content[:last_period + 1]
+    elif last_comma > MIN_TRUNCATED_CHARS:
+        return truncated_content[:last_comma + 1]
+    return truncated_content
+
+
+def clean_content(content: str) -> str:
+    """去除多余的空白，并把结果限制在500字以内"""
+    # 去除多余的空格和换行
+    return truncate_content(re.sub(r'\s+', ' ', content).strip())
+
+
+class IncrementalCleaner:
+    """
+    clean_content 的增量版本：逐段输入流式返回的文本，返回可以立即下发的部分
+    前400字不会被截断，可以直接下发；之后的文本缓存到确定截断位置后再下发
+    """
+
+    def __init__(self):
+        self.text = ''
+        self.emitted = 0
+        self.pending_space = False
+        self.finished = False
+
+    def feed(self, chunk: str) -> str:
+        if self.finished:
+            return ''
+        for ch in chunk:
+            if ch.isspace():
+                # 开头的空白直接丢弃，连续空白合并为一个空格
+                self.pending_space = bool(self.text)
+                continue
+            if self.pending_space:
+                self.text += ' '
+                self.pending_space = False
+            self.text += ch
+            if len(self.text) > MAX_PROMPT_CHARS:
+                return self._emit(truncate_content(self.text), final=True)
+        return self._emit(self.text[:MIN_TRUNCATED_CHARS])
+
+    def finish(self) -> str:
+        """输入结束，返回剩余的文本"""
+        if self.finished:
+            return ''
+        return self._emit(self.text, final=True)
+
+    def _emit(self, visible: str, final: bool = False) -> str:
+        if final:
+            self.text = visible
+            self.finished = True
+        delta = visible[self.emitted:]
+        self.emitted = max(self.emitted, len(visible))
+        return delta
+
+
+def parse_response(response) -> Tuple[bool, str]:
+    """处理API响应"""
+    if response and response.choices and len(response.choices) > 0:
+        content = response.choices[0].message.content
+        if content:
+            return True, clean_content(content)
+        return False, "未获取到反推结果，请重试。"
+    return False, "Qwen3-VL API返回格式异常。"
+
+
+def read_image_bytes(image_path: str) -> bytes:
+    """读取图片内容"""
+    with open(image_path, "rb") as image_file:
+        return image_file.read()
+
+
+def load_image(image: ImageSource) -> ImageData:
+    """图片可以是文件路径，也可以是内存中的 bytes/memoryview（后者不复制直接使用）"""
+    if isinstance(image, (str, os.PathLike)):
+        return read_image_bytes(image)
+    return image
+
+
+def encode_image(image_bytes: ImageData) -> str:
+    """编码图片为base64"""
+    return base64.b64encode(image_bytes).decode("utf-8")
+
+
+def prepare_image(image_bytes: ImageData, max_edge: int = ANALYZER_MAX_EDGE, image_format: str = ANALYZER_IMAGE_FORMAT,
+                  quality: int = ANALYZER_IMAGE_QUALITY) -> Tuple[ImageData, str, Dict[str, Any]]:
+    """
+    在内存中把图片的长边限制在 max_edge 以内，并重新编码为 WebP/JPEG
+
+    Returns:
+        Tuple[payload, mime_type, stats]: 上传的字节、对应的MIME类型，以及原始/发送字节数等统计
+    """
+    stats = {'original_bytes': len(image_bytes), 'sent_bytes': len(image_bytes), 'resized': False}
+    try:
+        with Image.open(BytesIO(image_bytes)) as img:
+            original_mime = IMAGE_MIME_TYPES.get(img.format, 'image/png')
+            stats['original_size'] = img.size
+            img.seek(0)   # 动图只取第一帧
+
+            if max(img.size) > max_edge:
+                img = img.copy()
+                img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+                stats['resized'] = True
+
+            fmt = image_format.upper()
+            if fmt == 'JPEG':
+                img = img.convert('RGB')
+            elif img.mode not in ('RGB', 'RGBA'):
+                img = img.convert('RGBA' if 'A' in img.getbands() or 'transparency' in img.info else 'RGB')
+
+            buffer = BytesIO()
+            img.save(buffer, format=fmt, quality=quality)
+            payload = buffer.getvalue()
+            stats['sent_size'] = img.size
+    except Exception as e:
+        logging.warning(f"图片预处理失败（可能原图损坏或格式不支持），使用原图上传: {e}")
+        return image_bytes, 'image/png', stats
+
+    # 未缩放且重新编码后反而更大时，直接上传原图
+    if not stats['resized'] and len(payload) >= len(image_bytes):
+        return image_bytes, original_mime, stats
+
+    stats['sent_bytes'] = len(payload)
+    return payload, IMAGE_MIME_TYPES.get(image_format.upper(), 'image/webp'), stats
+
+
+class ImageAnalyzer:
+    """
+    Qwen3-VL 反推服务
+    每个 API Key 只创建一个长期存活的客户端，复用其连接池；
+    提供同步、异步以及有界并发的批量反推接口，结果按图片内容缓存
+    """
+
+    def __init__(self, base_url: str = ANALYZER_BASE_URL, model: str = ANALYZER_MODEL,
+                 batch_concurrency: int = ANALYZER_BATCH_CONCURRENCY, cache: PromptCache = prompt_cache):
+        self.base_url = base_url
+        self.model = model
+        self.cache = cache
+        self._clients: Dict[str, OpenAI] = {}
+        self._async_clients: Dict[str, AsyncOpenAI] = {}
+        self._lock = threading.Lock()
+        self._batch_pool = ThreadPoolExecutor(max_workers=batch_concurrency, thread_name_prefix='image-analyze')
+        self._stats = {'requests': 0, 'original_bytes': 0, 'sent_bytes': 0, 'total_seconds': 0.0}
+        # 同一张图片同时只调用一次模型，按缓存键（图片内容哈希）合并
+        self.flight = SingleFlight('analysis')
+        # 预处理参数会影响反推结果，一并计入缓存键
+        self.cache_model_key = f"{model}@{ANALYZER_MAX_EDGE}/{ANALYZER_IMAGE_FORMAT}/{ANALYZER_IMAGE_QUALITY}"
+
+    def client(self, api_key: str) -> OpenAI:
+        with self._lock:
+            if api_key not in self._clients:
+                self._clients[api_key] = OpenAI(
+                    base_url=self.base_url,
+                    # api_key= api_key,
+                    api_key="ms-" + api_key,   #老版本的 KEY
+                )
+            return self._clients[api_key]
+
+    def async_client(self, api_key: str) -> AsyncOpenAI:
+        """异步客户端的连接绑定在事件循环上，应在同一个长期运行的事件循环中使用"""
+        with self._lock:
+            if api_key not in self._async_clients:
+                self._async_clients[api_key] = AsyncOpenAI(
+                    base_url=self.base_url,
+                    api_key="ms-" + api_key,
+                )
+            return self._async_clients[api_key]
+
+    def analyze(self, image: ImageSource, api_key: str, force_refresh: bool = False) -> Tuple[bool, str]:
+        """调用Qwen3-VL API分析图片（路径或内存中的图片），force_refresh 为 True 时跳过缓存"""
+        try:
+            image_bytes = load_image(image)
+        except Exception as e:
+            error_msg = f"反推图片时出错: {str(e)}"
+            logging.error(error_msg)
+            return False, error_msg
+
+        cache_key = make_key(image_bytes, self.cache_model_key, ANALYZE_PROMPT)
+        if not force_refresh:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return True, cached
+
+        result, _ = self.flight.do(cache_key, lambda: self._analyze_uncached(image_bytes, api_key, cache_key))
+        return result
+
+    def _analyze_uncached(self, image_bytes: ImageData, api_key: str, cache_key: str) -> Tuple[bool, str]:
+        # 使用Qwen3-VL反推
+        started = time.monotonic()
+        try:
+            payload, mime_type, image_stats = prepare_image(image_bytes)
+            response = self.client(api_key).chat.completions.create(
+                model=self.model,
+                messages=build_messages(encode_image(payload), mime_type),
                 stream=False,
-                timeout=60.0,  # 增加超时时间
+                timeout=ANALYZER_TIMEOUT,
             )
-            
-            # 处理响应
-            if response and response.choices and len(response.choices) > 0:
-                content = response.choices[0].message.content
-                
-                if content:
-                    # 去除多余的空格和换行
-                    filtered_content = re.sub(r'\s+', ' ', content).strip()
-                    
-                    # 限制字符数在500以内
-                    if len(filtered_content) > 500:
-                        # 尝试在合适的位置截断，避免破坏句子结构
-                        truncated_content = filtered_content[:500]
-                        last_period = truncated_content.rfind('。')
-                        last_comma = truncated_content.rfind('，')
-                        
-                        if last_period > 400:  # 确保截断后至少保留400个字符
-                            filtered_content = truncated_content[:last_period + 1]
-                        elif last_comma > 400:
-                            filtered_content = truncated_content[:last_comma + 1]
-                        else:
-                            filtered_content = truncated_content
-                    
-                    return True, filtered_content
-                else:
-                    return False, "未获取到反推结果，请重试。"
-            else:
-                return False, "Qwen3-VL API返回格式异常。"
+            success, result = parse_response(response)
         except Exception as e:
             error_msg = f"Qwen3-VL反推时出错: {str(e)}"
             logging.error(error_msg)
+            metrics.analyze_seconds.observe(time.monotonic() - started, mode='sync', outcome='error')
             return False, error_msg
-    except Exception as e:
-        error_msg = f"反推图片时出错: {str(e)}"
-        logging.error(error_msg)
-        return False, error_msg
+        self._record(image_stats, started, 'sync')
+
+        if success:
+            self.cache.put(cache_key, result)
+        return success, result
+
+    async def analyze_async(self, image: ImageSource, api_key: str, force_refresh: bool = False) -> Tuple[bool, str]:
+        """analyze 的异步版本，基于 AsyncOpenAI"""
+        try:
+            image_bytes = await asyncio.to_thread(load_image, image)
+        except Exception as e:
+            error_msg = f"反推图片时出错: {str(e)}"
+            logging.error(error_msg)
+            return False, error_msg
+
+        cache_key = make_key(image_bytes, self.cache_model_key, ANALYZE_PROMPT)
+        if not force_refresh:
+            cached = await asyncio.to_thread(self.cache.get, cache_key)
+            if cached is not None:
+                return True, cached
+
+        result, _ = await self.flight.do_async(
+            cache_key, lambda: self._analyze_uncached_async(image_bytes, api_key, cache_key))
+        return result
+
+    async def _analyze_uncached_async(self, image_bytes: ImageData, api_key: str, cache_key: str) -> Tuple[bool, str]:
+        started = time.monotonic()
+        try:
+            payload, mime_type, image_stats = await asyncio.to_thread(prepare_image, image_bytes)
+            response = await self.async_client(api_key).chat.completions.create(
+                model=self.model,
+                messages=build_messages(encode_image(payload), mime_type),
+                stream=False,
+                timeout=ANALYZER_TIMEOUT,
+            )
+            success, result = parse_response(response)
+        except Exception as e:
+            error_msg = f"Qwen3-VL反推时出错: {str(e)}"
+            logging.error(error_msg)
+            metrics.analyze_seconds.observe(time.monotonic() - started, mode='async', outcome='error')
+            return False, error_msg
+        self._record(image_stats, started, 'async')
+
+        if success:
+            await asyncio.to_thread(self.cache.put, cache_key, result)
+        return success, result
+
+    def analyze_stream(self, image: ImageSource, api_key: str, force_refresh: bool = False) -> Iterator[Tuple[str, str]]:
+        """
+        流式反推，边生成边返回清理后的文本
+
+        Yields:
+            Tuple[event, text]: ('delta', 新增文本)，最后是 ('done', 完整结果) 或 ('error', 错误信息)
+        """
+        try:
+            image_bytes = load_image(image)
+        except Exception as e:
+            error_msg = f"反推图片时出错: {str(e)}"
+            logging.error(error_msg)
+            yield 'error', error_msg
+            return
+
+        cache_key = make_key(image_bytes, self.cache_model_key, ANALYZE_PROMPT)
+        if not force_refresh:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                yield 'delta', cached
+                yield 'done', cached
+                return
+
+        # 同一张图片正在反推时直接等待其结果；流式调用本身也登记为进行中，供其他请求合并
+        future, leader = self.flight.begin(cache_key)
+        if not leader:
+            success, text = future.result()
+            if success:
+                yield 'delta', text
+                yield 'done', text
+            else:
+                yield 'error', text
+            return
+
+        outcome = (False, "反推请求已中断，请重试。")
+        try:
+            for event, text in self._stream_uncached(image_bytes, api_key, cache_key):
+                if event != 'delta':
+                    outcome = (event == 'done', text)
+                yield event, text
+        finally:
+            future.set_result(outcome)
+            self.flight.forget(cache_key, future)
+
+    def _stream_uncached(self, image_bytes: ImageData, api_key: str, cache_key: str) -> Iterator[Tuple[str, str]]:
+        started = time.monotonic()
+        cleaner = IncrementalCleaner()
+        try:
+            payload, mime_type, image_stats = prepare_image(image_bytes)
+            stream = self.client(api_key).chat.completions.create(
+                model=self.model,
+                messages=build_messages(encode_image(payload), mime_type),
+                stream=True,
+                timeout=ANALYZER_TIMEOUT,
+            )
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = cleaner.feed(chunk.choices[0].delta.content or '')
+                if delta:
+                    yield 'delta', delta
+                if cleaner.finished:
+                    stream.close()
+                    break
+            delta = cleaner.finish()
+            if delta:
+                yield 'delta', delta
+        except Exception as e:
+            error_msg = f"Qwen3-VL反推时出错: {str(e)}"
+            logging.error(error_msg)
+            metrics.analyze_seconds.observe(time.monotonic() - started, mode='stream', outcome='error')
+            yield 'error', error_msg
+            return
+
+        self._record(image_stats, started, 'stream')
+        if not cleaner.text:
+            yield 'error', "未获取到反推结果，请重试。"
+            return
+        self.cache.put(cache_key, cleaner.text)
+        yield 'done', cleaner.text
+
+    def _record(self, image_stats: Dict[str, Any], started: float, mode: str):
+        """记录一次反推的上传字节数与端到端耗时，mode 为 sync / async / stream"""
+        elapsed = time.monotonic() - started
+        metrics.analyze_seconds.observe(elapsed, mode=mode, outcome='ok')
+        metrics.analyze_payload_bytes.observe(image_stats['sent_bytes'], mode=mode)
+        saved = image_stats['original_bytes'] - image_stats['sent_bytes']
+        logging.info(f"反推完成，耗时{elapsed:.2f}s，原图{image_stats['original_bytes']}字节，"
+                     f"上传{image_stats['sent_bytes']}字节，节省{saved}字节")
+        with self._lock:
+            self._stats['requests'] += 1
+            self._stats['original_bytes'] += image_stats['original_bytes']
+            self._stats['sent_bytes'] += image_stats['sent_bytes']
+            self._stats['total_seconds'] += elapsed
+
+    def stats(self) -> Dict[str, Any]:
+        """累计的上传字节数、节省字节数与平均耗时"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['bytes_saved'] = stats['original_bytes'] - stats['sent_bytes']
+        stats['avg_seconds'] = round(stats['total_seconds'] / stats['requests'], 3) if stats['requests'] else 0.0
+        stats['total_seconds'] = round(stats['total_seconds'], 3)
+        return stats
+
+    def analyze_batch(self, images: List[ImageSource], api_key: str, force_refresh: bool = False) -> List[Tuple[bool, str]]:
+        """以有界并发同时反推多张图片，结果顺序与 images 一致"""
+        futures = [self._batch_pool.submit(self.analyze, image, api_key, force_refresh) for image in images]
+        return [future.result() for future in futures]
+
+
+image_analyzer = ImageAnalyzer()
+metrics.Gauge('analyses_in_flight', '正在进行的 Qwen3-VL 反推数（合并后）',
+              fn=lambda: image_analyzer.flight.stats()['in_flight'])
+
+
+def analyze_image(image, api_key, force_refresh=False):
+    """调用Qwen3-VL API分析图片，image 为文件路径或内存中的图片内容"""
+    return image_analyzer.analyze(image, api_key, force_refresh)
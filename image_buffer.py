@@ -0,0 +1,239 @@
+"""
+内存图片缓冲
+上传与下载的图片直接写入有界缓冲区，以 memoryview 交给预处理与base64编码，不再先落盘再读回；
+超过 IMAGE_SPILL_THRESHOLD 的图片才转存到匿名临时文件（创建后即删除，进程退出也不会残留），
+关闭缓冲区时立即释放内存或临时文件
+"""
+
+import io
+import os
+import mmap
+import time
+import uuid
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from werkzeug.utils import secure_filename
+
+import config
+import http_client
+import metrics
+from config import UPLOAD_FOLDER, MAX_CONTENT_LENGTH
+
+IMAGE_SPILL_THRESHOLD = getattr(config, 'IMAGE_SPILL_THRESHOLD', 8 * 1024 * 1024)   # 超过该大小转存到临时文件
+IMAGE_MAX_BYTES = getattr(config, 'IMAGE_MAX_BYTES', MAX_CONTENT_LENGTH)            # 单张图片的最大字节数
+IMAGE_DOWNLOAD_TIMEOUT = getattr(config, 'IMAGE_DOWNLOAD_TIMEOUT', 30)              # 下载图片的超时（秒）
+UPLOAD_STORE_MAX_ENTRIES = getattr(config, 'UPLOAD_STORE_MAX_ENTRIES', 64)          # 内存中最多保留的上传图片数
+UPLOAD_STORE_TTL = getattr(config, 'UPLOAD_STORE_TTL', 3600)                        # 上传后未反推的图片保留时间（秒）
+CHUNK_SIZE = 64 * 1024
+
+
+class ImageTooLarge(ValueError):
+    """图片超过 IMAGE_MAX_BYTES"""
+
+
+class ImageBuffer:
+    """
+    有界的图片缓冲区，小图保存在 BytesIO 中，超过阈值后转存到匿名临时文件
+
+    用法：
+        with ImageBuffer() as buf:
+            buf.fill(chunks)
+            analyze(buf.view())
+    """
+
+    def __init__(self, spill_threshold: int = IMAGE_SPILL_THRESHOLD, max_bytes: int = IMAGE_MAX_BYTES,
+                 spill_dir: str = UPLOAD_FOLDER):
+        self.spill_threshold = spill_threshold
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.size = 0
+        self.spilled = False
+        self._file = io.BytesIO()
+        self._mmap: Optional[mmap.mmap] = None
+        self._views: List[memoryview] = []
+        self.closed = False
+
+    def write(self, data) -> int:
+        if self._views:
+            raise ValueError('图片缓冲区已被读取，不能再写入')
+        if self.max_bytes and self.size + len(data) > self.max_bytes:
+            raise ImageTooLarge(f'图片超过大小上限{self.max_bytes}字节')
+        if not self.spilled and self.size + len(data) > self.spill_threshold:
+            self._spill()
+        self._file.write(data)
+        self.size += len(data)
+        return len(data)
+
+    def fill(self, chunks: Iterable[bytes]) -> 'ImageBuffer':
+        for chunk in chunks:
+            if chunk:
+                self.write(chunk)
+        return self
+
+    def _spill(self):
+        os.makedirs(self.spill_dir, exist_ok=True)
+        spill = tempfile.TemporaryFile(dir=self.spill_dir, prefix='image_')
+        spill.write(self._file.getbuffer())
+        self._file.close()
+        self._file = spill
+        self.spilled = True
+        logging.info(f'图片超过{self.spill_threshold}字节，转存到临时文件')
+
+    def view(self) -> memoryview:
+        """只读视图：内存中的图片不复制，临时文件通过mmap映射；关闭缓冲区时一并释放"""
+        view = self._view()
+        self._views.append(view)
+        return view
+
+    def getvalue(self) -> bytes:
+        with self._view() as view:
+            return bytes(view)
+
+    def _view(self) -> memoryview:
+        if self.closed:
+            raise ValueError('图片缓冲区已关闭')
+        if not self.size:
+            return memoryview(b'')
+        if self.spilled:
+            if self._mmap is None:
+                self._file.flush()
+                self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            return memoryview(self._mmap)
+        return self._file.getbuffer().toreadonly()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for view in self._views:
+            try:
+                view.release()
+            except BufferError:
+                pass
+        self._views.clear()
+        try:
+            if self._mmap is not None:
+                self._mmap.close()
+            self._file.close()
+        except BufferError as e:
+            # 仍有切片引用着缓冲区，交给垃圾回收
+            logging.warning(f'图片缓冲区仍被引用，延迟释放: {e}')
+
+    def __enter__(self) -> 'ImageBuffer':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_stream(stream, **kwargs) -> ImageBuffer:
+    """把文件流（如上传的 FileStorage.stream）读入缓冲区"""
+    buf = ImageBuffer(**kwargs)
+    try:
+        return buf.fill(iter(lambda: stream.read(CHUNK_SIZE), b''))
+    except Exception:
+        buf.close()
+        raise
+
+
+def download_image(url: str, timeout: float = IMAGE_DOWNLOAD_TIMEOUT, **kwargs) -> ImageBuffer:
+    """下载图片到缓冲区，Content-Length 已超过上限时不下载"""
+    buf = ImageBuffer(**kwargs)
+    started = time.monotonic()
+    try:
+        with http_client.get(url, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            length = response.headers.get('Content-Length')
+            if length and length.isdigit() and buf.max_bytes and int(length) > buf.max_bytes:
+                raise ImageTooLarge(f'图片超过大小上限{buf.max_bytes}字节')
+            buf.fill(response.iter_content(chunk_size=CHUNK_SIZE))
+    except Exception:
+        buf.close()
+        raise
+    finally:
+        metrics.download_seconds.observe(time.monotonic() - started, kind='analyze')
+    metrics.download_bytes.observe(buf.size, kind='analyze')
+    return buf
+
+
+async def download_image_async(client, url: str, timeout: float = IMAGE_DOWNLOAD_TIMEOUT, **kwargs) -> ImageBuffer:
+    """download_image 的异步版本，client 为 httpx.AsyncClient"""
+    buf = ImageBuffer(**kwargs)
+    started = time.monotonic()
+    try:
+        async with client.stream('GET', url, timeout=timeout) as response:
+            response.raise_for_status()
+            length = response.headers.get('Content-Length')
+            if length and length.isdigit() and buf.max_bytes and int(length) > buf.max_bytes:
+                raise ImageTooLarge(f'图片超过大小上限{buf.max_bytes}字节')
+            async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                if chunk:
+                    buf.write(chunk)
+    except Exception:
+        buf.close()
+        raise
+    finally:
+        metrics.download_seconds.observe(time.monotonic() - started, kind='analyze')
+    metrics.download_bytes.observe(buf.size, kind='analyze')
+    return buf
+
+
+class UploadStore:
+    """
+    /upload 到 /analyze 之间暂存上传图片的内存表
+    条目数有上限、超时自动释放，取出后由调用方负责关闭
+    """
+
+    def __init__(self, max_entries: int = UPLOAD_STORE_MAX_ENTRIES, ttl: float = UPLOAD_STORE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[str, Tuple[ImageBuffer, float]]' = OrderedDict()
+
+    def put(self, filename: str, buf: ImageBuffer) -> str:
+        """保存上传图片，返回唯一的上传ID（同时用作预览文件名）"""
+        upload_id = f'{uuid.uuid4().hex[:12]}_{secure_filename(filename) or "image"}'
+        with self._lock:
+            self._expire()
+            while len(self._entries) >= self.max_entries:
+                _, (old, _) = self._entries.popitem(last=False)
+                old.close()
+            self._entries[upload_id] = (buf, time.time())
+        return upload_id
+
+    def pop(self, upload_id: str) -> Optional[ImageBuffer]:
+        with self._lock:
+            entry = self._entries.pop(upload_id, None)
+        return entry[0] if entry else None
+
+    def __contains__(self, upload_id: str) -> bool:
+        with self._lock:
+            return upload_id in self._entries
+
+    def read(self, upload_id: str) -> Optional[bytes]:
+        """复制一份图片内容（用于预览），不影响之后的反推"""
+        with self._lock:
+            entry = self._entries.get(upload_id)
+            return entry[0].getvalue() if entry else None
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            buffers = [buf for buf, _ in self._entries.values()]
+            return {'entries': len(buffers), 'bytes': sum(buf.size for buf in buffers),
+                    'spilled': sum(1 for buf in buffers if buf.spilled)}
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        while self._entries:
+            upload_id, (buf, created_at) = next(iter(self._entries.items()))
+            if created_at >= cutoff:
+                break
+            del self._entries[upload_id]
+            buf.close()
+
+
+upload_store = UploadStore()
@@ -0,0 +1,472 @@
+"""
+异步生图任务管理模块
+提交接口立即返回本地任务ID，所有进行中的ModelScope任务由共享轮询调度器统一跟踪，
+客户端通过 GET /jobs/<job_id> 查询进度与结果，或订阅 GET /jobs/<job_id>/events 接收SSE推送；
+任务状态持久化到 task_store，服务重启后未结束的任务会继续轮询
+"""
+
+import json
+import time
+import asyncio
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable, Dict, List, Optional, Tuple, Any
+
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+
+import config
+import metrics
+from config import DEFAULT_WIDTH, DEFAULT_HEIGHT
+from account_pool import Lease, NoAccountAvailable, account_pool
+from archiver import archiver
+from poll_scheduler import poll_scheduler
+from adaptive_poll import AdaptiveInterval, poll_savings
+from task_store import TaskStore, task_store, COLUMNS
+from single_flight import SingleFlight, fingerprint
+from modelscope_api import (
+    DEFAULT_PROMPT_PREFIX, SUCCESS_STATUSES, FAILED_STATUSES, SESSION_EXPIRED_ERROR,
+    build_txt2img_request_body, submit_task, fetch_task_status, parse_task_status
+)
+
+# 可在config.py中覆盖的调度参数
+JOB_POLL_INTERVAL = getattr(config, 'JOB_POLL_INTERVAL', 3)        # 首次轮询间隔，也是自适应轮询的对照基线（秒）
+JOB_MAX_POLLS = getattr(config, 'JOB_MAX_POLLS', 60)                # 超时时间 = JOB_MAX_POLLS × JOB_POLL_INTERVAL 秒
+JOB_SUBMIT_WORKERS = getattr(config, 'JOB_SUBMIT_WORKERS', 4)       # 提交任务的线程数
+JOB_RETENTION = getattr(config, 'JOB_RETENTION', 3600)              # 已结束任务保留时间（秒）
+JOB_EVENTS_KEEPALIVE = getattr(config, 'JOB_EVENTS_KEEPALIVE', 15)  # SSE无更新时发送心跳的间隔（秒）
+JOB_COALESCE_WINDOW = getattr(config, 'JOB_COALESCE_WINDOW', 10)    # 多少秒内的相同请求视为重复提交而共享任务，0 表示不合并
+
+jobs_bp = Blueprint('jobs', __name__)
+
+# 本地任务状态
+STATUS_SUBMITTING = 'SUBMITTING'
+STATUS_COMPLETED = 'COMPLETED'
+STATUS_FAILED = 'FAILED'
+TERMINAL_STATUSES = (STATUS_COMPLETED, STATUS_FAILED)
+
+
+class Job:
+    """一个本地生图任务，对应一个ModelScope任务；cookie 为空时提交前从账号池分配"""
+
+    def __init__(self, cookie: str, request_body: Dict):
+        self.job_id = uuid.uuid4().hex
+        self.cookie = cookie
+        self.request_body = request_body
+        self.task_id: Optional[str] = None
+        self.status = STATUS_SUBMITTING
+        self.percent = 0
+        self.detail = ''
+        self.queue_position = None
+        self.queue_total = None
+        self.images: List[str] = []
+        self.prompt = ''
+        self.error: Optional[str] = None
+        self.polls = 0
+        self.pacer: Optional[AdaptiveInterval] = None
+        self.phases: Optional[metrics.TaskPhases] = None
+        self.lease: Optional[Lease] = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.done = threading.Event()
+        self.version = 0
+        self.saved_version = -1
+        # 账号不同的请求不合并；cookie 为空（由账号池分配）的请求之间可以合并
+        self.fingerprint = fingerprint({'cookie': cookie, 'request_body': request_body})
+        self._changed = threading.Condition()
+        self._done_callbacks: List[Callable[[], None]] = []
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> 'Job':
+        """从 task_store 的记录恢复任务"""
+        job = cls(record['cookie'], record['request_body'])
+        for column in COLUMNS:
+            setattr(job, column, record[column])
+        job.images = job.images or []
+        job.saved_version = job.version
+        if job.is_terminal:
+            job.done.set()
+        return job
+
+    def to_record(self) -> Dict[str, Any]:
+        return {column: getattr(self, column) for column in COLUMNS}
+
+    @property
+    def is_terminal(self) -> bool:
+        return self.status in TERMINAL_STATUSES
+
+    def touch(self):
+        """状态有变化：更新版本号并唤醒所有订阅者"""
+        with self._changed:
+            self.updated_at = time.time()
+            self.version += 1
+            self._changed.notify_all()
+
+    def wait_for_change(self, version: int, timeout: float) -> int:
+        """等待版本号超过 version，超时返回当前版本号"""
+        with self._changed:
+            self._changed.wait_for(lambda: self.version > version, timeout)
+            return self.version
+
+    def finish(self, status: str, error: Optional[str] = None):
+        self.status = status
+        self.error = error
+        self.done.set()
+        self.touch()
+        with self._changed:
+            callbacks, self._done_callbacks = self._done_callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def add_done_callback(self, callback: Callable[[], None]):
+        """任务结束时在轮询线程中调用 callback；已结束时立即调用"""
+        with self._changed:
+            if not self.done.is_set():
+                self._done_callbacks.append(callback)
+                return
+        callback()
+
+    async def wait_done(self, timeout: float) -> bool:
+        """异步等待任务结束，不占用线程；超时返回 False"""
+        loop = asyncio.get_running_loop()
+        finished = loop.create_future()
+
+        def wake():
+            try:
+                loop.call_soon_threadsafe(lambda: finished.done() or finished.set_result(True))
+            except RuntimeError:
+                pass   # 事件循环已关闭
+
+        self.add_done_callback(wake)
+        try:
+            return await asyncio.wait_for(finished, timeout)
+        except asyncio.TimeoutError:
+            return False
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'job_id': self.job_id,
+            'task_id': self.task_id,
+            'status': self.status,
+            'progress': self.percent,
+            'detail': self.detail,
+            'queue_position': self.queue_position,
+            'queue_total': self.queue_total,
+            'images': self.images,
+            'error': self.error,
+            'polls': self.polls,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at
+        }
+
+
+class JobManager:
+    """任务管理器：负责提交任务，并把进行中的任务交给共享轮询调度器"""
+
+    def __init__(self, poll_interval: float = JOB_POLL_INTERVAL, max_polls: int = JOB_MAX_POLLS,
+                 store: TaskStore = task_store):
+        self.poll_interval = poll_interval
+        self.max_polls = max_polls
+        self.store = store
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._submit_pool = ThreadPoolExecutor(max_workers=JOB_SUBMIT_WORKERS, thread_name_prefix='job-submit')
+        # 短时间内重复提交的相同请求（如连点两次）只提交一次，后来的请求直接共享同一个任务
+        self.flight = SingleFlight('generation')
+        self._flights: Dict[str, Future] = {}   # job_id -> 合并用的 Future
+
+    def submit(self, cookie: str, request_body: Dict, coalesce: bool = True) -> Job:
+        """
+        登记任务并在后台提交，立即返回
+        coalesce 为 True 时，JOB_COALESCE_WINDOW 秒内提交过的同账号、同请求体且未结束的任务直接返回该任务；
+        批量任务与用户明确要求重新生成时传 False，每次都提交新任务
+        """
+        job = Job(cookie, request_body)
+        if coalesce and JOB_COALESCE_WINDOW > 0:
+            shared = self._join(job)
+            if shared is not None:
+                logging.info(f'相同的生图请求正在进行，共享任务 {shared.job_id}')
+                return shared
+        else:
+            with self._lock:
+                self._jobs[job.job_id] = job
+        self._persist(job)
+        self._submit_pool.submit(self._submit, job)
+        self._evict_finished()
+        return job
+
+    def _join(self, job: Job) -> Optional[Job]:
+        """合并窗口内有相同的任务时返回它，否则由 job 发起新的合并并返回 None"""
+        while True:
+            future, leader = self.flight.begin(job.fingerprint)
+            if leader:
+                self._lead(job, future)
+                return None
+            shared = future.result()
+            if not shared.is_terminal and time.time() - shared.created_at <= JOB_COALESCE_WINDOW:
+                return shared
+            # 旧任务已结束或超过合并窗口：不再视为重复提交，结束旧任务的合并后重新登记
+            self.flight.forget(job.fingerprint, future)
+
+    def _lead(self, job: Job, future: Future):
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._flights[job.job_id] = future
+        future.set_result(job)
+
+    def _land(self, job: Job):
+        """任务结束，之后的相同请求重新提交"""
+        with self._lock:
+            future = self._flights.pop(job.job_id, None)
+        if future is not None:
+            self.flight.forget(job.fingerprint, future)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """先查内存，已被淘汰或重启前的任务从 task_store 读取"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            record = self.store.get(job_id)
+            job = Job.from_record(record) if record else None
+        return job
+
+    def resume(self) -> int:
+        """服务启动时重新加载未结束的任务并继续轮询，返回恢复的任务数"""
+        resumed = 0
+        for record in self.store.unfinished(TERMINAL_STATUSES):
+            job = Job.from_record(record)
+            if not job.task_id:
+                # 重启前尚未拿到ModelScope任务ID，无法确认是否已提交
+                job.finish(STATUS_FAILED, '服务重启时任务尚未提交完成，请重新提交')
+                self._persist(job)
+                continue
+            with self._lock:
+                if job.job_id in self._jobs:
+                    continue
+            future, leader = self.flight.begin(job.fingerprint)
+            if leader:
+                self._lead(job, future)
+            else:
+                # 重启前有多个相同请求体的任务在进行，各自继续轮询
+                with self._lock:
+                    self._jobs[job.job_id] = job
+            self._track(job)
+            resumed += 1
+        self.store.prune(TERMINAL_STATUSES)
+        if resumed:
+            logging.info(f'已恢复{resumed}个未完成的生图任务')
+        return resumed
+
+    def in_flight(self) -> List[Job]:
+        with self._lock:
+            return [job for job in self._jobs.values() if not job.is_terminal]
+
+    def count_in_flight(self) -> Dict[tuple, int]:
+        """按状态统计未结束的任务数，供 metrics 的 jobs_in_flight 抓取时调用"""
+        counts: Dict[tuple, int] = {}
+        for job in self.in_flight():
+            counts[(job.status,)] = counts.get((job.status,), 0) + 1
+        return counts
+
+    def _submit(self, job: Job):
+        try:
+            task_id, error = self._submit_with_accounts(job)
+            if not error:
+                job.task_id = task_id
+                if job.lease:
+                    job.lease.bind(task_id)
+        except Exception as e:
+            # 分配账号、登记任务等任何一步出错都不能让任务停在 SUBMITTING
+            logging.exception(f'任务 {job.job_id} 提交过程出错: {e}')
+            error = f'提交任务时出错: {e}'
+
+        if error:
+            if job.lease:
+                job.lease.release()
+                job.lease = None
+            job.finish(STATUS_FAILED, error)
+            self._persist(job)
+            self._land(job)
+            return
+
+        job.status = 'PENDING'
+        job.touch()
+        self._persist(job)
+        self._track(job)
+
+    def _submit_with_accounts(self, job: Job) -> Tuple[Optional[str], Optional[str]]:
+        """提交到ModelScope，返回 (task_id, error)；账号池分配的任务遇到会话过期时换账号重试"""
+        pooled = not job.cookie
+        tried: List[str] = []
+        task_id, error = None, None
+        while True:
+            if pooled:
+                try:
+                    job.lease = account_pool.acquire(exclude=tried)
+                except NoAccountAvailable as e:
+                    # 换过账号仍失败时保留最后一次的错误信息
+                    return None, error or str(e)
+                job.cookie = job.lease.cookie
+            try:
+                task_id, error = submit_task(job.cookie, job.request_body)
+            except Exception as e:
+                logging.error(f'任务 {job.job_id} 提交异常: {e}')
+                task_id, error = None, f'请求ModelScope API时出错: {e}'
+            if not (pooled and error == SESSION_EXPIRED_ERROR):
+                return task_id, error
+            # 会话过期的账号被隔离，换一个账号重新提交
+            tried.append(job.lease.account.name)
+            job.lease.release('expired')
+            job.lease = None
+
+    def _track(self, job: Job):
+        """把已提交的任务交给共享轮询调度器"""
+        job.pacer = AdaptiveInterval(self.poll_interval)
+        job.phases = metrics.TaskPhases('jobs')
+        if job.lease is None:
+            # 重启后恢复的任务：Cookie属于账号池时重新计入该账号的负载
+            job.lease = account_pool.attach(job.cookie, job.task_id)
+        poll_scheduler.watch(lambda: self._poll_once(job), self.poll_interval)
+
+    def _persist(self, job: Job):
+        """状态有变化时写入 task_store"""
+        version = job.version
+        if version != job.saved_version:
+            self.store.save(job.to_record())
+            job.saved_version = version
+
+    def _poll_once(self, job: Job) -> Optional[float]:
+        """查询一次任务状态，返回下次轮询的间隔，任务结束时返回 None"""
+        job.polls += 1
+        try:
+            parsed = parse_task_status(fetch_task_status(job.cookie, job.task_id))
+        except Exception as e:
+            logging.error(f'轮询任务 {job.task_id} 异常: {e}')
+            parsed = None
+
+        job.phases.update(parsed['status'] if parsed else None)
+        if parsed and parsed['status']:
+            job.pacer.update(parsed['percent'], parsed['queue_position'])
+            self._apply_status(job, parsed)
+            if job.lease:
+                job.lease.update(job.queue_position)
+        else:
+            job.pacer.failed()
+
+        outcome = job.status.lower()
+        if not job.is_terminal and job.pacer.elapsed() >= self.max_polls * self.poll_interval:
+            logging.error(f'任务 {job.task_id} 轮询超时')
+            job.finish(STATUS_FAILED, '任务超时，请稍后重试')
+            outcome = 'timeout'
+
+        self._persist(job)
+        if job.is_terminal:
+            self._land(job)
+            job.phases.finish(outcome)
+            if job.lease:
+                job.lease.release(outcome)
+            poll_savings.record(job.pacer, job.task_id)
+            return None
+        return job.pacer.next_delay()
+
+    def _apply_status(self, job: Job, parsed: Dict):
+        status = parsed['status']
+        job.percent = parsed['percent']
+        job.detail = parsed['detail']
+        job.queue_position = parsed['queue_position']
+        job.queue_total = parsed['queue_total']
+
+        if status in SUCCESS_STATUSES:
+            if not parsed['images']:
+                job.finish(STATUS_FAILED, parsed['error'])
+                return
+            job.images = parsed['images']
+            job.prompt = parsed['prompt']
+            job.percent = 100
+            # 先结束任务让客户端拿到URL，归档在后台队列中进行
+            job.finish(STATUS_COMPLETED)
+            archiver.enqueue(job.task_id, job.images, job.prompt, parsed['request_id'])
+        elif status in FAILED_STATUSES:
+            job.finish(STATUS_FAILED, f"任务失败: {parsed['error']}")
+        elif status:
+            job.status = status
+            job.touch()
+
+    def _evict_finished(self):
+        cutoff = time.time() - JOB_RETENTION
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items() if job.is_terminal and job.updated_at < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+
+job_manager = JobManager()
+metrics.Gauge('jobs_in_flight', '未结束的异步生图任务数', ('status',), fn=job_manager.count_in_flight)
+
+
+def submit_generate_job(data: Dict) -> Job:
+    """根据 /api/generate_image 风格的请求参数提交任务，账号由账号池分配；regenerate 为真时不与相同请求合并"""
+    prompt = data.get('prompt', '')
+    request_body = build_txt2img_request_body(DEFAULT_PROMPT_PREFIX + prompt, DEFAULT_WIDTH, DEFAULT_HEIGHT)
+    return job_manager.submit('', request_body, coalesce=not data.get('regenerate', False))
+
+
+@jobs_bp.route('/jobs', methods=['POST'])
+def create_job():
+    """提交生图任务，立即返回本地任务ID"""
+    data = request.get_json() or {}
+    if not data.get('prompt'):
+        return jsonify({'success': False, 'error': '请输入提示词'})
+    if not account_pool.accounts:
+        return jsonify({'success': False, 'error': 'Cookie未配置，请在config.py中设置MODEL_SCOPE_COOKIE'})
+
+    job = submit_generate_job(data)
+    return jsonify({'success': True, 'job_id': job.job_id, 'status': job.status})
+
+
+@jobs_bp.route('/jobs', methods=['GET'])
+def list_jobs():
+    """按状态与时间查询任务记录：?status=COMPLETED&since=<时间戳>&limit=50"""
+    records = job_manager.store.recent(status=request.args.get('status'),
+                                       since=request.args.get('since', 0, type=float),
+                                       limit=min(request.args.get('limit', 50, type=int), 500))
+    jobs = [Job.from_record(record).to_dict() for record in records]
+    return jsonify({'success': True, 'jobs': jobs, 'count': len(jobs)})
+
+
+@jobs_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """查询本地任务状态"""
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': '任务不存在或已过期'}), 404
+    return jsonify({'success': True, **job.to_dict()})
+
+
+@jobs_bp.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """
+    以SSE推送任务进度，数据来自共享轮询调度器，客户端无需自行轮询
+    事件：progress（排队位置、进度等）、done（最终结果，含图片URL），之后连接关闭
+    """
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': '任务不存在或已过期'}), 404
+
+    def generate():
+        version = -1
+        while True:
+            current = job.wait_for_change(version, JOB_EVENTS_KEEPALIVE)
+            if current == version:
+                yield ': keepalive\n\n'
+                continue
+            version = current
+            event = 'done' if job.is_terminal else 'progress'
+            payload = {'success': job.status == STATUS_COMPLETED or not job.is_terminal, **job.to_dict()}
+            yield f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+            if job.is_terminal:
+                return
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
@@ -0,0 +1,169 @@
+"""
+日志配置
+各模块通过 get_logger('组件名') 取得日志器，级别按组件分别配置（LOG_LEVELS），未开启的级别不做任何格式化；
+日志记录先放入有界队列，由后台线程格式化并写出，请求线程不会被慢终端阻塞；
+轮询类的重复日志按任务抽样输出，附加字段（extra）以 key=value 或JSON形式输出
+"""
+
+import copy
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+import config
+
+LOG_LEVEL = getattr(config, 'LOG_LEVEL', 'INFO')                   # 默认日志级别
+LOG_LEVELS = getattr(config, 'LOG_LEVELS', {})                     # 按组件覆盖，如 {'task_poller': 'WARNING'}
+LOG_FORMAT = getattr(config, 'LOG_FORMAT', 'text')                 # text 或 json
+LOG_QUEUE_SIZE = getattr(config, 'LOG_QUEUE_SIZE', 10000)          # 日志队列上限，写满时丢弃新日志
+LOG_SAMPLE_FIRST = getattr(config, 'LOG_SAMPLE_FIRST', 3)          # 每个任务的轮询日志先完整输出的条数
+LOG_SAMPLE_EVERY = getattr(config, 'LOG_SAMPLE_EVERY', 10)         # 之后每多少条输出一条
+
+ROOT_LOGGER = 'aigc'
+SAMPLE_KEYS = 1024   # 抽样计数最多跟踪的键数
+
+# LogRecord 的内置属性，其余属性视为通过 extra 传入的结构化字段
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'sample'}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_setup_lock = threading.Lock()
+_stats = {'dropped': 0, 'sampled_out': 0}
+_stats_lock = threading.Lock()   # 保护 dropped；sampled_out 在抽样过滤器的锁内更新
+
+
+def get_logger(component: str) -> logging.Logger:
+    """组件日志器，名称为 aigc.<component>，级别由 LOG_LEVELS 控制"""
+    return logging.getLogger(f'{ROOT_LOGGER}.{component}')
+
+
+class Lazy:
+    """延迟计算的日志参数，只有日志真正输出时才调用 fn"""
+
+    __slots__ = ('fn',)
+
+    def __init__(self, fn: Callable[[], Any]):
+        self.fn = fn
+
+    def __str__(self) -> str:
+        return str(self.fn())
+
+
+def lazy_json(obj: Any, limit: int = 2000) -> Lazy:
+    """延迟序列化的JSON，超过 limit 个字符时截断"""
+    def dump():
+        text = json.dumps(obj, ensure_ascii=False, default=str)
+        return text if len(text) <= limit else f'{text[:limit]}...（共{len(text)}字符）'
+    return Lazy(dump)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    通过 extra={'sample': key} 标记的日志按 key 抽样：前 first 条全部输出，之后每 every 条输出一条；
+    WARNING 及以上级别不抽样
+    """
+
+    def __init__(self, first: int = LOG_SAMPLE_FIRST, every: int = LOG_SAMPLE_EVERY):
+        super().__init__()
+        self.first = first
+        self.every = max(every, 1)
+        self._counts: 'OrderedDict[str, int]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = getattr(record, 'sample', None)
+        if key is None or record.levelno >= logging.WARNING:
+            return True
+        with self._lock:
+            count = self._counts.pop(key, 0) + 1
+            self._counts[key] = count
+            if len(self._counts) > SAMPLE_KEYS:
+                self._counts.popitem(last=False)
+            if count <= self.first or (count - self.first) % self.every == 0:
+                return True
+            _stats['sampled_out'] += 1
+        return False
+
+
+class StructuredFormatter(logging.Formatter):
+    """text: 时间 级别 组件 消息 key=value...；json: 每条日志一行JSON"""
+
+    def __init__(self, fmt: str = LOG_FORMAT):
+        super().__init__()
+        self.json = fmt == 'json'
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRS}
+        message = record.getMessage()
+        timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record.created))
+        component = record.name[len(ROOT_LOGGER) + 1:] if record.name.startswith(ROOT_LOGGER + '.') else record.name
+        # 经过队列的记录已把异常堆栈转成了 exc_text
+        exc_text = self.formatException(record.exc_info) if record.exc_info else record.exc_text
+        if self.json:
+            entry = {'time': timestamp, 'level': record.levelname, 'component': component, 'message': message, **fields}
+            if exc_text:
+                entry['exc_info'] = exc_text
+            return json.dumps(entry, ensure_ascii=False, default=str)
+        text = f'{timestamp} {record.levelname:<7} [{component}] {message}'
+        if fields:
+            text += ' ' + ' '.join(f'{key}={value}' for key, value in fields.items())
+        if exc_text:
+            text += '\n' + exc_text
+        return text
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """放入有界队列后立即返回，格式化留给后台线程；队列满时丢弃并计数"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 不在请求线程中格式化消息，只复制记录；异常堆栈无法跨线程延迟格式化，先转成文本
+        record = copy.copy(record)
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with _stats_lock:
+                _stats['dropped'] += 1
+
+
+def setup_logging(level: str = LOG_LEVEL, levels: Optional[Dict[str, str]] = None, fmt: str = LOG_FORMAT):
+    """
+    配置根日志器与各组件级别，只在首次调用时生效；
+    未迁移到 get_logger 的 logging.xxx 调用同样经过队列输出
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        log_queue: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        stream = logging.StreamHandler()
+        stream.setFormatter(StructuredFormatter(fmt))
+        handler = NonBlockingQueueHandler(log_queue)
+        handler.addFilter(SamplingFilter())
+
+        root = logging.getLogger()
+        for old in list(root.handlers):
+            root.removeHandler(old)
+        root.addHandler(handler)
+        root.setLevel(level)
+        for component, component_level in (LOG_LEVELS if levels is None else levels).items():
+            logging.getLogger(f'{ROOT_LOGGER}.{component}').setLevel(component_level)
+
+        _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+
+def stats() -> Dict[str, int]:
+    """被丢弃（队列满）与被抽样省略的日志条数"""
+    return dict(_stats)
@@ -0,0 +1,253 @@
+"""
+运行指标
+计数器、仪表与直方图集中登记在本模块，GET /metrics 以 Prometheus 文本格式输出；
+记录一次观测只是一次二分查找加几次加法，不做格式化，也不依赖 prometheus_client。
+缓存命中、进行中的任务数等已有统计用回调仪表在抓取时读取，热路径上没有额外开销
+"""
+
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+NAMESPACE = 'aigc'
+
+# 常用的桶边界
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+PHASE_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1800)
+COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+BYTES_BUCKETS = (16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024)
+
+LabelValues = Tuple[str, ...]
+CallbackValue = Union[float, Dict[LabelValues, float]]
+
+_metrics: Dict[str, '_Metric'] = {}
+_metrics_lock = threading.Lock()
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = f'{NAMESPACE}_{name}'
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        with _metrics_lock:
+            if self.name in _metrics:
+                raise ValueError(f'指标已存在: {self.name}')
+            _metrics[self.name] = self
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f'{self.name} 需要标签 {self.labelnames}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}', *self.samples()]
+
+
+class _Value(_Metric):
+    """计数器与仪表的公共部分；指定 fn 时在抓取时调用 fn 取值（返回数值，或 标签值元组 -> 数值 的字典）"""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 fn: Optional[Callable[[], CallbackValue]] = None):
+        super().__init__(name, help_text, labelnames)
+        self.fn = fn
+        # 无标签的指标从0开始输出，有标签的在首次记录时出现
+        self._values: Dict[LabelValues, float] = {} if self.labelnames else {(): 0}
+
+    def _add(self, amount: float, labels: Dict[str, str]):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> Iterator[str]:
+        if self.fn is not None:
+            try:
+                values = self.fn()
+            except Exception:
+                return
+            if not isinstance(values, dict):
+                values = {(): values}
+        else:
+            with self._lock:
+                values = dict(self._values)
+        for key, value in values.items():
+            yield f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+
+
+class Counter(_Value):
+    """只增的计数"""
+
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        self._add(amount, labels)
+
+
+class Gauge(_Value):
+    """可增可减的当前值"""
+
+    kind = 'gauge'
+
+    def inc(self, amount: float = 1, **labels):
+        self._add(amount, labels)
+
+    def dec(self, amount: float = 1, **labels):
+        self._add(-amount, labels)
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """固定桶边界的直方图"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[LabelValues, List[float]] = {}   # 各桶计数（不累加）+ [总和, 次数]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 3)
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """统计代码块的耗时（秒），异常时同样记录"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def snapshot(self, **labels) -> Dict[str, float]:
+        """某组标签的观测次数与总和"""
+        with self._lock:
+            series = self._series.get(self._key(labels))
+        return {'count': series[-1], 'sum': series[-2]} if series else {'count': 0, 'sum': 0}
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            series_items = [(key, list(series)) for key, series in self._series.items()]
+        for key, series in series_items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}'
+            labels = _format_labels(self.labelnames, key)
+            yield f'{self.name}_sum{labels} {_format_value(series[-2])}'
+            yield f'{self.name}_count{labels} {series[-1]}'
+
+
+def cache_results(stats: Dict[str, int]) -> Dict[LabelValues, float]:
+    """把缓存统计中的 hits/misses 转为按 result 标签区分的计数，命中率由 Prometheus 计算"""
+    return {('hit',): stats['hits'], ('miss',): stats['misses']}
+
+
+def render() -> str:
+    """所有指标的 Prometheus 文本格式"""
+    with _metrics_lock:
+        metrics = list(_metrics.values())
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# ---- 各模块共用的指标 ----
+
+submit_seconds = Histogram(
+    'modelscope_submit_seconds', 'ModelScope 提交生图任务的耗时', ('outcome',))
+task_phase_seconds = Histogram(
+    'task_phase_seconds', '生图任务在各状态（QUEUING/PROCESSING 等）停留的时间', ('phase',), PHASE_BUCKETS)
+task_polls = Histogram(
+    'task_polls', '每个生图任务结束前的状态查询次数', ('source', 'outcome'), COUNT_BUCKETS)
+download_seconds = Histogram(
+    'image_download_seconds', '下载图片的耗时', ('kind',))
+download_bytes = Histogram(
+    'image_download_bytes', '下载图片的字节数', ('kind',), BYTES_BUCKETS)
+analyze_seconds = Histogram(
+    'analyze_seconds', 'Qwen3-VL 反推的端到端耗时', ('mode', 'outcome'))
+analyze_payload_bytes = Histogram(
+    'analyze_payload_bytes', '发送给 Qwen3-VL 的图片字节数（预处理后）', ('mode',), BYTES_BUCKETS)
+
+
+class TaskPhases:
+    """
+    记录一个任务在各状态停留的时间，任务结束时写入 task_phase_seconds 与 task_polls
+
+    用法：每次轮询拿到状态后调用 update(status)，结束时调用 finish(outcome)
+    """
+
+    __slots__ = ('source', 'polls', '_phase', '_since', '_durations', '_finished')
+
+    def __init__(self, source: str):
+        self.source = source
+        self.polls = 0
+        self._phase: Optional[str] = None
+        self._since = time.monotonic()
+        self._durations: Dict[str, float] = {}
+        self._finished = False
+
+    def update(self, status: Optional[str]):
+        self.polls += 1
+        if status and status != self._phase:
+            self._close_phase()
+            self._phase = status
+
+    def _close_phase(self):
+        now = time.monotonic()
+        if self._phase is not None:
+            self._durations[self._phase] = self._durations.get(self._phase, 0) + now - self._since
+        self._since = now
+
+    def finish(self, outcome: str):
+        """outcome: completed / failed / timeout；超时结束时最后所处的状态也计时，其余情况最后的状态即结束状态，不计时"""
+        if self._finished:
+            return
+        self._finished = True
+        if outcome == 'timeout':
+            self._close_phase()
+        for phase, seconds in self._durations.items():
+            task_phase_seconds.observe(seconds, phase=phase)
+        task_polls.observe(self.polls, source=self.source, outcome=outcome)
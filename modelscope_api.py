@@ -0,0 +1,308 @@
+"""
+ModelScope 生图接口封装
+集中管理提交任务、查询任务状态所需的URL、请求头与响应解析逻辑，
+供 routes.py、jobs.py 等模块复用
+"""
+
+import re
+import time
+import uuid
+import logging
+from functools import lru_cache
+from urllib.parse import urlparse
+from typing import Dict, List, Optional, Tuple, Any
+
+import config
+import http_client
+import metrics
+from config import LORA_ARGS
+from response_extractor import Extractor
+from upstream_guard import UpstreamRejected, status_guard, submit_guard
+
+# 压测时可指向本地的 benchmarks/fake_modelscope.py
+MODELSCOPE_BASE_URL = getattr(config, 'MODELSCOPE_BASE_URL', 'https://www.modelscope.cn').rstrip('/')
+SUBMIT_URL = f'{MODELSCOPE_BASE_URL}/api/v1/muse/predict/task/submit'
+STATUS_URL = f'{MODELSCOPE_BASE_URL}/api/v1/muse/predict/task/status'
+
+# 默认的提示词前缀
+DEFAULT_PROMPT_PREFIX = "feifei,a photo-realistic shoot from a portrait camera angle about a young woman,big boobs,妃妃,"
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/140.0.0.0 Safari/537.36'
+
+# 任务状态分类
+SUCCESS_STATUSES = ('COMPLETED', 'SUCCESS', 'SUCCEED')
+RUNNING_STATUSES = ('PENDING', 'QUEUING', 'PROCESSING', 'RUNNING')
+FAILED_STATUSES = ('FAILED',)
+
+# 提交时账号会话已过期的错误信息，jobs.py 据此换用其他账号重试
+SESSION_EXPIRED_ERROR = 'Cookie已过期，请重新登录获取新的Cookie'
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp')
+
+
+def extract_csrf_token_enhanced(cookie_str: str) -> str:
+    """从Cookie中提取CSRF Token，支持 csrf_token / csrftoken / csrf_session / XSRF-TOKEN 格式"""
+    cookie_str = (cookie_str or '').strip()
+    for name in ('csrf_token', 'csrftoken', 'csrf_session', 'XSRF-TOKEN'):
+        match = re.search(rf'{name}=([^;]+)', cookie_str)
+        if match:
+            # 处理可能的引号
+            return match.group(1).strip('"')
+
+    # 如果没有找到CSRF Token，记录警告但继续执行
+    logging.warning('未从Cookie中提取到CSRF Token')
+    return ''
+
+
+# 请求头中与Cookie无关的部分只构建一次
+_COMMON_HEADERS = {
+    'Accept': 'application/json, text/plain, */*',
+    'Accept-Encoding': 'gzip, deflate, br, zstd',
+    'Accept-Language': 'zh-CN,zh;q=0.9',
+    'Bx-V': '2.5.31',
+    'Connection': 'keep-alive',
+    'Host': urlparse(MODELSCOPE_BASE_URL).netloc,
+    'Referer': 'https://www.modelscope.cn/aigc/imageGeneration?tab=advanced&presetId=5804',
+    'Sec-Ch-Ua': '"Chromium";v="140", "Not=A?Brand";v="24", "Google Chrome";v="140"',
+    'Sec-Ch-Ua-Mobile': '?0',
+    'Sec-Ch-Ua-Platform': '"Windows"',
+    'Sec-Fetch-Dest': 'empty',
+    'Sec-Fetch-Mode': 'cors',
+    'Sec-Fetch-Site': 'same-origin',
+    'User-Agent': USER_AGENT,
+    'X-Modelscope-Accept-Language': 'zh_CN'
+}
+
+_SUBMIT_HEADERS = {
+    **_COMMON_HEADERS,
+    'Content-Type': 'application/json',
+    'Origin': 'https://www.modelscope.cn',
+    'Cache-Control': 'no-cache',
+    'Pragma': 'no-cache'
+}
+
+
+@lru_cache(maxsize=32)
+def _submit_cookie_headers(cookie: str) -> Dict[str, str]:
+    return {**_SUBMIT_HEADERS, 'Cookie': cookie, 'X-Csrftoken': extract_csrf_token_enhanced(cookie)}
+
+
+@lru_cache(maxsize=32)
+def _poll_cookie_headers(cookie: str) -> Dict[str, str]:
+    return {**_COMMON_HEADERS, 'Cookie': cookie}
+
+
+def build_submit_headers(cookie: str) -> Dict[str, str]:
+    """构建提交任务的请求头，尽量接近真实浏览器"""
+    return {**_submit_cookie_headers(cookie), 'X-Modelscope-Trace-Id': str(uuid.uuid4())}
+
+
+def build_poll_headers(cookie: str) -> Dict[str, str]:
+    """构建查询任务状态的请求头"""
+    return {**_poll_cookie_headers(cookie), 'X-Modelscope-Trace-Id': str(uuid.uuid4())}
+
+
+def build_txt2img_request_body(prompt: str, width: int, height: int, model_args: Optional[Dict] = None,
+                               negative_prompt: str = '', num_images: int = 4) -> Dict[str, Any]:
+    """构建文生图任务的请求体，未指定 model_args 时使用默认的 Qwen-image 模型与 LORA_ARGS"""
+    if model_args is None:
+        model_args = {
+            'checkpointModelVersionId': 275167,   # 大模型地址
+            'checkpointShowInfo': "Qwen_Image_v1.safetensors",   # 大模型名称
+            'loraArgs': LORA_ARGS,
+            'predictType': "TXT_2_IMG"
+        }
+
+    return {
+        'taskType': 'TXT_2_IMG',
+        'type': 'TXT_2_IMG',
+        'task_type': 'TXT_2_IMG',
+        'predictType': 'TXT_2_IMG',
+        'modelArgs': model_args,
+        'promptArgs': {
+            'prompt': prompt,
+            'negativePrompt': negative_prompt
+        },
+        'basicDiffusionArgs': {
+            'sampler': "Euler",
+            'guidanceScale': 4,
+            'seed': -1,
+            'numInferenceSteps': 50,
+            'numImagesPerPrompt': int(num_images),
+            'width': int(width),
+            'height': int(height)
+        },
+        'advanced': False,
+        'addWaterMark': False,
+        'adetailerArgsMap': {},
+        'hiresFixFrontArgs': {
+            'modelName': "Nomos 8k SCHATL 4x",
+            "scale": 4
+        },
+        'controlNetFullArgs': []
+    }
+
+
+def _is_numeric_id(value) -> bool:
+    return isinstance(value, (int, str)) and not isinstance(value, bool) and str(value).isdigit()
+
+
+def _is_url(value) -> bool:
+    return isinstance(value, str) and bool(value)
+
+
+def _is_image_url(value) -> bool:
+    return value.lower().endswith(IMAGE_EXTENSIONS)
+
+
+# 响应字段的提取规则：按顺序尝试预设路径，命中次数在 /health 的 extractors 中查看
+task_id_extractor = Extractor(
+    'task_id', ('data.taskId', 'Data.data.taskId', 'Data.taskId', 'taskId'),
+    accept=_is_numeric_id, fallback_keys=('taskId', 'task_id'))
+# 提交响应中没有数字taskId时的备用ID（UUID格式，轮询接口通常不支持）
+request_id_extractor = Extractor(
+    'request_id', ('Data.requestId', 'requestId', 'Data.data.requestId'),
+    fallback_keys=('requestId', 'request_id'))
+image_extractor = Extractor(
+    'images', ('predictResult.images[*].imageUrl', 'results[*].url', 'predictResult[*].url',
+               'predictResult.results[*].url', 'predictResult.url', 'predictResult.image_list'),
+    accept=_is_url, many=True, fallback_keys=('url', 'imageUrl', 'image_url'), fallback_accept=_is_image_url)
+prompt_extractor = Extractor('prompt', ('predictResult.images[0].prompt',))
+
+
+def extract_task_id(result: Dict) -> Optional[str]:
+    """从提交任务的响应中提取数字格式的任务ID"""
+    task_id = task_id_extractor.extract(result)
+    return str(task_id) if task_id is not None else None
+
+
+def post_submit(headers: Dict[str, str], request_body: Dict, url: str = SUBMIT_URL, timeout: int = 30):
+    """
+    发送提交请求并记录耗时（metrics 中的 modelscope_submit_seconds），返回原始响应；
+    受提交接口的限速与熔断保护，被本地拒绝时抛出 UpstreamRejected
+    """
+    started = time.monotonic()
+    try:
+        response = submit_guard.call(lambda: http_client.post(url, headers=headers, json=request_body, timeout=timeout))
+    except UpstreamRejected:
+        metrics.submit_seconds.observe(time.monotonic() - started, outcome='rejected')
+        raise
+    except Exception:
+        metrics.submit_seconds.observe(time.monotonic() - started, outcome='error')
+        raise
+    metrics.submit_seconds.observe(time.monotonic() - started, outcome='ok' if response.ok else 'http_error')
+    return response
+
+
+def is_session_expired(result: Dict) -> bool:
+    """提交响应是否表示账号的会话已过期"""
+    data = result.get('Data')
+    return isinstance(data, dict) and data.get('code', 0) != 0 and '会话已过期' in str(data.get('message', ''))
+
+
+def submit_task(cookie: str, request_body: Dict, timeout: int = 30) -> Tuple[Optional[str], Optional[str]]:
+    """
+    提交生图任务
+
+    Returns:
+        Tuple[task_id, error]: 成功时 error 为 None，失败时 task_id 为 None
+    """
+    response = post_submit(build_submit_headers(cookie), request_body, timeout=timeout)
+    if not response.ok:
+        logging.error(f'提交任务失败，状态码: {response.status_code}, 响应: {response.text}')
+        return None, f'API请求失败，状态码: {response.status_code}'
+
+    result = response.json()
+
+    # 检查是否有业务错误信息
+    data = result.get('Data')
+    if isinstance(data, dict) and 'code' in data and data['code'] != 0:
+        error_msg = data.get('message', '未知错误')
+        logging.error(f'API返回业务错误: {error_msg}')
+        if is_session_expired(result):
+            return None, SESSION_EXPIRED_ERROR
+        return None, f'API返回错误: {error_msg}'
+
+    task_id = extract_task_id(result)
+    if not task_id:
+        logging.error(f'未获取到任务ID，API响应结构: {result}')
+        return None, '未获取到任务ID，请检查Cookie是否有效'
+
+    logging.info(f'获取到任务ID: {task_id}')
+    return task_id, None
+
+
+def fetch_task_status(cookie: str, task_id: str, timeout: int = 10) -> Dict:
+    """查询一次任务状态，返回原始JSON"""
+    response = status_guard.call(lambda: http_client.get(STATUS_URL, params={'taskId': task_id},
+                                                         headers=build_poll_headers(cookie), timeout=timeout))
+    response.raise_for_status()
+    return response.json()
+
+
+def extract_images(task_data: Dict, response_json: Optional[Dict] = None) -> Tuple[List[str], str]:
+    """
+    从任务数据中提取图片URL与提示词，预设路径都未命中时在整个响应中查找图片URL
+
+    Returns:
+        Tuple[images, prompt_text]
+    """
+    images = image_extractor.extract(task_data, response_json)
+    prompt_text = (prompt_extractor.extract(task_data) or '') if images else ''
+    return images, prompt_text
+
+
+def parse_task_status(response_json: Dict) -> Dict[str, Any]:
+    """
+    将状态查询响应解析为统一结构
+
+    Returns:
+        Dict: status / percent / detail / queue_position / queue_total / images / prompt / request_id / error
+    """
+    parsed = {
+        'status': '',
+        'percent': 0,
+        'detail': '',
+        'queue_position': None,
+        'queue_total': None,
+        'images': [],
+        'prompt': '',
+        'request_id': '',
+        'error': None
+    }
+
+    task_data = None
+    # 基于正确响应格式：{"Code":200,"Data":{"data":{...}},"Success":true}
+    if response_json.get('Success') and isinstance(response_json.get('Data'), dict):
+        data = response_json['Data']
+        if data.get('data'):
+            task_data = data['data']
+        parsed['request_id'] = response_json.get('RequestId') or data.get('requestId') or ''
+    elif response_json.get('code') == 0 and isinstance(response_json.get('data'), dict):
+        # 兼容旧结构
+        task_data = response_json['data']
+        parsed['request_id'] = response_json.get('RequestId') or ''
+
+    if not isinstance(task_data, dict):
+        parsed['error'] = '响应结构异常'
+        return parsed
+
+    status = str(task_data.get('status', '')).upper()
+    progress = task_data.get('progress') or {}
+    parsed['status'] = status
+    parsed['percent'] = progress.get('percent', 0) or 0
+    parsed['detail'] = progress.get('detail', '') or ''
+
+    task_queue = task_data.get('taskQueue')
+    if isinstance(task_queue, dict):
+        parsed['queue_position'] = task_queue.get('currentPosition')
+        parsed['queue_total'] = task_queue.get('total')
+
+    if status in SUCCESS_STATUSES:
+        parsed['images'], parsed['prompt'] = extract_images(task_data, response_json)
+        if not parsed['images']:
+            parsed['error'] = '图片生成成功但未找到图片URL'
+    elif status in FAILED_STATUSES:
+        parsed['error'] = task_data.get('errorMsg', '未知错误')
+
+    return parsed
@@ -0,0 +1,107 @@
+"""
+共享的任务轮询调度器
+所有进行中的ModelScope任务共用一个调度线程：按下次轮询时间维护一个小顶堆，
+到期的状态查询交给有界线程池执行，避免每个任务各自 sleep 轮询
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+import config
+
+POLL_WORKERS = getattr(config, 'POLL_WORKERS', 8)    # 并发执行状态查询的线程数
+
+# 轮询函数：执行一次状态查询，返回距离下次轮询的秒数，返回 None 表示不再轮询
+PollFn = Callable[[], Optional[float]]
+
+
+class PollScheduler:
+    """多路复用轮询调度器"""
+
+    def __init__(self, max_workers: int = POLL_WORKERS):
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='poll-worker')
+        self._thread: Optional[threading.Thread] = None
+        self._running = 0   # 正在线程池中执行的轮询数
+
+    def watch(self, poll_fn: PollFn, delay: float = 0) -> None:
+        """登记一个轮询函数，delay 秒后第一次执行"""
+        with self._cond:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), poll_fn))
+            self._cond.notify()
+        self._ensure_thread()
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {'scheduled': len(self._heap), 'running': self._running}
+
+    def _ensure_thread(self):
+        with self._cond:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._loop, name='poll-scheduler', daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                due_at = self._heap[0][0]
+                now = time.monotonic()
+                if due_at > now:
+                    # 等到最早的任务到期，或有新任务插入
+                    self._cond.wait(due_at - now)
+                    continue
+                due = []
+                while self._heap and self._heap[0][0] <= now:
+                    due.append(heapq.heappop(self._heap)[2])
+                self._running += len(due)
+
+            for poll_fn in due:
+                self._pool.submit(self._run, poll_fn)
+
+    def _run(self, poll_fn: PollFn):
+        try:
+            next_delay = poll_fn()
+        except Exception as e:
+            logging.error(f'轮询任务执行异常: {e}')
+            next_delay = None
+
+        with self._cond:
+            self._running -= 1
+        if next_delay is not None:
+            self.watch(poll_fn, next_delay)
+
+
+poll_scheduler = PollScheduler()
+
+
+def wait_for(poll_fn: PollFn, timeout: Optional[float] = None) -> bool:
+    """
+    在共享调度器上轮询直到 poll_fn 返回 None，阻塞等待结果
+
+    Returns:
+        bool: 是否在超时前结束
+    """
+    finished = threading.Event()
+
+    def wrapped() -> Optional[float]:
+        try:
+            next_delay = poll_fn()
+        except Exception:
+            finished.set()
+            raise
+        if next_delay is None:
+            finished.set()
+        return next_delay
+
+    poll_scheduler.watch(wrapped)
+    return finished.wait(timeout)
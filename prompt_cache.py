@@ -0,0 +1,114 @@
+"""
+反推结果缓存模块
+以 图片内容哈希 + 模型 + 提示词模板 作为键，把 Qwen3-VL 的反推结果持久化到 SQLite，
+支持 TTL 过期与按最近访问时间的 LRU 淘汰
+"""
+
+import os
+import time
+import hashlib
+import sqlite3
+import logging
+import threading
+from typing import Dict, Optional, Any
+
+import config
+import metrics
+
+PROMPT_CACHE_PATH = getattr(config, 'PROMPT_CACHE_PATH',
+                            os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'prompt_cache.sqlite3'))
+PROMPT_CACHE_MAX_ENTRIES = getattr(config, 'PROMPT_CACHE_MAX_ENTRIES', 10000)   # 最大条目数，超出按LRU淘汰
+PROMPT_CACHE_TTL = getattr(config, 'PROMPT_CACHE_TTL', 30 * 24 * 3600)         # 条目有效期（秒）
+
+
+def make_key(image_bytes: bytes, model: str, prompt_template: str) -> str:
+    """缓存键：图片内容的SHA-256 + 模型 + 提示词模板的哈希"""
+    template_hash = hashlib.sha256(prompt_template.encode('utf-8')).hexdigest()[:16]
+    return f"{hashlib.sha256(image_bytes).hexdigest()}:{model}:{template_hash}"
+
+
+class PromptCache:
+    """基于SQLite的反推结果缓存"""
+
+    def __init__(self, path: str = PROMPT_CACHE_PATH, max_entries: int = PROMPT_CACHE_MAX_ENTRIES,
+                 ttl: float = PROMPT_CACHE_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._stats = {'hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0}
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''CREATE TABLE IF NOT EXISTS prompt_cache (
+                                key TEXT PRIMARY KEY,
+                                prompt TEXT NOT NULL,
+                                created_at REAL NOT NULL,
+                                accessed_at REAL NOT NULL)''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_prompt_cache_accessed ON prompt_cache(accessed_at)')
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            try:
+                conn = self._connect()
+                row = conn.execute('SELECT prompt, created_at FROM prompt_cache WHERE key = ?', (key,)).fetchone()
+                if row and now - row[1] <= self.ttl:
+                    conn.execute('UPDATE prompt_cache SET accessed_at = ? WHERE key = ?', (now, key))
+                    conn.commit()
+                    self._stats['hits'] += 1
+                    return row[0]
+                if row:
+                    conn.execute('DELETE FROM prompt_cache WHERE key = ?', (key,))
+                    conn.commit()
+                    self._stats['evictions'] += 1
+            except sqlite3.Error as e:
+                logging.error(f'读取反推缓存失败: {e}')
+            self._stats['misses'] += 1
+            return None
+
+    def put(self, key: str, prompt: str):
+        now = time.time()
+        with self._lock:
+            try:
+                conn = self._connect()
+                conn.execute('INSERT OR REPLACE INTO prompt_cache (key, prompt, created_at, accessed_at) VALUES (?, ?, ?, ?)',
+                             (key, prompt, now, now))
+                self._stats['writes'] += 1
+                self._evict(conn, now)
+                conn.commit()
+            except sqlite3.Error as e:
+                logging.error(f'写入反推缓存失败: {e}')
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        """先删除过期条目，再按最近访问时间淘汰超出上限的条目"""
+        expired = conn.execute('DELETE FROM prompt_cache WHERE created_at < ?', (now - self.ttl,)).rowcount
+        overflow = conn.execute('SELECT COUNT(*) FROM prompt_cache').fetchone()[0] - self.max_entries
+        if overflow > 0:
+            conn.execute('''DELETE FROM prompt_cache WHERE key IN (
+                                SELECT key FROM prompt_cache ORDER BY accessed_at LIMIT ?)''', (overflow,))
+        self._stats['evictions'] += expired + max(overflow, 0)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            try:
+                entries = self._connect().execute('SELECT COUNT(*) FROM prompt_cache').fetchone()[0]
+            except sqlite3.Error:
+                entries = None
+            return {
+                **self._stats,
+                'entries': entries,
+                'hit_rate': round(self._stats['hits'] / lookups, 4) if lookups else 0.0
+            }
+
+
+prompt_cache = PromptCache()
+metrics.Counter('prompt_cache_requests_total', '反推结果缓存的查询次数', ('result',),
+                fn=lambda: metrics.cache_results(prompt_cache.stats()))
@@ -0,0 +1,177 @@
+"""
+响应字段提取器
+按顺序尝试一组预编译的路径表达式（如 Data.data.taskId、predictResult.images[*].imageUrl），
+每条路径只是几次字典/列表下标访问；全部未命中时才做有深度上限的回退遍历。
+记录每条路径的命中次数，接口结构变化（命中落到靠后的路径或回退遍历）时可以在 /health 中看出来
+"""
+
+import re
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import config
+
+EXTRACTOR_MAX_DEPTH = getattr(config, 'EXTRACTOR_MAX_DEPTH', 6)   # 回退遍历的最大深度
+
+WILDCARD = '*'
+_TOKEN = re.compile(r'([^.\[\]]+)|\[(\*|-?\d+)\]')
+
+_extractors: Dict[str, 'Extractor'] = {}
+_extractors_lock = threading.Lock()
+
+
+def compile_path(expr: str) -> Tuple:
+    """
+    把路径表达式编译为访问步骤：a.b 为字典键，[0] 为列表下标，[*] 展开列表中的所有元素
+
+    >>> compile_path('predictResult.images[*].imageUrl')
+    ('predictResult', 'images', '*', 'imageUrl')
+    """
+    steps = []
+    pos = 0
+    for match in _TOKEN.finditer(expr):
+        if expr[pos:match.start()].strip('.'):
+            raise ValueError(f'无效的路径表达式: {expr}')
+        key, index = match.groups()
+        if key is not None:
+            steps.append(key)
+        elif index == WILDCARD:
+            steps.append(WILDCARD)
+        else:
+            steps.append(int(index))
+        pos = match.end()
+    if not steps or expr[pos:].strip('.'):
+        raise ValueError(f'无效的路径表达式: {expr}')
+    return tuple(steps)
+
+
+def resolve(obj: Any, steps: Tuple) -> List[Any]:
+    """按编译好的步骤取值，路径不存在时返回空列表；不含 [*] 时最多返回一个值"""
+    values = [obj]
+    for step in steps:
+        found = []
+        for value in values:
+            if step == WILDCARD:
+                if isinstance(value, list):
+                    found.extend(value)
+            elif isinstance(step, int):
+                if isinstance(value, list) and -len(value) <= step < len(value):
+                    found.append(value[step])
+            elif isinstance(value, dict) and step in value:
+                found.append(value[step])
+        if not found:
+            return []
+        values = found
+    return values
+
+
+def _truthy(value: Any) -> bool:
+    return bool(value)
+
+
+class Extractor:
+    """
+    一个字段的提取规则
+
+    Args:
+        name: 名称，用于统计
+        paths: 按优先级排列的路径表达式
+        accept: 判断取到的值是否有效，无效的值视为未命中
+        many: True 时返回所有有效值组成的列表（列表值会被展开），否则返回第一个有效值
+        fallback_keys: 回退遍历时匹配的键名（不区分大小写），为空时不做回退遍历
+        fallback_accept: 回退遍历取到的值额外需要满足的条件
+        max_depth: 回退遍历的最大深度
+    """
+
+    def __init__(self, name: str, paths: Iterable[str], accept: Callable[[Any], bool] = _truthy, many: bool = False,
+                 fallback_keys: Iterable[str] = (), fallback_accept: Optional[Callable[[Any], bool]] = None,
+                 max_depth: int = EXTRACTOR_MAX_DEPTH):
+        self.name = name
+        self.paths = [(expr, compile_path(expr)) for expr in paths]
+        self.accept = accept
+        self.many = many
+        self.fallback_keys = frozenset(key.lower() for key in fallback_keys)
+        self.fallback_accept = fallback_accept
+        self.max_depth = max_depth
+        self._lock = threading.Lock()
+        self._hits = {expr: 0 for expr, _ in self.paths}
+        self._hits.update({'fallback': 0, 'miss': 0})
+        with _extractors_lock:
+            _extractors[name] = self
+
+    def extract(self, obj: Any, fallback_obj: Any = None) -> Any:
+        """
+        提取字段值，未找到时返回 None（many=True 时返回空列表）
+
+        Args:
+            obj: 按路径表达式查找的对象
+            fallback_obj: 回退遍历的对象，默认与 obj 相同
+        """
+        for expr, steps in self.paths:
+            result = self._select(resolve(obj, steps), self.accept)
+            if result:
+                self._count(expr)
+                return result
+
+        if self.fallback_keys:
+            accept = self.accept
+            if self.fallback_accept:
+                accept = lambda value: self.accept(value) and self.fallback_accept(value)
+            result = self._select(self._walk(obj if fallback_obj is None else fallback_obj), accept)
+            if result:
+                self._count('fallback')
+                logging.warning(f'[{self.name}] 预设路径均未命中，回退遍历取得结果，接口结构可能已变化')
+                return result
+
+        self._count('miss')
+        if isinstance(obj, dict):
+            logging.debug(f'[{self.name}] 未找到字段，顶层键: {list(obj)[:20]}')
+        return [] if self.many else None
+
+    def _select(self, values: Iterable[Any], accept: Callable[[Any], bool]) -> Any:
+        if not self.many:
+            for value in values:
+                if accept(value):
+                    return value
+            return None
+        items = []
+        for value in values:
+            if isinstance(value, list):
+                items.extend(item for item in value if accept(item))
+            elif accept(value):
+                items.append(value)
+        return items
+
+    def _walk(self, obj: Any) -> Iterator[Any]:
+        """广度优先遍历，先返回浅层的匹配，超过 max_depth 的层级不再展开"""
+        level = [obj]
+        for _ in range(self.max_depth):
+            children = []
+            for node in level:
+                if isinstance(node, dict):
+                    for key, value in node.items():
+                        if isinstance(key, str) and key.lower() in self.fallback_keys:
+                            yield value
+                        elif isinstance(value, (dict, list)):
+                            children.append(value)
+                elif isinstance(node, list):
+                    children.extend(item for item in node if isinstance(item, (dict, list)))
+            if not children:
+                return
+            level = children
+
+    def _count(self, key: str):
+        with self._lock:
+            self._hits[key] += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._hits)
+
+
+def stats() -> Dict[str, Dict[str, int]]:
+    """所有提取器各路径的命中次数"""
+    with _extractors_lock:
+        extractors = list(_extractors.values())
+    return {extractor.name: extractor.stats() for extractor in extractors}
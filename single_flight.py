@@ -0,0 +1,103 @@
+"""
+请求合并（single-flight）
+同一指纹的请求同时只向上游发出一次：第一个请求负责调用，其余请求等待并共享同一结果。
+反推按图片内容哈希合并，生图按账号与规范化后的 request_body 在短时间窗口内合并；各分组的合并计数在 /health 中查看
+"""
+
+import json
+import asyncio
+import hashlib
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+_groups: Dict[str, 'SingleFlight'] = {}
+_groups_lock = threading.Lock()
+
+
+def fingerprint(obj: Any) -> str:
+    """请求指纹：键排序、去掉空白后的JSON的SHA-256，字段顺序不同的同一请求得到相同指纹"""
+    canonical = json.dumps(obj, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class SingleFlight:
+    """按键合并进行中的调用"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Future] = {}
+        self._stats = {'calls': 0, 'executions': 0, 'coalesced': 0}
+        with _groups_lock:
+            _groups[name] = self
+
+    def begin(self, key: str) -> Tuple[Future, bool]:
+        """
+        登记一次调用
+
+        Returns:
+            Tuple[future, leader]: leader 为 True 时由调用方执行并设置 future 的结果，之后调用 forget()；
+                                   否则等待 future 即可
+        """
+        with self._lock:
+            self._stats['calls'] += 1
+            future = self._calls.get(key)
+            if future is not None:
+                self._stats['coalesced'] += 1
+                return future, False
+            future = Future()
+            self._calls[key] = future
+            self._stats['executions'] += 1
+            return future, True
+
+    def forget(self, key: str, future: Future):
+        """结束合并窗口，之后的同键请求会重新调用上游"""
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """执行 fn 或等待进行中的同键调用，返回 (结果, 是否共享了他人的调用)"""
+        future, leader = self.begin(key)
+        if not leader:
+            logging.debug(f'[{self.name}] 合并请求 {key[:16]}')
+            return future.result(), True
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            self.forget(key, future)
+
+    async def do_async(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """do 的异步版本，可与同步调用共享同一次执行"""
+        future, leader = self.begin(key)
+        if not leader:
+            return await asyncio.wrap_future(future), True
+        try:
+            result = await fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            self.forget(key, future)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._stats, 'in_flight': len(self._calls)}
+
+
+def stats() -> Dict[str, Dict[str, int]]:
+    """所有分组的合并计数"""
+    with _groups_lock:
+        groups = list(_groups.values())
+    return {group.name: group.stats() for group in groups}
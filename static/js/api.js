@@ -1,5 +1,8 @@
 // static/js/api.js
 
+// 最近一次上传的图片ID（/upload 返回的 upload_id），/analyze 时带上
+let lastUploadId = null;
+
 async function uploadFile(file, onUploadProgress) {
     const formData = new FormData();
     formData.append('file', file);
@@ -11,6 +14,9 @@ async function uploadFile(file, onUploadProgress) {
             },
             onUploadProgress: onUploadProgress
         });
+        if (response.data.success) {
+            lastUploadId = response.data.upload_id;
+        }
         return response.data;
     } catch (error) {
         console.error('Upload error:', error);
@@ -20,7 +26,7 @@ async function uploadFile(file, onUploadProgress) {
 
 async function analyzeImage(showSuccessToast = false) {
     try {
-        const response = await axios.post('/analyze');
+        const response = await axios.post('/analyze', { upload_id: lastUploadId });
         if (response.data.success) {
             if (showSuccessToast) {
                 showToast('图片分析成功！', 'success');
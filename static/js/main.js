@@ -148,7 +148,7 @@ document.addEventListener('DOMContentLoaded', function() {
             const data = await uploadFile(file, onUploadProgress);
 
             if (data.success) {
-                const imageUrl = '/uploads/' + data.filename;
+                const imageUrl = '/uploads/' + data.upload_id;
                 showImagePreview(imageUrl); // from ui.js
                 if (analyzeAndGenerateButton) analyzeAndGenerateButton.disabled = false;
 
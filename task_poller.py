@@ -6,74 +6,135 @@ ModelScope API任务轮询模块
 
 import requests
 import re
-import time
-import logging
-from typing import Dict, Optional, Tuple, Any
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
 from flask import request, jsonify, Blueprint
-from config import MODEL_SCOPE_COOKIE
+import http_client
+import metrics
+from account_pool import account_pool
+from poll_scheduler import wait_for
+from modelscope_api import STATUS_URL, parse_task_status
+from upstream_guard import status_guard
+from adaptive_poll import AdaptiveInterval, poll_savings
+from log_setup import get_logger, lazy_json
 
 task_poller_bp = Blueprint('task_poller', __name__)
+logger = get_logger('task_poller')
+
+# 同步等待中的轮询（/process_image_complete、/poll_task 等）
+polls_in_flight = metrics.Gauge('poller_tasks_in_flight', '同步等待结果的轮询任务数')
+
+UUID_PATTERN = re.compile(r'^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$')
 
 class ModelScopeTaskPoller:
+    BASE_HEADERS = {
+        'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/133.0.0.0 Safari/537.36',
+        'Accept': 'application/json, text/plain, */*',
+        'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
+        'Accept-Encoding': 'gzip, deflate, br, zstd',
+        'Origin': 'https://www.modelscope.cn',
+        'Referer': 'https://www.modelscope.cn/studios?tab=0'
+    }
+
     def __init__(self, cookie: str):
         self.cookie = cookie
-        self.headers = {
-            'Cookie': cookie,
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/133.0.0.0 Safari/537.36',
-            'Accept': 'application/json, text/plain, */*',
-            'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
-            'Accept-Encoding': 'gzip, deflate, br, zstd',
-            'Origin': 'https://www.modelscope.cn',
-            'Referer': 'https://www.modelscope.cn/studios?tab=0'
-        }
+        self.headers = {**self.BASE_HEADERS, 'Cookie': cookie}
 
     def poll_task_with_numeric_id(self, task_id: str, max_attempts: int = 60, interval: int = 5) -> Tuple[bool, Dict]:
-        """使用数字ID轮询任务状态（传统方式）- 适配正确的响应格式"""
-        url = f"https://www.modelscope.cn/api/v1/muse/predict/task/status?taskId={task_id}"
-
-        for attempt in range(max_attempts):
-            try:
-                response = requests.get(url, headers=self.headers, timeout=30)
-                response.raise_for_status()
-
-                data = response.json()
-                print(f"📊 轮询任务 {task_id} (第{attempt+1}次): {data}")
-
-                # 基于正确响应格式：{"Code":200,"Data":{"data":{...}},"Success":true}
-                if data.get('Success') == True and data.get('Code') == 200 and data.get('Data'):
-                    if isinstance(data['Data'], dict) and data['Data'].get('data'):
-                        task_data = data['Data']['data']
-                        status = task_data.get('status', '').upper()
-
-                        if status in ['SUCCEED', 'SUCCESS', 'COMPLETED']:
-                            print(f"✅ 任务 {task_id} 完成")
-                            return True, data
-                        elif status == 'FAILED':
-                            print(f"❌ 任务 {task_id} 失败")
-                            return False, data
-                        elif status in ['PENDING', 'RUNNING', 'PROCESSING', 'QUEUING']:
-                            print(f"⏳ 任务 {task_id} 仍在处理中...")
-                            time.sleep(interval)
-                            continue
-                        else:
-                            print(f"⚠️ 任务 {task_id} 未知状态: {status}")
-                    else:
-                        print(f"⚠️ Data.data结构异常: {data.get('Data')}")
-
-                elif data.get('Code') == 40000 or 'NumberFormatException' in str(data.get('Data', {}).get('message', '')):
-                    print(f"🔄 检测到ID格式错误，UUID格式不支持数字轮询")
-                    # 返回False而不是None，以便在poll_task_with_fallback中处理
-                    return False, {'error': 'UUID format not supported', 'original_data': data}
-
+        """
+        使用数字ID轮询任务状态（传统方式）- 适配正确的响应格式
+        状态查询由共享轮询调度器执行，当前线程只等待结果；
+        间隔按排队位置与进度自适应调整；最多查询 max_attempts 次，总等待时间不超过 max_attempts × interval 秒，
+        max_attempts=1 时只查询一次、不等待
+        """
+        url = f"{STATUS_URL}?taskId={task_id}"
+        state = {'attempt': 0, 'result': None}
+        pacer = AdaptiveInterval(interval)
+        phases = metrics.TaskPhases('poller')
+
+        def poll_once() -> Optional[float]:
+            attempt = state['attempt']
+            state['attempt'] += 1
+            state['result'] = self.check_task_status(url, task_id, attempt, pacer, phases)
+            if (state['result'] is not None or state['attempt'] >= max_attempts
+                    or pacer.elapsed() >= max_attempts * interval):
+                poll_savings.record(pacer, task_id)
+                result = state['result']
+                phases.finish('timeout' if result is None else 'completed' if result[0] else 'failed')
+                return None
+            return pacer.next_delay()
+
+        polls_in_flight.inc()
+        try:
+            wait_for(poll_once)
+        finally:
+            polls_in_flight.dec()
+
+        if state['result'] is None:
+            logger.warning("⏰ 任务 %s 轮询超时", task_id)
+            return False, {'error': '轮询超时', 'timeout': True}
+        return state['result']
+
+    def check_task_status(self, url: str, task_id: str, attempt: int, pacer: Optional[AdaptiveInterval] = None,
+                          phases: Optional[metrics.TaskPhases] = None) -> Optional[Tuple[bool, Dict]]:
+        """查询一次任务状态，任务结束时返回 (success, data)，仍需继续轮询时返回 None"""
+        try:
+            # 熔断打开或被限速时抛出 RequestException 的子类，与网络错误一样退避后再查询
+            response = status_guard.call(lambda: http_client.get(url, headers=self.headers, timeout=30))
+            response.raise_for_status()
+            return self.interpret_status(response.json(), task_id, attempt, pacer, phases)
+        except requests.RequestException as e:
+            self.poll_failed(task_id, e, pacer, phases)
+        return None
+
+    def poll_failed(self, task_id: str, error: Exception, pacer: Optional[AdaptiveInterval] = None,
+                    phases: Optional[metrics.TaskPhases] = None):
+        """一次查询出现网络错误：退避后继续轮询"""
+        logger.warning("❌ 轮询任务 %s 网络错误: %s", task_id, error)
+        if pacer:
+            pacer.failed()
+        if phases:
+            phases.update(None)
+
+    def interpret_status(self, data: Dict, task_id: str, attempt: int, pacer: Optional[AdaptiveInterval] = None,
+                         phases: Optional[metrics.TaskPhases] = None) -> Optional[Tuple[bool, Dict]]:
+        """解析一次状态查询的响应（同步与异步轮询共用），任务结束时返回 (success, data)，否则返回 None"""
+        logger.debug("📊 轮询任务 %s (第%d次): %s", task_id, attempt + 1, lazy_json(data), extra={'sample': task_id})
+        if pacer or phases:
+            parsed = parse_task_status(data)
+            if pacer:
+                pacer.update(parsed['percent'], parsed['queue_position'])
+            if phases:
+                phases.update(parsed['status'])
+
+        # 基于正确响应格式：{"Code":200,"Data":{"data":{...}},"Success":true}
+        if data.get('Success') == True and data.get('Code') == 200 and data.get('Data'):
+            if isinstance(data['Data'], dict) and data['Data'].get('data'):
+                task_data = data['Data']['data']
+                status = task_data.get('status', '').upper()
+
+                if status in ['SUCCEED', 'SUCCESS', 'COMPLETED']:
+                    logger.info("✅ 任务 %s 完成", task_id)
+                    return True, data
+                elif status == 'FAILED':
+                    logger.warning("❌ 任务 %s 失败", task_id)
+                    return False, data
+                elif status in ['PENDING', 'RUNNING', 'PROCESSING', 'QUEUING']:
+                    logger.info("⏳ 任务 %s 仍在处理中...", task_id, extra={'sample': task_id, 'status': status})
                 else:
-                    print(f"⚠️ 任务 {task_id} 轮询响应异常: {data}")
+                    logger.warning("⚠️ 任务 %s 未知状态: %s", task_id, status)
+            else:
+                logger.warning("⚠️ Data.data结构异常: %s", lazy_json(data.get('Data')))
+
+        elif data.get('Code') == 40000 or 'NumberFormatException' in str(data.get('Data', {}).get('message', '')):
+            logger.warning("🔄 检测到ID格式错误，UUID格式不支持数字轮询")
+            # 返回False而不是None，以便在poll_task_with_fallback中处理
+            return False, {'error': 'UUID format not supported', 'original_data': data}
 
-            except requests.RequestException as e:
-                print(f"❌ 轮询任务 {task_id} 网络错误: {e}")
-                time.sleep(interval)
+        else:
+            logger.warning("⚠️ 任务 %s 轮询响应异常: %s", task_id, lazy_json(data))
 
-        print(f"⏰ 任务 {task_id} 轮询超时")
-        return False, {'error': '轮询超时', 'timeout': True}
+        return None
 
     def poll_task_with_fallback(self, task_id: str, id_type: str = 'auto', max_attempts: int = 60, interval: int = 5) -> Tuple[bool, Dict]:
         """
@@ -88,46 +149,45 @@ class ModelScopeTaskPoller:
         Returns:
             Tuple[success, data]: 是否成功和响应数据
         """
-        print(f"🔄 开始智能轮询任务 {task_id} (类型: {id_type})")
-
-        if id_type == 'auto':
-            # 自动检测ID类型
-            if task_id.isdigit():
-                id_type = 'numeric'
-                print(f"🔢 检测到数字格式ID，使用数字轮询")
-            elif self.is_uuid_format(task_id):
-                id_type = 'uuid'
-                print(f"🆔 检测到UUID格式ID，使用UUID轮询")
-            else:
-                # 尝试先作为数字ID处理
-                id_type = 'numeric'
-                print(f"❓ 未确定ID格式，尝试数字轮询")
+        logger.info("🔄 开始智能轮询任务 %s (类型: %s)", task_id, id_type)
 
-        # 首先尝试指定的类型
+        id_type = self.resolve_id_type(task_id, id_type)
         if id_type == 'numeric':
-            result, data = self.poll_task_with_numeric_id(task_id, max_attempts, interval)
-
-            # 如果检测到UUID格式错误，提供错误指导
-            if result is False and 'NumberFormatException' in str(data):
-                print(f"🔄 数字轮询失败，UUID格式ID不被标准轮询API支持")
-                # 返回包含指导信息的错误
-                return False, self.create_error_response_with_guidance(task_id, data)
-
-            return result, data
-
-        elif id_type == 'uuid':
+            return self.numeric_result(task_id, *self.poll_task_with_numeric_id(task_id, max_attempts, interval))
+        return self.unsupported_id_result(task_id, id_type)
+
+    def resolve_id_type(self, task_id: str, id_type: str = 'auto') -> str:
+        """id_type 为 auto 时按任务ID格式确定轮询方式"""
+        if id_type != 'auto':
+            return id_type
+        if task_id.isdigit():
+            logger.debug("🔢 检测到数字格式ID，使用数字轮询")
+            return 'numeric'
+        if self.is_uuid_format(task_id):
+            logger.debug("🆔 检测到UUID格式ID，使用UUID轮询")
+            return 'uuid'
+        # 尝试先作为数字ID处理
+        logger.debug("❓ 未确定ID格式，尝试数字轮询")
+        return 'numeric'
+
+    def numeric_result(self, task_id: str, result: bool, data: Dict) -> Tuple[bool, Dict]:
+        """数字轮询的结果；检测到UUID格式错误时返回包含指导信息的错误"""
+        if result is False and 'NumberFormatException' in str(data):
+            logger.warning("🔄 数字轮询失败，UUID格式ID不被标准轮询API支持")
+            return False, self.create_error_response_with_guidance(task_id, data)
+        return result, data
+
+    def unsupported_id_result(self, task_id: str, id_type: str) -> Tuple[bool, Dict]:
+        """无法轮询的ID类型"""
+        if id_type == 'uuid':
             # UUID格式的ID需要特殊处理
-            print(f"❌ UUID格式的任务ID目前不被轮询API支持")
+            logger.warning("❌ UUID格式的任务ID目前不被轮询API支持")
             return False, self.create_error_response_with_guidance(task_id, {'error': 'UUID format not supported by polling API'})
-
-        else:
-            return False, {'error': f'不支持的ID类型: {id_type}'}
+        return False, {'error': f'不支持的ID类型: {id_type}'}
 
     def is_uuid_format(self, value: str) -> bool:
         """检查是否为UUID格式"""
-        import re
-        uuid_pattern = r'^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$'
-        return bool(re.match(uuid_pattern, value))
+        return bool(UUID_PATTERN.match(value))
 
     def get_modelscope_gallery_link(self) -> str:
         """获取ModelScope图片库链接"""
@@ -155,8 +215,9 @@ class ModelScopeTaskPoller:
         return error_response
 
 
+@lru_cache(maxsize=32)
 def create_task_poller(cookie: str) -> ModelScopeTaskPoller:
-    """创建任务轮询器实例"""
+    """创建任务轮询器实例，同一Cookie复用同一实例及其请求头"""
     return ModelScopeTaskPoller(cookie)
 
 
@@ -176,6 +237,23 @@ def poll_task_smart(cookie: str, task_id: str, **kwargs) -> Tuple[bool, Dict]:
     return poller.poll_task_with_fallback(task_id, **kwargs)
 
 
+def poll_task_response(poller: ModelScopeTaskPoller, task_id: str, success: bool, result_data: Dict) -> Dict:
+    """/poll_task 的响应内容（WSGI 与 ASGI 服务共用）"""
+    if success:
+        return {'success': True, 'data': result_data}
+    # 检查是否需要提供指导信息
+    if 'timeout' in result_data or 'NumberFormatException' in str(result_data.get('message', '')):
+        return poller.create_error_response_with_guidance(task_id, result_data)
+    return {'success': False, 'error': result_data}
+
+
+def task_status_response(success: bool, result_data: Dict) -> Dict:
+    """/task_status/<task_id> 的响应内容"""
+    if success:
+        return {'status': 'completed', 'result': result_data}
+    return {'status': 'failed', 'error': result_data}
+
+
 @task_poller_bp.route('/poll_task', methods=['POST'])
 def poll_task():
     """智能轮询任务状态端点"""
@@ -189,26 +267,17 @@ def poll_task():
         return jsonify({'success': False, 'error': '缺少任务ID'})
 
     try:
-        poller = create_task_poller(MODEL_SCOPE_COOKIE)
+        poller = create_task_poller(account_pool.cookie_for_task(task_id))
         success, result_data = poller.poll_task_with_fallback(
             task_id=task_id,
             id_type=id_type,
             max_attempts=max_attempts,
             interval=interval
         )
-
-        if success:
-            return jsonify({'success': True, 'data': result_data})
-        else:
-            # 检查是否需要提供指导信息
-            if 'timeout' in result_data or 'NumberFormatException' in str(result_data.get('message', '')):
-                guided_response = poller.create_error_response_with_guidance(task_id, result_data)
-                return jsonify(guided_response)
-            else:
-                return jsonify({'success': False, 'error': result_data})
+        return jsonify(poll_task_response(poller, task_id, success, result_data))
 
     except Exception as e:
-        logging.error(f'智能轮询任务 {task_id} 异常: {e}')
+        logger.error('智能轮询任务 %s 异常: %s', task_id, e)
         return jsonify({'success': False, 'error': f'轮询异常: {str(e)}'})
 
 
@@ -216,14 +285,10 @@ def poll_task():
 def get_task_status(task_id):
     """兼容性端点：轮询任务状态"""
     try:
-        poller = create_task_poller(MODEL_SCOPE_COOKIE)
+        poller = create_task_poller(account_pool.cookie_for_task(task_id))
         success, result_data = poller.poll_task_with_fallback(task_id, max_attempts=1, interval=1)
-
-        if success:
-            return jsonify({'status': 'completed', 'result': result_data})
-        else:
-            return jsonify({'status': 'failed', 'error': result_data})
+        return jsonify(task_status_response(success, result_data))
 
     except Exception as e:
-        logging.error(f"获取任务状态 {task_id} 异常: {e}")
-        return jsonify({'status': 'failed', 'error': f'获取任务状态异常: {str(e)}'})
\ No newline at end of file
+        logger.error('获取任务状态 %s 异常: %s', task_id, e)
+        return jsonify({'status': 'failed', 'error': f'获取任务状态异常: {str(e)}'})
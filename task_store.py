@@ -0,0 +1,129 @@
+"""
+生图任务持久化模块
+把每个任务的提交参数、ModelScope任务ID、状态、进度与结果URL写入SQLite，
+服务重启后由 JobManager 重新加载未结束的任务并继续轮询
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from typing import Dict, List, Optional, Any
+
+import config
+
+TASK_STORE_PATH = getattr(config, 'TASK_STORE_PATH',
+                          os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'tasks.sqlite3'))
+TASK_STORE_RETENTION = getattr(config, 'TASK_STORE_RETENTION', 30 * 24 * 3600)   # 已结束任务保留时间（秒）
+
+# 列名与 Job 属性一一对应；request_body 与 images 以JSON保存
+COLUMNS = ('job_id', 'task_id', 'cookie', 'request_body', 'status', 'percent', 'detail', 'queue_position',
+           'queue_total', 'images', 'prompt', 'error', 'polls', 'created_at', 'updated_at')
+JSON_COLUMNS = ('request_body', 'images')
+
+
+class TaskStore:
+    """基于SQLite的任务存储，按状态与更新时间建索引"""
+
+    def __init__(self, path: str = TASK_STORE_PATH, retention: float = TASK_STORE_RETENTION):
+        self.path = path
+        self.retention = retention
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''CREATE TABLE IF NOT EXISTS tasks (
+                                job_id TEXT PRIMARY KEY,
+                                task_id TEXT,
+                                cookie TEXT NOT NULL,
+                                request_body TEXT NOT NULL,
+                                status TEXT NOT NULL,
+                                percent REAL,
+                                detail TEXT,
+                                queue_position INTEGER,
+                                queue_total INTEGER,
+                                images TEXT,
+                                prompt TEXT,
+                                error TEXT,
+                                polls INTEGER,
+                                created_at REAL NOT NULL,
+                                updated_at REAL NOT NULL)''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_status_updated ON tasks(status, updated_at)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_created ON tasks(created_at)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_task_id ON tasks(task_id)')
+            self._conn = conn
+        return self._conn
+
+    def save(self, record: Dict[str, Any]):
+        """插入或更新一个任务，record 包含 COLUMNS 中的全部字段"""
+        values = [json.dumps(record[c], ensure_ascii=False) if c in JSON_COLUMNS else record[c] for c in COLUMNS]
+        with self._lock:
+            try:
+                conn = self._connect()
+                conn.execute(f'INSERT OR REPLACE INTO tasks ({", ".join(COLUMNS)}) '
+                             f'VALUES ({", ".join("?" * len(COLUMNS))})', values)
+                conn.commit()
+            except sqlite3.Error as e:
+                logging.error(f'保存任务 {record["job_id"]} 失败: {e}')
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        rows = self._query('SELECT * FROM tasks WHERE job_id = ?', (job_id,))
+        return rows[0] if rows else None
+
+    def find_by_task_id(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """按ModelScope任务ID查找最近的一条记录"""
+        rows = self._query('SELECT * FROM tasks WHERE task_id = ? ORDER BY updated_at DESC LIMIT 1', (task_id,))
+        return rows[0] if rows else None
+
+    def unfinished(self, terminal_statuses) -> List[Dict[str, Any]]:
+        """所有未结束的任务，按创建时间排序"""
+        marks = ', '.join('?' * len(terminal_statuses))
+        return self._query(f'SELECT * FROM tasks WHERE status NOT IN ({marks}) ORDER BY created_at',
+                           tuple(terminal_statuses))
+
+    def recent(self, status: Optional[str] = None, since: float = 0, limit: int = 50) -> List[Dict[str, Any]]:
+        """按状态与更新时间查询最近的任务"""
+        if status:
+            return self._query('SELECT * FROM tasks WHERE status = ? AND updated_at >= ? ORDER BY updated_at DESC LIMIT ?',
+                               (status, since, limit))
+        return self._query('SELECT * FROM tasks WHERE updated_at >= ? ORDER BY updated_at DESC LIMIT ?',
+                           (since, limit))
+
+    def prune(self, terminal_statuses) -> int:
+        """删除超过保留期的已结束任务"""
+        marks = ', '.join('?' * len(terminal_statuses))
+        with self._lock:
+            try:
+                conn = self._connect()
+                deleted = conn.execute(f'DELETE FROM tasks WHERE status IN ({marks}) AND updated_at < ?',
+                                       (*terminal_statuses, time.time() - self.retention)).rowcount
+                conn.commit()
+                return deleted
+            except sqlite3.Error as e:
+                logging.error(f'清理任务记录失败: {e}')
+                return 0
+
+    def _query(self, sql: str, params: tuple) -> List[Dict[str, Any]]:
+        with self._lock:
+            try:
+                rows = self._connect().execute(sql, params).fetchall()
+            except sqlite3.Error as e:
+                logging.error(f'查询任务记录失败: {e}')
+                return []
+        records = []
+        for row in rows:
+            record = dict(row)
+            for c in JSON_COLUMNS:
+                record[c] = json.loads(record[c]) if record[c] else None
+            records.append(record)
+        return records
+
+
+task_store = TaskStore()
@@ -0,0 +1,89 @@
+"""
+Flask 与 ASGI 入口的响应结构一致性测试
+两个应用都指向 benchmarks/fake_modelscope.py 的替身服务，依次调用
+/health、/reverse_image、/api/generate_image、/poll_task、/task_status/<task_id>，比较响应的键；
+未安装 starlette / httpx 时跳过 ASGI 部分
+
+运行：python -m pytest -q tests
+"""
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.fake_modelscope import FakeSettings
+from benchmarks.load_test import start_in_process
+
+FAKE_SETTINGS = FakeSettings(workers=4, processing_time=0.2, jitter=0, images_per_task=1, image_size=64,
+                             submit_latency=0, status_latency=0, analyze_latency=0, seed=1)
+
+# 各接口成功时应返回的键
+EXPECTED_KEYS = {
+    'reverse_image': {'success', 'prompt'},
+    'generate_image': {'success', 'images', 'task_id'},
+    'poll_task': {'success', 'data'},
+    'task_status': {'status', 'result'},
+}
+
+
+def call_endpoints(post, get, fake_url: str, seed: int):
+    """按固定顺序调用各接口，返回 {接口名: 响应JSON}；seed 使两个应用的图片与提示词不同，避免命中缓存或同一任务"""
+    responses = {'health': get('/health')}
+    responses['reverse_image'] = post('/reverse_image', {'image_url': f'{fake_url}/cdn/source/{seed}.png',
+                                                         'force_refresh': True})
+    responses['generate_image'] = post('/api/generate_image', {'prompt': f'parity {seed}'})
+    task_id = responses['generate_image'].get('task_id')
+    assert task_id, responses['generate_image']
+    responses['poll_task'] = post('/poll_task', {'task_id': task_id, 'max_attempts': 3, 'interval': 0.1})
+    responses['task_status'] = get(f'/task_status/{task_id}')
+    return responses
+
+
+@pytest.fixture(scope='module')
+def server():
+    app_url, fake_url, shutdown = start_in_process(FAKE_SETTINGS, poll_interval=0.1)
+    yield app_url, fake_url
+    shutdown()
+
+
+@pytest.fixture(scope='module')
+def flask_responses(server):
+    import requests
+    app_url, fake_url = server
+
+    def post(path, payload):
+        return requests.post(f'{app_url}{path}', json=payload, timeout=30).json()
+
+    def get(path):
+        return requests.get(f'{app_url}{path}', timeout=30).json()
+
+    return call_endpoints(post, get, fake_url, 1)
+
+
+def test_flask_response_shapes(flask_responses):
+    for name, keys in EXPECTED_KEYS.items():
+        assert set(flask_responses[name]) >= keys, (name, flask_responses[name])
+    assert flask_responses['generate_image']['success'] is True
+    assert flask_responses['task_status']['status'] == 'completed'
+
+
+def test_asgi_matches_flask(server, flask_responses):
+    pytest.importorskip('httpx')
+    pytest.importorskip('starlette')
+    from starlette.testclient import TestClient
+    from asgi_app import create_async_app
+    _, fake_url = server
+
+    with TestClient(create_async_app(resume_jobs=False)) as client:
+        asgi_responses = call_endpoints(lambda path, payload: client.post(path, json=payload).json(),
+                                        lambda path: client.get(path).json(), fake_url, 2)
+
+    for name, response in flask_responses.items():
+        assert set(asgi_responses[name]) == set(response), (name, asgi_responses[name], response)
+    assert set(asgi_responses['health']['accounts']) == set(flask_responses['health']['accounts'])
+    assert set(asgi_responses['health']['upstream']) <= set(flask_responses['health']['upstream']) | {
+        'modelscope_submit', 'modelscope_status'}
@@ -0,0 +1,268 @@
+"""
+缩略图服务
+GET /thumb/<task_id>/<n>?w= 返回归档任务第n张图片的WebP缩略图，GET /thumb/uploads/<filename>?w= 返回上传图片的缩略图；
+首次请求时在线程池中生成并缓存到磁盘，缓存总大小有上限，超出时淘汰最久未访问的缩略图，
+响应带 ETag 与 Cache-Control，浏览器可直接复用
+"""
+
+import os
+import io
+import math
+import time
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image, ImageOps
+from flask import Blueprint, request, jsonify, send_file, current_app
+from werkzeug.utils import secure_filename
+
+import config
+import http_client
+import metrics
+from config import out_pic
+from downloader import image_filename
+from history_index import history_index
+from image_buffer import upload_store
+from task_store import task_store
+
+THUMB_CACHE_DIR = getattr(config, 'THUMB_CACHE_DIR',
+                          os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'thumbs'))
+THUMB_CACHE_MAX_BYTES = getattr(config, 'THUMB_CACHE_MAX_BYTES', 512 * 1024 * 1024)   # 缓存总大小上限
+THUMB_WORKERS = getattr(config, 'THUMB_WORKERS', 4)            # 生成缩略图的线程数
+THUMB_QUALITY = getattr(config, 'THUMB_QUALITY', 80)           # WebP质量
+THUMB_MAX_AGE = getattr(config, 'THUMB_MAX_AGE', 7 * 24 * 3600)   # 浏览器缓存时间（秒）
+THUMB_WIDTHS = (64, 128, 256, 320, 480, 640, 1024)             # 请求宽度向上取整到这些档位，限制缓存的变体数量
+THUMB_DEFAULT_WIDTH = 320
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp')
+
+thumb_bp = Blueprint('thumb', __name__)
+
+
+def bucket_width(width: Optional[int]) -> int:
+    """把请求的宽度归到最近的不小于它的档位"""
+    if not width or width <= 0:
+        return THUMB_DEFAULT_WIDTH
+    for w in THUMB_WIDTHS:
+        if width <= w:
+            return w
+    return THUMB_WIDTHS[-1]
+
+
+def requested_width() -> int:
+    """读取 ?w= 的档位宽度；按设备像素比换算的宽度常带小数（如 151×1.5），向上取整后归档"""
+    width = request.args.get('w', type=float)
+    if width is None or not math.isfinite(width):
+        return bucket_width(None)
+    return bucket_width(math.ceil(width))
+
+
+def make_thumbnail(data: bytes, width: int, quality: int = THUMB_QUALITY) -> bytes:
+    """按宽度等比缩小并编码为WebP"""
+    with Image.open(io.BytesIO(data)) as img:
+        # JPEG可以在解码时直接按比例缩小，大图省去大部分解码开销
+        img.draft('RGB', (width, width * 4))
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+        if img.width > width:
+            img = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS)
+        out = io.BytesIO()
+        img.save(out, 'WEBP', quality=quality, method=4)
+        return out.getvalue()
+
+
+class ThumbnailCache:
+    """磁盘缩略图缓存：同一缩略图并发请求只生成一次，总大小超限时按访问时间淘汰"""
+
+    def __init__(self, folder: str = THUMB_CACHE_DIR, max_bytes: int = THUMB_CACHE_MAX_BYTES,
+                 workers: int = THUMB_WORKERS):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thumbnail')
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Future] = {}
+        self._entries: Optional[Dict[str, Tuple[int, float]]] = None   # 文件名 -> (大小, 最近访问时间)
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def _load_entries(self) -> Dict[str, Tuple[int, float]]:
+        if self._entries is None:
+            os.makedirs(self.folder, exist_ok=True)
+            entries = {}
+            with os.scandir(self.folder) as it:
+                for entry in it:
+                    if entry.is_file() and entry.name.endswith('.webp'):
+                        st = entry.stat()
+                        entries[entry.name] = (st.st_size, st.st_mtime)
+            self._entries = entries
+        return self._entries
+
+    def get(self, key: str, load_source) -> str:
+        """
+        返回缩略图文件路径，不存在时在线程池中生成
+
+        Args:
+            key: 缓存键（同时用作ETag）
+            load_source: 返回 (原图字节, 宽度) 的函数，只在需要生成时调用
+        """
+        name = f'{key}.webp'
+        path = os.path.join(self.folder, name)
+        with self._lock:
+            entries = self._load_entries()
+            if name in entries and os.path.exists(path):
+                entries[name] = (entries[name][0], time.time())
+                self._stats['hits'] += 1
+                return path
+            future = self._pending.get(key)
+            if future is None:
+                self._stats['misses'] += 1
+                future = self._pool.submit(self._generate, name, path, load_source)
+                self._pending[key] = future
+        return future.result()
+
+    def _generate(self, name: str, path: str, load_source) -> str:
+        try:
+            data, width = load_source()
+            thumb = make_thumbnail(data, width)
+            tmp_path = f'{path}.{threading.get_ident()}.part'
+            with open(tmp_path, 'wb') as f:
+                f.write(thumb)
+            os.replace(tmp_path, path)
+            with self._lock:
+                self._entries[name] = (len(thumb), time.time())
+                self._evict(keep=name)
+            return path
+        finally:
+            with self._lock:
+                self._pending.pop(name[:-len('.webp')], None)
+
+    def _evict(self, keep: str):
+        """总大小超过上限时删除最久未访问的缩略图，降到上限的90%；刚生成的 keep 不删除"""
+        total = sum(size for size, _ in self._entries.values())
+        if total <= self.max_bytes:
+            return
+        for name, (size, _) in sorted(self._entries.items(), key=lambda item: item[1][1]):
+            if total <= self.max_bytes * 0.9:
+                break
+            if name == keep:
+                continue
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except OSError:
+                pass
+            del self._entries[name]
+            total -= size
+            self._stats['evictions'] += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            entries = self._load_entries()
+            return {**self._stats, 'entries': len(entries), 'bytes': sum(size for size, _ in entries.values()),
+                    'max_bytes': self.max_bytes}
+
+
+thumbnail_cache = ThumbnailCache()
+metrics.Counter('thumbnail_cache_requests_total', '缩略图缓存的查询次数', ('result',),
+                fn=lambda: metrics.cache_results(thumbnail_cache.stats()))
+
+
+def _task_images(task_id: str) -> List[str]:
+    """任务的图片URL：先查历史索引，尚未归档的任务查任务记录"""
+    record = history_index.get(task_id)
+    if record:
+        return record['images']
+    record = task_store.find_by_task_id(task_id)
+    return record['images'] if record and record['images'] else []
+
+
+def _file_source(path: str, width: int):
+    def load():
+        with open(path, 'rb') as f:
+            return f.read(), width
+    return load
+
+
+def _upload_source(upload_id: str, width: int):
+    def load():
+        data = upload_store.read(upload_id)
+        if data is None:
+            raise FileNotFoundError('上传图片已释放')
+        return data, width
+    return load
+
+
+def _url_source(url: str, width: int):
+    def load():
+        with metrics.download_seconds.time(kind='thumbnail'):
+            response = http_client.get(url, timeout=30)
+            response.raise_for_status()
+        metrics.download_bytes.observe(len(response.content), kind='thumbnail')
+        return response.content, width
+    return load
+
+
+def _cache_key(source_id: str, width: int) -> str:
+    return hashlib.sha1(f'{source_id}|{width}|{THUMB_QUALITY}'.encode('utf-8')).hexdigest()
+
+
+def _send_thumbnail(key: str, load_source):
+    try:
+        path = thumbnail_cache.get(key, load_source)
+    except Exception as e:
+        logging.error(f'生成缩略图失败 {key}: {e}')
+        return jsonify({'success': False, 'error': f'生成缩略图失败: {e}'}), 502
+    return send_file(path, mimetype='image/webp', etag=key, conditional=True, max_age=THUMB_MAX_AGE)
+
+
+@thumb_bp.route('/thumb/<task_id>/<int:n>', methods=['GET'])
+def task_thumbnail(task_id, n):
+    """归档任务第n张（从0开始）图片的缩略图"""
+    task_id = secure_filename(task_id)
+    width = requested_width()
+    urls = _task_images(task_id)
+
+    local_path = None
+    if n < len(urls):
+        local_path = os.path.join(out_pic, task_id, image_filename(urls[n], n))
+    else:
+        # 索引中没有记录时按文件名顺序取文件夹中的图片
+        folder = os.path.join(out_pic, task_id)
+        if os.path.isdir(folder):
+            files = sorted(f for f in os.listdir(folder) if f.lower().endswith(IMAGE_EXTENSIONS))
+            if n < len(files):
+                local_path = os.path.join(folder, files[n])
+
+    if local_path is None:
+        return jsonify({'success': False, 'error': '图片不存在'}), 404
+    # 缓存键取归档文件的路径：归档前从URL生成与归档后从文件生成的是同一张图，只缓存一份；
+    # 归档文件原子写入、之后不再修改，路径即可确定内容
+    key = _cache_key(f'archive|{os.path.abspath(local_path)}', width)
+    if os.path.exists(local_path):
+        return _send_thumbnail(key, _file_source(local_path, width))
+    if n < len(urls):
+        # 归档尚未完成：直接从ModelScope下载原图生成缩略图
+        return _send_thumbnail(key, _url_source(urls[n], width))
+    return jsonify({'success': False, 'error': '图片不存在'}), 404
+
+
+@thumb_bp.route('/thumb/uploads/<filename>', methods=['GET'])
+def upload_thumbnail(filename):
+    """上传图片的缩略图：优先取内存中暂存的上传图片"""
+    width = requested_width()
+    if filename in upload_store:
+        # 上传ID本身唯一，可直接作为缓存键的来源
+        return _send_thumbnail(_cache_key(f'upload|{filename}', width), _upload_source(filename, width))
+    path = os.path.join(current_app.config['UPLOAD_FOLDER'], secure_filename(filename))
+    if not os.path.exists(path):
+        return jsonify({'success': False, 'error': '图片不存在'}), 404
+    st = os.stat(path)
+    return _send_thumbnail(_cache_key(f'{path}|{st.st_mtime_ns}|{st.st_size}', width), _file_source(path, width))
+
+
+@thumb_bp.route('/thumb/stats', methods=['GET'])
+def thumb_stats():
+    """缩略图缓存统计"""
+    return jsonify({'success': True, **thumbnail_cache.stats()})
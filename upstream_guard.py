@@ -0,0 +1,240 @@
+"""
+上游保护：按接口限速与熔断
+每个 ModelScope 接口（提交、状态查询）有一个令牌桶限制请求速率，令牌不足且需等待超过 max_wait 时直接本地失败；
+熔断器在连续 BREAKER_FAILURE_THRESHOLD 次失败（连接错误、超时、5xx、429）后打开，
+打开期间调用立即失败，BREAKER_OPEN_SECONDS 后进入半开状态放行少量试探请求，试探成功则关闭、失败则重新打开。
+被拒绝的调用抛出 requests.RequestException 的子类，轮询处按网络错误处理并退避；状态在 /health 的 upstream 中查看
+"""
+
+import time
+import asyncio
+import logging
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import requests
+
+import config
+import metrics
+
+# 各接口的限速：rate 每秒令牌数（0 表示不限），burst 桶容量，max_wait 令牌不足时最多等待的秒数
+UPSTREAM_LIMITS = getattr(config, 'UPSTREAM_LIMITS', {
+    'modelscope_submit': {'rate': 2, 'burst': 5, 'max_wait': 5},
+    'modelscope_status': {'rate': 20, 'burst': 40, 'max_wait': 0.5},
+})
+BREAKER_FAILURE_THRESHOLD = getattr(config, 'BREAKER_FAILURE_THRESHOLD', 5)   # 连续失败多少次后打开熔断
+BREAKER_OPEN_SECONDS = getattr(config, 'BREAKER_OPEN_SECONDS', 30)            # 打开后多久进入半开状态（秒）
+BREAKER_HALF_OPEN_CALLS = getattr(config, 'BREAKER_HALF_OPEN_CALLS', 1)       # 半开状态的试探请求数，全部成功后关闭
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+STATE_VALUES = {STATE_CLOSED: 0, STATE_HALF_OPEN: 1, STATE_OPEN: 2}
+
+
+class UpstreamRejected(requests.RequestException):
+    """调用未发出即被本地拒绝"""
+
+
+class CircuitOpen(UpstreamRejected):
+    """熔断器打开，上游暂时不可用"""
+
+
+class RateLimited(UpstreamRejected):
+    """令牌不足，需要等待的时间超过上限"""
+
+
+def is_failure_status(status_code: int) -> bool:
+    """计入熔断的HTTP状态：5xx 与 429；其余4xx是请求本身的问题，不算上游故障"""
+    return status_code >= 500 or status_code == 429
+
+
+class TokenBucket:
+    """令牌桶，令牌不足时预约未来的令牌，返回需要等待的时间"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait: float) -> Optional[float]:
+        """取一个令牌，返回需要等待的秒数；需要等待超过 max_wait 时不取，返回 None"""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = max(1 - self.tokens, 0) / self.rate
+            if wait > max_wait:
+                return None
+            self.tokens -= 1
+            return wait
+
+    def available(self) -> float:
+        with self._lock:
+            return min(self.burst, self.tokens + (time.monotonic() - self._updated) * self.rate)
+
+
+class CircuitBreaker:
+    """closed / open / half_open 三态熔断器"""
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 open_seconds: float = BREAKER_OPEN_SECONDS, half_open_calls: int = BREAKER_HALF_OPEN_CALLS):
+        self.name = name
+        self.failure_threshold = max(failure_threshold, 1)
+        self.open_seconds = open_seconds
+        self.half_open_calls = max(half_open_calls, 1)
+        self.state = STATE_CLOSED
+        self.failures = 0             # 连续失败次数
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._probes = 0              # 半开状态已放行、尚未返回的试探请求
+        self._probe_successes = 0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """是否放行一次调用；放行后必须调用 record() 或 cancel()"""
+        with self._lock:
+            if self.state == STATE_OPEN:
+                if time.monotonic() - self.opened_at < self.open_seconds:
+                    return False
+                self._transition(STATE_HALF_OPEN)
+            if self.state == STATE_HALF_OPEN:
+                if self._probes + self._probe_successes >= self.half_open_calls:
+                    return False
+                self._probes += 1
+            return True
+
+    def cancel(self):
+        """放行后调用未发出（如被限速），归还半开状态的试探名额"""
+        with self._lock:
+            if self.state == STATE_HALF_OPEN and self._probes:
+                self._probes -= 1
+
+    def record(self, success: bool):
+        with self._lock:
+            if self.state == STATE_HALF_OPEN:
+                self._probes = max(self._probes - 1, 0)
+                if not success:
+                    self._transition(STATE_OPEN)
+                    return
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_calls:
+                    self._transition(STATE_CLOSED)
+                return
+            if success:
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.state == STATE_CLOSED and self.failures >= self.failure_threshold:
+                self._transition(STATE_OPEN)
+
+    def _transition(self, state: str):
+        previous, self.state = self.state, state
+        self._probes = 0
+        self._probe_successes = 0
+        if state == STATE_OPEN:
+            self.opened_at = time.monotonic()
+            self.times_opened += 1
+            logging.warning(f'上游 {self.name} 熔断打开（{previous} -> open），{self.open_seconds}秒内的调用直接失败')
+        elif state == STATE_CLOSED:
+            self.failures = 0
+            logging.info(f'上游 {self.name} 熔断关闭，恢复正常调用')
+
+    def open_remaining(self) -> float:
+        with self._lock:
+            if self.state != STATE_OPEN:
+                return 0.0
+            return max(self.open_seconds - (time.monotonic() - self.opened_at), 0.0)
+
+
+class UpstreamGuard:
+    """一个上游接口的限速器与熔断器"""
+
+    def __init__(self, name: str, rate: float = 0, burst: float = 1, max_wait: float = 0):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.max_wait = max_wait
+        self.breaker = CircuitBreaker(name)
+        self._rejected = {'circuit_open': 0, 'rate_limited': 0}
+
+    def _admit(self) -> float:
+        """检查熔断与令牌，返回调用前需要等待的秒数；被拒绝时抛出 UpstreamRejected"""
+        if not self.breaker.allow():
+            self._reject('circuit_open')
+            raise CircuitOpen(f'上游 {self.name} 暂时不可用（熔断中，{self.breaker.open_remaining():.1f}秒后重试）')
+        wait = self.bucket.reserve(self.max_wait)
+        if wait is None:
+            self.breaker.cancel()
+            self._reject('rate_limited')
+            raise RateLimited(f'上游 {self.name} 请求过于频繁，已本地限速')
+        return wait
+
+    def _reject(self, reason: str):
+        self._rejected[reason] += 1
+        rejected_total.inc(endpoint=self.name, reason=reason)
+
+    def record_response(self, response) -> Any:
+        self.breaker.record(not is_failure_status(response.status_code))
+        return response
+
+    def call(self, fn: Callable[[], Any]) -> Any:
+        """在限速与熔断保护下调用 fn（返回带 status_code 的响应）"""
+        wait = self._admit()
+        if wait:
+            time.sleep(wait)
+        try:
+            response = fn()
+        except Exception:
+            self.breaker.record(False)
+            raise
+        return self.record_response(response)
+
+    async def call_async(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """call 的异步版本，等待令牌时不阻塞事件循环"""
+        wait = self._admit()
+        if wait:
+            await asyncio.sleep(wait)
+        try:
+            response = await fn()
+        except Exception:
+            self.breaker.record(False)
+            raise
+        return self.record_response(response)
+
+    def stats(self) -> Dict[str, Any]:
+        breaker = self.breaker
+        return {
+            'state': breaker.state,
+            'consecutive_failures': breaker.failures,
+            'times_opened': breaker.times_opened,
+            'open_remaining': round(breaker.open_remaining(), 1),
+            'tokens': round(self.bucket.available(), 2) if self.bucket.rate > 0 else None,
+            'rejected': dict(self._rejected),
+        }
+
+
+rejected_total = metrics.Counter('upstream_rejected_total', '被本地限速或熔断拒绝的上游调用', ('endpoint', 'reason'))
+
+_guards: Dict[str, UpstreamGuard] = {}
+
+
+def get_guard(name: str) -> UpstreamGuard:
+    """按接口名取得共享的保护器，限速参数来自 UPSTREAM_LIMITS"""
+    guard = _guards.get(name)
+    if guard is None:
+        guard = _guards[name] = UpstreamGuard(name, **UPSTREAM_LIMITS.get(name, {}))
+    return guard
+
+
+def stats() -> Dict[str, Dict[str, Any]]:
+    return {name: guard.stats() for name, guard in _guards.items()}
+
+
+submit_guard = get_guard('modelscope_submit')
+status_guard = get_guard('modelscope_status')
+metrics.Gauge('upstream_circuit_state', '上游熔断器状态（0 关闭，1 半开，2 打开）', ('endpoint',),
+              fn=lambda: {(name,): STATE_VALUES[guard.breaker.state] for name, guard in _guards.items()})
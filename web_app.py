@@ -3,16 +3,31 @@
 
 import os
 import logging
-from flask import Flask, send_from_directory, request, make_response
+import argparse
+import mimetypes
+from flask import Flask, Response, send_from_directory, request, make_response
 from flask_cors import CORS
 from config import UPLOAD_FOLDER, MAX_CONTENT_LENGTH, OPENAI_API_KEY
 from routes import main_bp
 
 
 from task_poller import task_poller_bp
+from jobs import jobs_bp, job_manager
+from archiver import archive_bp
+from batch import batch_bp
+from history_index import history_bp
+from thumbnailer import thumb_bp
+from image_buffer import upload_store
+from log_setup import setup_logging
+
+def create_app(resume_jobs=True):
+    """
+    创建并配置Flask应用
+    resume_jobs: 是否恢复重启前未完成的生图任务（debug 重载器的监控进程不应恢复，避免重复轮询）
+    """
+    # 日志先于其他组件配置，后续恢复任务等输出都经过日志队列
+    setup_logging()
 
-def create_app():
-    """创建并配置Flask应用"""
     app = Flask(__name__)
     CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
     app.secret_key = 'a_very_secret_key'  # 使用一个固定的密钥
@@ -39,9 +54,26 @@ def create_app():
 
     app.register_blueprint(task_poller_bp)
 
-    # 添加uploads目录的静态文件服务
+    app.register_blueprint(jobs_bp)
+
+    app.register_blueprint(archive_bp)
+
+    app.register_blueprint(batch_bp)
+
+    app.register_blueprint(history_bp)
+
+    app.register_blueprint(thumb_bp)
+
+    if resume_jobs:
+        job_manager.resume()
+
+    # 上传图片预览：优先取内存中暂存的上传图片，其次是uploads目录中的文件
     @app.route('/uploads/<filename>')
     def uploaded_file(filename):
+        data = upload_store.read(filename)
+        if data is not None:
+            mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            return Response(data, mimetype=mimetype, headers={'Cache-Control': 'no-store'})
         return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
 
     # 添加comfyui模型配置文件的静态服务
@@ -55,7 +87,29 @@ def create_app():
 
 
 
-if __name__ == '__main__':
+def main():
+    parser = argparse.ArgumentParser(description='图片反推+魔搭生图服务')
+    parser.add_argument('--server', choices=('dev', 'asgi'), default='dev',
+                        help='dev: Flask 调试服务器（默认）；asgi: uvicorn 运行 asgi_app，需安装 requirements-asgi.txt')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8005)
+    parser.add_argument('--workers', type=int, default=1,
+                        help='asgi 模式的进程数，目前只支持 1：上传暂存、任务表、账号占用与限速状态都在进程内')
+    args = parser.parse_args()
+
+    if args.server == 'dev':
+        # debug 模式下只有重载器启动的子进程（WERKZEUG_RUN_MAIN=true）实际处理请求
+        app = create_app(resume_jobs=os.environ.get('WERKZEUG_RUN_MAIN') == 'true')
+        app.run(host=args.host, port=args.port, debug=True)
+        return
+
+    if args.workers != 1:
+        # 上传暂存、生图任务表、合并中的请求、账号占用与隔离、令牌桶都只存在于单个进程中，
+        # 多进程时 /upload 与 /analyze、/api/generate_image 与 /api/jobs 可能落到不同进程，限速与隔离也会按进程数放大
+        parser.error('--workers 目前只支持 1：上传、任务与账号状态保存在进程内，不能在多个进程间共享')
 
-    app = create_app()
-    app.run(host='0.0.0.0', port=8005, debug=True)
+    import uvicorn
+    uvicorn.run('asgi_app:create_async_app', factory=True, host=args.host, port=args.port)
+
+if __name__ == '__main__':
+    main()